@@ -0,0 +1,116 @@
+"""
+layout.py
+
+Usage:
+  python -m benchmarks.layout [--channels=<n>] [--seconds=<s>] [--sfreq=<hz>]
+                              [--window=<s>] [--repeat=<n>]
+
+Benchmark of the storage layouts available to the MNE converter.  Writes the
+same synthetic recording with mne2nix.write_raw_mne() using different
+compression and chunking policies and reports for each
+
+- the size of the resulting file
+- the write throughput
+- the read latency for one channel over the whole recording
+- the read latency for all channels over one time window
+
+Latencies are the median of several reads at random positions.
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+import numpy as np
+import nixio as nix
+import mne
+
+from nixworks.converters.layout import Layout
+from nixworks.converters.mne import mne2nix
+
+
+LAYOUTS = [
+    ("none/auto", Layout(compression=False, access=None)),
+    ("none/channel", Layout(compression=False, access="channel")),
+    ("none/time", Layout(compression=False, access="time")),
+    ("deflate6/auto", Layout(level=6, access=None)),
+    ("deflate1/channel", Layout(level=1, access="channel")),
+    ("deflate1/time", Layout(level=1, access="time")),
+    ("deflate6/channel", Layout(level=6, access="channel")),
+    ("deflate6/time", Layout(level=6, access="time")),
+]
+
+
+def parse_args(args):
+    opts = {"channels": 64, "seconds": 600., "sfreq": 1000., "window": 1.,
+            "repeat": 10}
+    for arg in args:
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        if key in opts:
+            opts[key] = type(opts[key])(value)
+    return opts
+
+
+def make_raw(nchan, nsamples, sfreq):
+    info = mne.create_info([f"EEG{idx:03}" for idx in range(nchan)], sfreq,
+                           "eeg")
+    time = np.arange(nsamples) / sfreq
+    data = np.random.randn(nchan, nsamples) * 1e-6
+    data += np.sin(2 * np.pi * 10 * time) * 1e-5
+    return mne.io.RawArray(data, info, verbose=False)
+
+
+def read_latencies(nfname, nwindow, repeat):
+    nf = nix.File(nfname, nix.FileMode.ReadOnly)
+    da = nf.blocks[0].groups[mne2nix.RAW_DATA_GROUP_NAME].data_arrays[0]
+    nchan, nsamples = da.shape
+    rng = np.random.default_rng(42)
+
+    channel = list()
+    for chidx in rng.integers(0, nchan, repeat):
+        t0 = time.perf_counter()
+        da[chidx, :]
+        channel.append(time.perf_counter() - t0)
+
+    window = list()
+    for start in rng.integers(0, nsamples - nwindow, repeat):
+        t0 = time.perf_counter()
+        da[:, start:start+nwindow]
+        window.append(time.perf_counter() - t0)
+
+    nf.close()
+    return np.median(channel), np.median(window)
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    nsamples = int(opts["seconds"] * opts["sfreq"])
+    nwindow = int(opts["window"] * opts["sfreq"])
+    raw = make_raw(opts["channels"], nsamples, opts["sfreq"])
+    nbytes = raw.get_data().nbytes
+
+    print(f"{opts['channels']} channels, {nsamples} samples "
+          f"({nbytes / 2**20:.1f} MiB)")
+    header = (f"{'layout':<18} {'size MiB':>9} {'write MiB/s':>12} "
+              f"{'1 chan ms':>10} {'1 window ms':>12}")
+    print(header)
+    print("-" * len(header))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, layout in LAYOUTS:
+            nfname = os.path.join(tmpdir, name.replace("/", "-") + ".nix")
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(None):
+                mne2nix.write_raw_mne(nfname, raw, layout=layout)
+            wtime = time.perf_counter() - t0
+            size = os.path.getsize(nfname)
+            chanlat, winlat = read_latencies(nfname, nwindow, opts["repeat"])
+            print(f"{name:<18} {size / 2**20:>9.1f} "
+                  f"{nbytes / 2**20 / wtime:>12.1f} "
+                  f"{chanlat * 1e3:>10.2f} {winlat * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+passthrough.py
+
+Usage:
+  python -m benchmarks.passthrough [--channels=<n>] [--seconds=<s>]
+                                   [--sfreq=<hz>] [--deflate=<level>]
+
+Benchmark of the raw chunk passthrough of nwb2nix.  Writes a gzip-compressed
+ElectricalSeries to an NWB file and converts it to NIX twice:
+
+- 'source' layout: the NIX DataArray takes over chunking and compression of
+  the NWB dataset and the compressed chunks are copied as they are
+- 'time' layout with the same deflate level: every chunk is decompressed and
+  compressed again
+
+and reports the conversion time of both and the speedup.
+"""
+import os
+import sys
+import time
+import datetime
+import tempfile
+from pathlib import Path
+from contextlib import redirect_stdout, redirect_stderr
+
+import numpy as np
+import pynwb as nwb
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+
+from nixworks.converters.layout import Layout
+from nixworks.converters.nwb import nwb2nix
+
+
+def parse_args(args):
+    opts = {"channels": 64, "seconds": 300., "sfreq": 30000., "deflate": 4}
+    for arg in args:
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        if key in opts:
+            opts[key] = type(opts[key])(value)
+    return opts
+
+
+def write_electrical_series(nwbpath, nchan, nsamples, sfreq, level):
+    start = datetime.datetime.now(datetime.timezone.utc)
+    nwbfile = nwb.NWBFile(session_description="passthrough benchmark",
+                          identifier="benchmark", session_start_time=start)
+    device = nwbfile.create_device(name="probe")
+    group = nwbfile.create_electrode_group(name="shank", description="shank",
+                                           location="unknown", device=device)
+    for _ in range(nchan):
+        nwbfile.add_electrode(group=group, location="unknown")
+    region = nwbfile.create_electrode_table_region(list(range(nchan)),
+                                                   "all electrodes")
+
+    # band limited noise compresses roughly like real extracellular data
+    data = np.random.randn(nsamples, nchan).cumsum(axis=0)
+    data -= np.convolve(data[:, 0], np.ones(64) / 64, mode="same")[:, None]
+    data = (data * 10).astype(np.int16)
+    dataio = H5DataIO(data, compression="gzip", compression_opts=level,
+                      chunks=(min(16384, nsamples), nchan))
+    nwbfile.add_acquisition(nwb.ecephys.ElectricalSeries(
+        name="ElectricalSeries", data=dataio, electrodes=region, rate=sfreq))
+    with nwb.NWBHDF5IO(str(nwbpath), "w") as io:
+        io.write(nwbfile)
+    return data.nbytes
+
+
+def convert(nwbpath, nixpath, layout):
+    t0 = time.perf_counter()
+    with redirect_stdout(None), redirect_stderr(None):
+        nwb2nix.convert_file(nwbpath, nixpath, layout)
+    return time.perf_counter() - t0
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    nsamples = int(opts["seconds"] * opts["sfreq"])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        nwbpath = Path(tmpdir) / "electrical.nwb"
+        nbytes = write_electrical_series(nwbpath, opts["channels"], nsamples,
+                                         opts["sfreq"], opts["deflate"])
+        print(f"ElectricalSeries: {opts['channels']} channels, "
+              f"{nsamples} samples, {nbytes / 2**20:.1f} MiB raw, "
+              f"{os.path.getsize(nwbpath) / 2**20:.1f} MiB gzip-"
+              f"{opts['deflate']}")
+
+        nixpath = Path(tmpdir) / "electrical.nix"
+        recompress = convert(nwbpath, nixpath,
+                             Layout(level=opts["deflate"], access="time"))
+        passthrough = convert(nwbpath, nixpath, Layout(access="source"))
+
+    print(f"{'recompress':<12} {recompress:8.2f} s "
+          f"{nbytes / 2**20 / recompress:8.1f} MiB/s")
+    print(f"{'passthrough':<12} {passthrough:8.2f} s "
+          f"{nbytes / 2**20 / passthrough:8.1f} MiB/s")
+    print(f"speedup: {recompress / passthrough:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
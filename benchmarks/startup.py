@@ -0,0 +1,90 @@
+"""
+startup.py
+
+Usage:
+  python -m benchmarks.startup [--repeat=<n>] [--max=<seconds>]
+
+Startup time of the nixworks command line interface.  Every command is run
+'repeat' times in a fresh interpreter with '-X importtime'.  The benchmark
+reports the median wall time and which heavy dependencies (pynwb, mne,
+matplotlib, IPython, ipywidgets) each command imported.
+
+Commands that don't convert anything (version, help, bare import) should not
+load any of them.  The direct 'python -m nixworks.converters.nwb.nwb2nix' run
+is listed for comparison, since it imports its converter module up front.
+With '--max', the benchmark exits with an error if one of the nixworks
+commands takes longer than the given number of seconds.
+"""
+import sys
+import time
+import statistics
+import subprocess
+
+
+HEAVY_MODULES = ("pynwb", "mne", "matplotlib", "IPython", "ipywidgets")
+
+# name, interpreter arguments, checked against --max
+COMMANDS = [
+    ("import nixworks", ["-c", "import nixworks"], True),
+    ("nixworks --version", ["-m", "nixworks", "--version"], True),
+    ("nixworks nwb2nix --version", ["-m", "nixworks", "nwb2nix", "--version"],
+     True),
+    ("nixworks nix2nwb --help", ["-m", "nixworks", "nix2nwb", "--help"], True),
+    ("nwb2nix module --version",
+     ["-m", "nixworks.converters.nwb.nwb2nix", "--version"], False),
+]
+
+
+def parse_args(args):
+    opts = {"repeat": 5, "max": 0.}
+    for arg in args:
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        if key in opts:
+            opts[key] = type(opts[key])(value)
+    return opts
+
+
+def imported_modules(importtime):
+    """
+    Names of the top-level packages in the output of 'python -X importtime'.
+    """
+    modules = set()
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        name = line.rsplit("|", 1)[1].strip()
+        modules.add(name.split(".")[0])
+    return modules
+
+
+def run(arguments, repeat):
+    times = []
+    modules = set()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime"] + arguments,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+        times.append(time.perf_counter() - t0)
+        modules = imported_modules(proc.stderr)
+    return statistics.median(times), sorted(modules & set(HEAVY_MODULES))
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    slow = []
+    for name, arguments, checked in COMMANDS:
+        seconds, heavy = run(arguments, opts["repeat"])
+        print(f"{name:<28} {seconds:7.3f} s  "
+              f"heavy imports: {', '.join(heavy) or '-'}")
+        if checked and opts["max"] and seconds > opts["max"]:
+            slow.append(name)
+    if slow:
+        print(f"slower than {opts['max']} s: {', '.join(slow)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+suite.py
+
+Usage:
+  python -m benchmarks.suite [--size=<size>] [--channels=<n>]
+                             [--deflate=<level>] [--rows=<n>]
+                             [--window=<samples>] [--windows=<n>]
+                             [--cases=<case,...>] [--output=<dir>]
+                             [--label=<name>] [--compare=<results.json>]
+                             [--threshold=<fraction>]
+
+Benchmark suite over synthetic datasets built with the generator in
+nixworks/test/create_testfile.py.  A recording of 'size' bytes (e.g. 64MB or
+20GB) is written as a 1d sampled array and a 2d sampled-set array with
+'channels' channels ('deflate' < 0 stores it uncompressed), and the cases
+below run on it:
+
+  generate   writing the dataset
+  table      round trip of a DataFrame with 'rows' rows through
+             nixworks.table (pandas -> NIX -> pandas)
+  plotter    LinePlotter window reads: 'windows' slider moves to random
+             positions with windows of 'window' samples (Agg backend)
+  nix2nwb    exporting the recording to NWB
+  nwb2nix    converting that NWB file back to NIX
+  mne2nix    writing the 2d array as MNE Raw to NIX (the Raw is held in
+             memory, as mne.io.RawArray requires)
+  nix2mne    reading the mne2nix output back with nix2mne.import_nix()
+
+Every case runs in a fresh interpreter, which reports its wall time,
+throughput and peak resident memory.  The results are stored as JSON in
+'<output>/<label>.json' (default: benchmarks/results/nixworks-<version>.json)
+together with the options and library versions.  With '--compare', the
+results are compared with an earlier results file: every time or memory
+value that grew by more than 'threshold' (default: 0.1, i.e. 10%) is
+reported as a regression and the benchmark exits with an error.
+"""
+import sys
+import json
+import time
+import platform
+import resource
+import datetime
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from contextlib import redirect_stdout, redirect_stderr
+
+import numpy as np
+import nixio as nix
+
+from nixworks import cli
+from nixworks.converters.layout import Layout
+from nixworks.test.create_testfile import (create_1d_sampled,
+                                           create_2d_sampled_set, parse_size)
+
+
+CASES = ("generate", "table", "plotter", "nix2nwb", "nwb2nix", "mne2nix",
+         "nix2mne")
+
+# metrics where larger values are worse; checked by --compare
+COST_METRICS = ("seconds", "write_seconds", "read_seconds", "median_ms_1d",
+                "median_ms_2d", "peak_mib")
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def parse_args(args):
+    opts = {"size": "64MB", "channels": 16, "deflate": 1, "rows": 100000,
+            "window": 100000, "windows": 20, "cases": ",".join(CASES),
+            "output": str(RESULTS_DIR), "label": "", "compare": "",
+            "threshold": 0.1, "run-case": "", "workdir": ""}
+    for arg in args:
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        if key in opts:
+            opts[key] = type(opts[key])(value)
+    return opts
+
+
+def layout(opts):
+    if opts["deflate"] < 0:
+        return Layout(compression=False, access="time")
+    return Layout(level=opts["deflate"], access="time")
+
+
+def dataset_bytes(opts):
+    return parse_size(opts["size"])
+
+
+def data_path(workdir):
+    return Path(workdir) / "data.nix"
+
+
+def case_generate(opts, workdir):
+    """
+    Write the recording with the create_testfile generator.  The block has
+    relacs style metadata, so that nix2nwb can export it.
+    """
+    nbytes = dataset_bytes(opts)
+    samples = max(nbytes // (8 * (opts["channels"] + 1)), 1)
+    t0 = time.perf_counter()
+    nf = nix.File.open(str(data_path(workdir)), nix.FileMode.Overwrite)
+    block = nf.create_block("recording", "benchmark")
+    section = nf.create_section("recording", "benchmark")
+    recording = section.create_section("Recording", "Recording")
+    recording["Name"] = "recording"
+    recording["Date"] = "2020-01-01"
+    recording["Time"] = "12:00:00"
+    block.metadata = section
+    create_1d_sampled(block, samples, layout(opts), seed=42)
+    create_2d_sampled_set(block, samples, opts["channels"], layout(opts),
+                          seed=42)
+    nf.close()
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds, "mib_per_s": nbytes / 2**20 / seconds}
+
+
+def case_table(opts, workdir):
+    import pandas as pd
+    from nixworks.table.table import create_from_pandas, write_to_pandas
+
+    rows = opts["rows"]
+    rng = np.random.default_rng(42)
+    frame = pd.DataFrame({"id": np.arange(rows),
+                          "value": rng.standard_normal(rows),
+                          "label": pd.Series([f"row{i % 100}"
+                                              for i in range(rows)],
+                                             dtype=object)})
+    nf = nix.File.open(str(Path(workdir) / "table.nix"),
+                       nix.FileMode.Overwrite)
+    block = nf.create_block("table", "benchmark")
+    t0 = time.perf_counter()
+    df = create_from_pandas(block, frame, "frame")
+    t1 = time.perf_counter()
+    result = write_to_pandas(df)
+    t2 = time.perf_counter()
+    nf.close()
+    if len(result) != rows:
+        raise RuntimeError(f"Round trip returned {len(result)} rows")
+    return {"write_seconds": t1 - t0, "read_seconds": t2 - t1,
+            "rows_per_s": rows / (t2 - t0)}
+
+
+def case_plotter(opts, workdir):
+    import matplotlib
+    matplotlib.use("Agg")
+    from nixworks.plotter.plotter import LinePlotter
+
+    rng = np.random.default_rng(42)
+    nf = nix.File.open(str(data_path(workdir)), nix.FileMode.ReadOnly)
+    results = dict()
+    for key, name in (("1d", "long 1d data"), ("2d", "2d sampled-set")):
+        plotter = LinePlotter(nf.blocks[0].data_arrays[name])
+        plotter.plot(maxpoints=opts["window"])
+        latencies = []
+        for val in rng.uniform(plotter.slider.valmin, plotter.slider.valmax,
+                               opts["windows"]):
+            t0 = time.perf_counter()
+            plotter.slider.set_val(val)
+            latencies.append(time.perf_counter() - t0)
+        results[f"median_ms_{key}"] = statistics.median(latencies) * 1000
+    nf.close()
+    return results
+
+
+def case_nix2nwb(opts, workdir):
+    from nixworks.converters.nwb import nix2nwb
+
+    nf = nix.File.open(str(data_path(workdir)), nix.FileMode.ReadOnly)
+    t0 = time.perf_counter()
+    nix2nwb.convert_block(nf.blocks[0], Path(workdir) / "data.nwb",
+                          layout(opts))
+    seconds = time.perf_counter() - t0
+    nf.close()
+    return {"seconds": seconds,
+            "mib_per_s": dataset_bytes(opts) / 2**20 / seconds}
+
+
+def case_nwb2nix(opts, workdir):
+    from nixworks.converters.nwb import nwb2nix
+
+    nwbpath = Path(workdir) / "data.nwb"
+    if not nwbpath.exists():
+        case_nix2nwb(opts, workdir)
+    t0 = time.perf_counter()
+    nwb2nix.convert_file(nwbpath, Path(workdir) / "converted.nix",
+                         Layout(access="source"))
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds,
+            "mib_per_s": dataset_bytes(opts) / 2**20 / seconds}
+
+
+def case_mne2nix(opts, workdir):
+    import mne
+    from nixworks.converters.mne import mne2nix
+
+    nf = nix.File.open(str(data_path(workdir)), nix.FileMode.ReadOnly)
+    da = nf.blocks[0].data_arrays["2d sampled-set"]
+    data = da[:].T * 1e-3
+    nf.close()
+    info = mne.create_info([f"EEG{idx:03}" for idx in range(len(data))],
+                           1000., "eeg")
+    raw = mne.io.RawArray(data, info, verbose=False)
+    t0 = time.perf_counter()
+    mne2nix.write_raw_mne(str(Path(workdir) / "raw.nix"), raw,
+                          layout=layout(opts))
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds, "mib_per_s": data.nbytes / 2**20 / seconds}
+
+
+def case_nix2mne(opts, workdir):
+    from nixworks.converters.mne import nix2mne
+
+    nixpath = Path(workdir) / "raw.nix"
+    if not nixpath.exists():
+        case_mne2nix(opts, workdir)
+    t0 = time.perf_counter()
+    raw = nix2mne.import_nix(str(nixpath))
+    data = raw.get_data()
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds, "mib_per_s": data.nbytes / 2**20 / seconds}
+
+
+def run_case(opts):
+    """
+    Run one case in this interpreter and print its results as JSON.
+    """
+    case = globals()[f"case_{opts['run-case']}"]
+    with redirect_stdout(None), redirect_stderr(None):
+        results = case(opts, opts["workdir"])
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_mib"] = maxrss * scale / 2**20
+    print("RESULT " + json.dumps(results))
+
+
+def spawn_case(case, args, workdir):
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.suite"] + args +
+                          [f"--run-case={case}", f"--workdir={workdir}"],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Case '{case}' failed:\n{proc.stderr}")
+
+
+def environment():
+    return {"nixworks": cli.package_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{name: cli.dependency_version(name)
+               for name in ("nixio", "h5py", "numpy", "pynwb", "mne")}}
+
+
+def compare(results, previous, threshold):
+    """
+    Print the change of every cost metric against 'previous' and return the
+    list of regressions.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = previous.get(case, {}).get(metric)
+            if metric not in COST_METRICS or not old:
+                continue
+            change = value / old - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{case}.{metric}")
+            print(f"{case + '.' + metric:<28} {old:10.3f} -> {value:10.3f} "
+                  f"({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    if opts["run-case"]:
+        run_case(opts)
+        return
+
+    # options passed on to the cases
+    args = [f"--{key}={opts[key]}"
+            for key in ("size", "channels", "deflate", "rows", "window",
+                        "windows")]
+    cases = [case for case in opts["cases"].split(",") if case]
+    for case in cases:
+        if case not in CASES:
+            sys.exit(f"Unknown case '{case}'. Valid cases are {CASES}")
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as workdir:
+        # every case but 'table' needs the dataset
+        if "generate" not in cases:
+            spawn_case("generate", args, workdir)
+        for case in cases:
+            results[case] = spawn_case(case, args, workdir)
+            values = "  ".join(f"{key}={value:.3f}"
+                               for key, value in results[case].items())
+            print(f"{case:<10} {values}")
+
+    label = opts["label"] or f"nixworks-{cli.package_version()}"
+    output = Path(opts["output"])
+    output.mkdir(parents=True, exist_ok=True)
+    record = {"label": label,
+              "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "environment": environment(),
+              "options": {key: opts[key] for key in
+                          ("size", "channels", "deflate", "rows", "window",
+                           "windows")},
+              "results": results}
+    with open(output / f"{label}.json", "w") as resultfile:
+        json.dump(record, resultfile, indent=2)
+    print(f"Results written to {output / (label + '.json')}")
+
+    if opts["compare"]:
+        with open(opts["compare"]) as prevfile:
+            previous = json.load(prevfile)
+        if previous["options"] != record["options"]:
+            print("Warning: the compared results used different options")
+        regressions = compare(results, previous["results"],
+                              opts["threshold"])
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
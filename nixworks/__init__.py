@@ -1,4 +1,36 @@
-from .plotter import plotter, interactor
-from .table import table
+import importlib
+import sys
+import types
 
 __all__ = ["plotter", "interactor", "table"]
+
+# The plotting and table modules pull in matplotlib, IPython and ipywidgets.
+# They are imported on first access, so that the converters and the command
+# line interface don't pay for them.
+_LAZY_MODULES = {
+    "plotter": ".plotter.plotter",
+    "interactor": ".plotter.interactor",
+    "table": ".table.table",
+}
+
+
+def _lazy_module(name):
+    def load(package):
+        return importlib.import_module(_LAZY_MODULES[name], __name__)
+
+    def keep(package, value):
+        # importing the subpackages nixworks.plotter and nixworks.table binds
+        # them here; the names stay bound to the modules, as they were when
+        # they were imported eagerly
+        pass
+
+    return property(load, keep)
+
+
+class _Package(types.ModuleType):
+    pass
+
+
+for _name in _LAZY_MODULES:
+    setattr(_Package, _name, _lazy_module(_name))
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,49 @@
+"""
+arrays.py
+
+Helpers for the dimensions and the calibration of DataArrays shared by the
+converters, the analysis modules and the plotters.  They depend on nixio
+and NumPy only.
+"""
+import numpy as np
+import nixio as nix
+
+
+def time_dimension(data_array):
+    """Index of the sampled or (non alias) range dimension or None."""
+    for idx, dim in enumerate(data_array.dimensions):
+        if dim.dimension_type == nix.DimensionType.Sample:
+            return idx
+        if dim.dimension_type == nix.DimensionType.Range and \
+           not dim.is_alias:
+            return idx
+    return None
+
+
+def sampling_rate(interval, unit):
+    """
+    Sampling rate in Hz of a sampling interval in 'unit' (seconds if not
+    set), or None if the unit is not a time.  Units without an SI prefix
+    (e.g. 'min') are converted with quantities if it is installed.
+    """
+    unit = unit or "s"
+    if nix.util.units.scalable(unit, "s"):
+        return float(1 / (interval * nix.util.units.scaling(unit, "s")))
+    try:
+        import quantities as pq
+    except ImportError:
+        return None
+    try:
+        return float(1 / pq.Quantity(interval, unit).rescale(pq.s))
+    except (LookupError, ValueError):
+        return None
+
+
+def calibrate(values, data_array):
+    """Apply the polynomial calibration of a DataArray, as nixio does."""
+    coefficients = data_array.polynom_coefficients
+    origin = data_array.expansion_origin or 0.0
+    values = values - origin
+    if len(coefficients):
+        values = np.polynomial.polynomial.polyval(values, coefficients)
+    return values
@@ -0,0 +1,330 @@
+"""
+cli.py
+
+Usage:
+  nixworks [--version] [--profile=<file>] [--profile-format=<format>]
+           <command> [<args>...]
+
+Commands:
+  nwb2nix   Convert NWB files to NIX
+  nix2nwb   Convert a NIX file recorded with relacs to NWB
+  mne2nix   Convert an EDF or BrainVision file to NIX (see mne2nix.py)
+  nix2mne   Read a NIX file created with mne2nix into MNE (see nix2mne.py)
+  verify    Compare a converted file with its source (see verify.py)
+  stats     Compute and cache statistics of the DataArrays (see stats.py)
+  preprocess
+            Filter, reference and decimate a DataArray (see preprocess.py)
+  spectral  Spectrogram or Welch PSD of a DataArray (see spectral.py)
+  events    Detect threshold crossings or peaks in a DataArray (see events.py)
+
+Run 'nixworks <command> --help' for the arguments of a command.
+
+With '--profile', the HDF5 reads, bytes read, attribute accesses and wall
+time of every nixworks operation the command runs are recorded (see
+instrument.py) and written to the given file as a JSON summary ('json',
+default), Chrome trace events ('trace') or folded stacks for flame graphs
+('folded').  A summary table is printed to stderr.
+
+The command line interface parses arguments and answers '--version' and
+'--help' without importing pynwb, mne or matplotlib, which take seconds to
+load.  A converter module (and with it its dependencies) is only imported
+once a conversion actually runs.  'python -m nixworks' is equivalent to the
+'nixworks' command.
+"""
+import sys
+import json
+import argparse
+import importlib
+from pathlib import Path
+
+# importlib.metadata is new in Python 3.8
+try:
+    from importlib import metadata
+except ImportError:
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+
+
+def package_version():
+    with open(Path(__file__).parent / "info.json") as infofile:
+        return json.load(infofile)["VERSION"]
+
+
+def dependency_version(name):
+    """
+    Version of an installed distribution, read from its metadata without
+    importing it.
+    """
+    if metadata is None:
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            return "not installed"
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "not installed"
+
+
+def print_versions(*dependencies):
+    print(f"nixworks: {package_version()}")
+    for name in dependencies:
+        print(f"{name}: {dependency_version(name)}")
+
+
+def add_layout_arguments(parser, source):
+    parser.add_argument("--no-compression", action="store_true",
+                        default=False,
+                        help="store the converted data uncompressed")
+    parser.add_argument("--deflate", type=int, default=None,
+                        help="deflate (gzip) level 0-9 (default: 6)")
+    parser.add_argument("--chunking",
+                        choices=["source", "channel", "time", "auto"],
+                        default="source",
+                        help="access pattern the chunk shape is tuned for; "
+                             "'source' (default) keeps chunking and "
+                             f"compression of the {source} data and copies "
+                             "compressed chunks as they are; with "
+                             "--no-compression or --deflate only matching "
+                             "chunks are copied")
+
+
+def nwb2nix_parser(parser):
+    parser.add_argument("-v", "--version", action="store_true", default=False)
+    add_layout_arguments(parser, "NWB")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="reader threads prefetching and decoding data "
+                             "while one thread writes (default: 1)")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="worker processes when converting several files "
+                             "(default: number of CPUs)")
+    parser.add_argument("-o", "--output-dir", type=str, default=".",
+                        help="directory for the NIX files (default: .)")
+    parser.add_argument("--restart", action="store_true", default=False,
+                        help="start over instead of continuing an "
+                             "interrupted conversion (<output>.part)")
+    parser.add_argument("FILE", type=str, nargs="*")
+
+
+def nix2nwb_parser(parser):
+    parser.add_argument("-v", "--version", action="store_true", default=False)
+    add_layout_arguments(parser, "NIX")
+    parser.add_argument("FILE", type=str, nargs="?")
+
+
+def verify_parser(parser):
+    parser.add_argument("--hash", action="store_true", default=False,
+                        help="compare digests of the stored values (for "
+                             "bit-exact copies) instead of differences")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="largest accepted absolute difference "
+                             "(default: 0)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="reader threads (default: 1)")
+    parser.add_argument("--max-ranges", type=int, default=100,
+                        help="mismatching ranges reported per channel "
+                             "(default: 100)")
+    parser.add_argument("SOURCE", type=str)
+    parser.add_argument("TARGET", type=str)
+
+
+def stats_parser(parser):
+    parser.add_argument("-a", "--array", action="append", default=None,
+                        help="name of a DataArray (default: all numeric "
+                             "arrays); can be repeated")
+    parser.add_argument("--bins", type=int, default=64,
+                        help="histogram bins per channel (default: 64)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="reader threads (default: 1)")
+    parser.add_argument("--refresh", action="store_true", default=False,
+                        help="recompute cached statistics")
+    parser.add_argument("FILE", type=str)
+
+
+def preprocess_parser(parser):
+    parser.add_argument("-a", "--array", required=True,
+                        help="name of the sampled DataArray to process")
+    parser.add_argument("-o", "--output", default=None,
+                        help="name of the new DataArray (default: "
+                             "'<array> (preprocessed)')")
+    parser.add_argument("--reference", default=None,
+                        help="'average' for a common average reference or "
+                             "comma separated channel labels or indices")
+    parser.add_argument("--highpass", type=float, default=None,
+                        metavar="FREQ", help="high-pass cutoff in Hz")
+    parser.add_argument("--lowpass", type=float, default=None,
+                        metavar="FREQ", help="low-pass cutoff in Hz")
+    parser.add_argument("--bandpass", type=float, nargs=2, default=None,
+                        metavar="FREQ", help="band-pass cutoffs in Hz")
+    parser.add_argument("--notch", type=float, action="append",
+                        default=None, metavar="FREQ",
+                        help="notch filter frequency in Hz; can be repeated")
+    parser.add_argument("--fir", type=int, default=None, metavar="TAPS",
+                        help="use FIR filters with TAPS coefficients for "
+                             "the high-, low- and band-pass filters "
+                             "(default: 4th order Butterworth IIR)")
+    parser.add_argument("--decimate", type=int, action="append",
+                        default=None, metavar="FACTOR",
+                        help="decimate by FACTOR after filtering; can be "
+                             "repeated")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="threads the channels are split over "
+                             "(default: 1)")
+    parser.add_argument("FILE", type=str)
+
+
+def spectral_parser(parser):
+    parser.add_argument("-a", "--array", required=True,
+                        help="name of the sampled DataArray to analyse")
+    parser.add_argument("--welch", action="store_true", default=False,
+                        help="compute the Welch PSD instead of the "
+                             "spectrogram")
+    parser.add_argument("--channel", default=None,
+                        help="label or index of a single channel (default: "
+                             "all channels)")
+    parser.add_argument("--nperseg", type=int, default=256,
+                        help="samples per segment (default: 256)")
+    parser.add_argument("--noverlap", type=int, default=None,
+                        help="overlap of segments in samples (default: "
+                             "half a segment)")
+    parser.add_argument("--nfft", type=int, default=None,
+                        help="length of the FFT (default: nperseg)")
+    parser.add_argument("--window", default="hann",
+                        help="window function (default: hann)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="name of the new DataArray")
+    parser.add_argument("--restart", action="store_true", default=False,
+                        help="start over instead of continuing an "
+                             "interrupted computation")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="threads for the transforms (default: 1)")
+    parser.add_argument("FILE", type=str)
+
+
+def events_parser(parser):
+    parser.add_argument("-a", "--array", required=True,
+                        help="name of the sampled DataArray to search")
+    parser.add_argument("--threshold", type=float, required=True,
+                        help="threshold; negative values detect excursions "
+                             "below it")
+    parser.add_argument("--std", action="store_true", default=False,
+                        help="threshold in standard deviations from the "
+                             "mean of every channel")
+    parser.add_argument("--peak", action="store_true", default=False,
+                        help="time events at their peak instead of the "
+                             "threshold crossing")
+    parser.add_argument("--dead-time", type=float, default=0.0,
+                        help="minimum time between two events of a channel "
+                             "(default: 0)")
+    parser.add_argument("--multitag", action="store_true", default=False,
+                        help="write a MultiTag with extents instead of "
+                             "event DataArrays")
+    parser.add_argument("-o", "--output", default=None,
+                        help="name of the output (default: "
+                             "'<array> events')")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="threads the channels are split over "
+                             "(default: 1)")
+    parser.add_argument("FILE", type=str)
+
+
+def passthrough_parser(parser):
+    parser.add_argument("ARGS", nargs=argparse.REMAINDER)
+
+
+# command: (converter module, argument definitions, dependencies, help)
+COMMANDS = {
+    "nwb2nix": ("nixworks.converters.nwb.nwb2nix", nwb2nix_parser,
+                ("nixio", "pynwb"), "convert NWB files to NIX"),
+    "nix2nwb": ("nixworks.converters.nwb.nix2nwb", nix2nwb_parser,
+                ("nixio", "pynwb"),
+                "convert a NIX file recorded with relacs to NWB"),
+    "mne2nix": ("nixworks.converters.mne.mne2nix", passthrough_parser,
+                ("nixio", "mne"),
+                "convert an EDF or BrainVision file to NIX"),
+    "nix2mne": ("nixworks.converters.mne.nix2mne", passthrough_parser,
+                ("nixio", "mne"),
+                "read a NIX file created with mne2nix into MNE"),
+    "verify": ("nixworks.converters.verify", verify_parser,
+               ("nixio", "h5py"),
+               "compare a converted file with its source"),
+    "stats": ("nixworks.stats", stats_parser, ("nixio", "h5py"),
+              "compute and cache statistics of the DataArrays of a NIX "
+              "file"),
+    "preprocess": ("nixworks.preprocess", preprocess_parser,
+                   ("nixio", "scipy"),
+                   "filter, reference and decimate a DataArray of a NIX "
+                   "file"),
+    "spectral": ("nixworks.spectral", spectral_parser, ("nixio", "scipy"),
+                 "compute the spectrogram or Welch PSD of a DataArray of a "
+                 "NIX file"),
+    "events": ("nixworks.events", events_parser, ("nixio", "scipy"),
+               "detect threshold crossings or peaks in a DataArray of a NIX "
+               "file"),
+}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="nixworks")
+    parser.add_argument("--version", action="store_true", default=False)
+    parser.add_argument("--profile", type=str, default=None, metavar="FILE",
+                        help="record the HDF5 I/O of the command and write "
+                             "it to FILE")
+    parser.add_argument("--profile-format", default="json",
+                        choices=["json", "trace", "folded"],
+                        help="format of the --profile output (default: "
+                             "json)")
+    subparsers = parser.add_subparsers(dest="command")
+    for name, (_, add_arguments, _, helptext) in COMMANDS.items():
+        add_arguments(subparsers.add_parser(name, help=helptext,
+                                            description=helptext))
+    return parser
+
+
+def main(args=None):
+    parser = create_parser()
+    args = parser.parse_args(args)
+    if args.command is None:
+        if args.version:
+            print_versions("nixio", "pynwb", "mne")
+            return
+        parser.print_help()
+        sys.exit(1)
+
+    modname, _, dependencies, _ = COMMANDS[args.command]
+    if getattr(args, "version", False):
+        print_versions(*dependencies)
+        return
+
+    if args.command in ("nwb2nix", "nix2nwb") and not args.FILE:
+        parser.error(f"{args.command}: the FILE argument is required")
+
+    module = importlib.import_module(modname)
+    if not args.profile:
+        run_command(module, args)
+        return
+
+    from .instrument import Recorder
+    recorder = Recorder(f"nixworks {args.command}")
+    try:
+        with recorder:
+            run_command(module, args)
+    finally:
+        # also profile commands that failed
+        recorder.save(args.profile, args.profile_format)
+        recorder.print()
+
+
+def run_command(module, args):
+    if hasattr(args, "ARGS"):
+        # converters with their own argument handling
+        module.main([args.command] + args.ARGS)
+    else:
+        module.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+checkpoint.py
+
+Crash-safe, resumable conversions.
+
+A checkpointed conversion never writes to the requested output file
+directly.  It writes to '<output>.part' and, once everything is written,
+renames that file to the output path with 'os.replace()', so the output
+either does not exist or is complete.  The conversion runs in two phases:
+
+1. All objects (blocks, groups, metadata, DataArrays with their final shape)
+   are created and the small datasets written.  The arrays holding the bulk
+   data are only registered with 'Checkpoint.add()'.
+2. The registered arrays are written block by block, either copied from
+   datasets of an HDF5 source file ('Checkpoint.copy()') or filled from a
+   function reading the source ('Checkpoint.fill()', or 'fill_rows()' for
+   several arrays read together).  After a block is
+   written, the number of completed chunks of its array is stored in the
+   partial file.
+
+The progress lives in a section named 'nixworks.checkpoint' of the partial
+file itself:
+
+    nixworks.checkpoint
+      Source = fingerprint of the source file and conversion options
+      Prepared = True once phase 1 is complete
+      <DataArray name>
+        Source = path of the source dataset in the source file (HDF5 only)
+        Target = path of the target dataset in the NIX file
+        Axis = axis along which the array is written
+        Chunks = number of complete chunks along that axis
+
+When a conversion is started again and finds a partial file with a matching
+fingerprint after phase 1, it skips phase 1 and continues every copy from
+its last complete chunk.  A partial file that cannot be opened, has a
+different fingerprint or was interrupted during phase 1 is overwritten.
+The section is removed before the file is renamed.
+
+Progress is written (and the file flushed) at most once per 'interval'
+seconds and at the end of every array, so recorded chunks are always on
+disk.  HDF5 itself is not crash consistent: a crash in the middle of a
+write can leave the partial file unreadable, in which case the conversion
+starts over.
+
+If a conversion fails or is interrupted (e.g., with Ctrl-C), leaving the
+'with' block closes the partial file cleanly, so it can be resumed.
+
+Usage:
+
+    with Checkpoint.open(nixpath, fingerprint(srcpath, options)) as checkpoint:
+        if not checkpoint.prepared:
+            ...  # create the structure in checkpoint.nixfile
+            checkpoint.add(da.name, target_dataset, source_dataset)
+            checkpoint.prepare()
+        checkpoint.copy(h5py.File(srcpath, "r"))
+        checkpoint.finish()
+"""
+import os
+import time
+from pathlib import Path
+
+import nixio as nix
+
+from .streaming import DEFAULT_BUFFER_BYTES, Progress, copy_pipelined
+
+
+SECTION_NAME = "nixworks.checkpoint"
+SECTION_TYPE = "nixworks.checkpoint"
+PARTIAL_SUFFIX = ".part"
+
+
+def partial_path(path):
+    """
+    Path of the file a checkpointed conversion to 'path' writes to.
+    """
+    return Path(str(path) + PARTIAL_SUFFIX)
+
+
+def fingerprint(path, *options):
+    """
+    Identify a source file (by its absolute path, size and modification time)
+    and the conversion options, so that a partial file is only resumed for
+    the same input.
+    """
+    stat = os.stat(path)
+    parts = [str(Path(path).resolve()), str(stat.st_size),
+             str(stat.st_mtime_ns)]
+    return "|".join(parts + [repr(opt) for opt in options])
+
+
+def open_partial(path, fingerprint):
+    """
+    Open the partial file at 'path' for resuming.  Returns None if it does
+    not exist, cannot be opened, belongs to another source or was
+    interrupted before all objects were created.
+    """
+    if not path.exists():
+        return None
+    try:
+        nixfile = nix.File.open(str(path), nix.FileMode.ReadWrite)
+    except (OSError, RuntimeError, ValueError):
+        return None
+    section = nixfile.sections[SECTION_NAME] \
+        if SECTION_NAME in nixfile.sections else None
+    if (section is None or "Source" not in section.props
+            or section["Source"] != fingerprint
+            or "Prepared" not in section.props or not section["Prepared"]):
+        nixfile.close()
+        return None
+    return nixfile
+
+
+class Checkpoint:
+    """
+    Progress of a checkpointed conversion to 'path' (see module docstring).
+    Use 'Checkpoint.open()' to create one.
+    """
+
+    def __init__(self, path, nixfile, interval=1.0):
+        self.path = Path(path)
+        self.nixfile = nixfile
+        self.interval = interval
+        self._last = time.monotonic()
+
+    @classmethod
+    def open(cls, path, fingerprint, resume=True, interval=1.0):
+        """
+        Start or resume a conversion to 'path'.
+
+        :param path: Path of the finished NIX file.
+        :param fingerprint: Identification of the source and options (see
+        'fingerprint()').
+        :param resume: Continue from a matching partial file; if False, any
+        partial file is overwritten.
+        :param interval: Least time in seconds between progress updates.
+        """
+        partial = partial_path(path)
+        nixfile = open_partial(partial, fingerprint) if resume else None
+        if nixfile is None:
+            nixfile = nix.File.open(str(partial), nix.FileMode.Overwrite)
+            section = nixfile.create_section(SECTION_NAME, SECTION_TYPE)
+            section["Source"] = fingerprint
+        return cls(path, nixfile, interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.nixfile.is_open():
+            self.nixfile.close()
+
+    @property
+    def section(self):
+        return self.nixfile.sections[SECTION_NAME]
+
+    @property
+    def prepared(self):
+        """
+        True if the structure of the file was created in an earlier run.
+        """
+        section = self.section
+        return "Prepared" in section.props and bool(section["Prepared"])
+
+    def prepare(self):
+        """
+        Mark the structure of the file as complete (end of phase 1).
+        """
+        self.section["Prepared"] = True
+        self.nixfile.flush()
+
+    def add(self, name, target, source=None, axis=0):
+        """
+        Register the DataArray data 'target' (an h5py.Dataset in this file)
+        under the name 'name'.
+
+        :param source: h5py.Dataset to copy the data from with 'copy()';
+        None for arrays written with 'fill()'.
+        :param axis: Axis along which the data is written (the time axis).
+        Copies from HDF5 sources always run along the first axis.
+        """
+        sub = self.section.create_section(name, SECTION_TYPE + ".array")
+        if source is not None:
+            sub["Source"] = source.name
+        sub["Target"] = target.name
+        sub["Axis"] = axis
+        sub["Chunks"] = 0
+
+    def arrays(self):
+        """
+        Registered arrays as a list of (name, source path, target path, axis,
+        completed chunks) tuples.  The source path is None for arrays
+        written with 'fill()'.
+        """
+        return [(sub.name,
+                 sub["Source"] if "Source" in sub.props else None,
+                 sub["Target"], int(sub["Axis"]), int(sub["Chunks"]))
+                for sub in self.section.sections]
+
+    def commit(self, name, chunks, force=False):
+        """
+        Record 'chunks' complete chunks for the array 'name' (or every array
+        in a list of names).  The record (and the data written before it) is
+        flushed to disk if 'force' is set or 'interval' seconds passed since
+        the last flush.
+        """
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        for name in [name] if isinstance(name, str) else name:
+            self.section.sections[name]["Chunks"] = int(chunks)
+        self.nixfile.flush()
+        self._last = now
+
+    def copy(self, sourcefile, jobs=1, buffer_bytes=None):
+        """
+        Run (or continue) all registered copies from the open h5py.File
+        'sourcefile' with 'copy_pipelined()'.
+
+        :param jobs: Number of reader threads.
+        :param buffer_bytes: Memory budget for blocks in flight (default:
+        DEFAULT_BUFFER_BYTES).
+        """
+        if buffer_bytes is None:
+            buffer_bytes = DEFAULT_BUFFER_BYTES
+        h5file = self.nixfile._h5file
+        names, tasks, start, chunklens = [], [], [], []
+        for name, srcpath, tgtpath, _, chunks in self.arrays():
+            if srcpath is None:
+                continue
+            source = sourcefile[srcpath]
+            target = h5file[tgtpath]
+            chunklen = target.chunks[0] if target.chunks else 1
+            if source.shape:
+                first = min(chunks * chunklen, source.shape[0])
+                rows = source.shape[0] - first
+                remaining = source.size // max(source.shape[0], 1) * rows
+            else:
+                first, remaining = 0, 1
+            names.append(name)
+            tasks.append((source, target,
+                          Progress(name, remaining * source.dtype.itemsize)))
+            start.append(first)
+            chunklens.append(chunklen)
+
+        def committed(index, rows):
+            source = tasks[index][0]
+            total = source.shape[0] if source.shape else 0
+            done = rows >= total
+            chunks = -(-rows // chunklens[index]) if done \
+                else rows // chunklens[index]
+            self.commit(names[index], chunks, force=done)
+
+        copy_pipelined(tasks, max(jobs, 1), buffer_bytes, start=start,
+                       committed=committed)
+
+    def fill(self, name, read, buffer_bytes=None):
+        """
+        Write (or continue writing) the registered array 'name' block by
+        block from a function reading the source.
+
+        :param name: Name the array was registered with.
+        :param read: Callable 'read(start, stop)' returning the data of the
+        index range [start, stop) along the axis of the array.
+        :param buffer_bytes: Approximate size of a block in bytes (default:
+        DEFAULT_BUFFER_BYTES).
+        """
+        if buffer_bytes is None:
+            buffer_bytes = DEFAULT_BUFFER_BYTES
+        sub = self.section.sections[name]
+        target = self.nixfile._h5file[sub["Target"]]
+        axis = int(sub["Axis"])
+        length = target.shape[axis]
+        chunklen = target.chunks[axis] if target.chunks else 1
+        rowbytes = target.dtype.itemsize * target.size // max(length, 1)
+        step = max(buffer_bytes // max(rowbytes * chunklen, 1), 1) * chunklen
+        first = min(int(sub["Chunks"]) * chunklen, length)
+        progress = Progress(name, (length - first) * rowbytes)
+        selection = [slice(None)] * len(target.shape)
+        for start in range(first, length, step):
+            stop = min(start + step, length)
+            block = read(start, stop)
+            selection[axis] = slice(start, stop)
+            target[tuple(selection)] = block
+            progress.update(block.nbytes)
+            done = stop == length
+            self.commit(name, -(-stop // chunklen) if done
+                        else stop // chunklen, force=done)
+        progress.finish()
+
+    def fill_rows(self, names, read, buffer_bytes=None):
+        """
+        Like 'fill()' for several registered arrays of the same length along
+        their axis, read together: 'read(start, stop)' returns an array with
+        one row per name, written to the arrays in order.  Every block of
+        the source is read once for all arrays.
+        """
+        if buffer_bytes is None:
+            buffer_bytes = DEFAULT_BUFFER_BYTES
+        subs = [self.section.sections[name] for name in names]
+        targets = [self.nixfile._h5file[sub["Target"]] for sub in subs]
+        axis = int(subs[0]["Axis"])
+        length = targets[0].shape[axis]
+        chunklen = targets[0].chunks[axis] if targets[0].chunks else 1
+        rowbytes = sum(target.dtype.itemsize * target.size
+                       for target in targets) // max(length, 1)
+        step = max(buffer_bytes // max(rowbytes * chunklen, 1), 1) * chunklen
+        first = min(min(int(sub["Chunks"]) for sub in subs) * chunklen,
+                    length)
+        progress = Progress(", ".join(names), (length - first) * rowbytes)
+        selection = [slice(None)] * len(targets[0].shape)
+        for start in range(first, length, step):
+            stop = min(start + step, length)
+            block = read(start, stop)
+            selection[axis] = slice(start, stop)
+            for target, row in zip(targets, block):
+                target[tuple(selection)] = row
+            progress.update(block.nbytes)
+            done = stop == length
+            self.commit(names, -(-stop // chunklen) if done
+                        else stop // chunklen, force=done)
+        progress.finish()
+
+    def finish(self):
+        """
+        Remove the checkpoint section, close the partial file and move it to
+        its final path.
+        """
+        del self.nixfile.sections[SECTION_NAME]
+        self.nixfile.close()
+        os.replace(partial_path(self.path), self.path)
+        return self.path
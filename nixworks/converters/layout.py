@@ -0,0 +1,253 @@
+"""
+layout.py
+
+Storage layout policies for DataArrays written by the converters.
+
+NIX creates every DataArray with h5py's automatic chunk guess and, when
+compression is enabled, a fixed deflate level.  For long recordings this
+results in chunks that are neither aligned to channels nor to time windows,
+so both typical access patterns (one channel over the whole recording and
+all channels over a short window) touch many more chunks than necessary.
+
+A Layout describes how the data of an array should be stored:
+
+- compression on or off and the deflate level (0-9)
+- the byte-shuffle filter (helps deflate on integer and float samples)
+- the access pattern the chunk shape is tuned for:
+    "channel"  one chunk holds a long stretch of a single channel
+    "time"     one chunk holds a short window of all channels
+    "source"   use the chunk shape and filters of the source dataset when
+               converting from another HDF5 file, so that compressed chunks
+               can be copied as they are ("time" if there is no source)
+    None       leave the chunk shape to h5py (the NIX default)
+- the target chunk size in bytes
+- whether the "source" access pattern keeps the filters of the source
+  ('source_filters').  This is switched off when compression is chosen
+  explicitly: the source chunks are then only copied as they are if the
+  source filters match the layout, and decoded and re-encoded otherwise.
+
+Use 'Layout.create_data_array()' in place of 'Block.create_data_array()' to
+apply a policy.
+"""
+import dataclasses
+
+import h5py
+import numpy as np
+import nixio as nix
+
+from .streaming import filter_pipeline
+
+ACCESS_PATTERNS = ("channel", "time", "source")
+
+
+@dataclasses.dataclass
+class Layout:
+    compression: bool = True
+    level: int = 6
+    shuffle: bool = False
+    access: str = "time"
+    chunk_bytes: int = 256 * 1024
+    source_filters: bool = True
+
+    def __post_init__(self):
+        if self.access is not None and self.access not in ACCESS_PATTERNS:
+            raise ValueError(f"Unknown access pattern '{self.access}'. "
+                             f"Valid values are {ACCESS_PATTERNS} or None")
+        if not 0 <= self.level <= 9:
+            raise ValueError("Deflate level must be between 0 and 9")
+
+    @property
+    def block_compression(self):
+        """
+        The nix.Compression flag matching this layout, for use when creating
+        Blocks (applies to all arrays not created through the layout).
+        """
+        if self.compression:
+            return nix.Compression.DeflateNormal
+        return nix.Compression.No
+
+    @property
+    def filters(self):
+        """
+        Keyword arguments for h5py.Group.create_dataset() describing the
+        filter pipeline of this layout.
+        """
+        if not self.compression:
+            return dict()
+        return {"compression": "gzip", "compression_opts": self.level,
+                "shuffle": self.shuffle}
+
+    def matches(self, dataset):
+        """
+        True if the filter pipeline of 'dataset' is the one this layout
+        creates (same filters in the same order and the same deflate level).
+
+        :param dataset: h5py.Dataset
+        :rtype: bool
+        """
+        pipeline = filter_pipeline(dataset)
+        if not self.compression:
+            return not pipeline
+        codes = [code for code, _ in pipeline]
+        expected = [h5py.h5z.FILTER_DEFLATE]
+        if self.shuffle:
+            expected.insert(0, h5py.h5z.FILTER_SHUFFLE)
+        return (codes == expected and
+                dict(pipeline)[h5py.h5z.FILTER_DEFLATE][:1] == (self.level,))
+
+    def follows(self, source):
+        """
+        True if data converted from the dataset 'source' are stored with its
+        chunk shape and filters, so that its stored chunks can be copied as
+        they are.
+
+        :param source: h5py.Dataset the data are converted from or None.
+        :rtype: bool
+        """
+        return (self.access == "source" and source is not None and
+                source.chunks is not None and
+                (self.source_filters or self.matches(source)))
+
+    def chunks(self, shape, itemsize, time_axis=-1):
+        """
+        Chunk shape for a dataset with the given shape and item size.
+
+        The time axis is the axis holding the samples.  For 2-dimensional
+        data the remaining axis is treated as the channel axis.  Returns
+        True (let h5py guess) if no access pattern is set.
+
+        :param shape: Shape of the dataset.
+        :param itemsize: Size of a single element in bytes.
+        :param time_axis: Index of the time (sample) axis.
+        :rtype: tuple of int or True
+        """
+        if self.access is None or not len(shape):
+            return True
+        ndim = len(shape)
+        time_axis = time_axis % ndim
+        nelements = max(self.chunk_bytes // itemsize, 1)
+
+        chunks = [1] * ndim
+        if self.access in ("time", "source"):
+            # all channels (every axis but time) in every chunk
+            for idx, dimlen in enumerate(shape):
+                if idx != time_axis:
+                    chunks[idx] = max(dimlen, 1)
+            nchan = int(np.prod(chunks))
+            chunks[time_axis] = max(nelements // nchan, 1)
+        else:
+            # one channel per chunk, as many samples as fit
+            chunks[time_axis] = nelements
+
+        # chunks never need to be bigger than the data itself
+        return tuple(max(min(c, dimlen), 1)
+                     for c, dimlen in zip(chunks, shape))
+
+    def create_data_array(self, block, name, array_type, data=None,
+                          shape=None, dtype=None, time_axis=-1, source=None):
+        """
+        Create a DataArray on the given Block stored according to this layout.
+
+        Either 'data' or 'shape' must be given.  If 'dtype' is not specified,
+        it is taken from the data or defaults to 64-bit floating point.  With
+        the "source" access pattern and a chunked 'source' dataset, the new
+        dataset takes over the creation properties (chunk shape and filter
+        pipeline) of the source, unless compression was set explicitly and the
+        source filters differ (see 'follows()'); then only the chunk shape is
+        taken over.
+
+        :param block: The NIX Block to create the DataArray on.
+        :param name: Name of the new DataArray.
+        :param array_type: Type of the new DataArray.
+        :param data: Data to write after the storage has been created.
+        :param shape: Shape of the DataArray.
+        :param dtype: Data type used for storage.
+        :param time_axis: Index of the time (sample) axis.
+        :param source: h5py.Dataset the data are converted from.
+        :rtype: nix.DataArray
+        """
+        if data is not None:
+            data = np.ascontiguousarray(data)
+            if shape is None:
+                shape = data.shape
+            if dtype is None:
+                dtype = data.dtype
+        if shape is None:
+            raise ValueError("Either shape and or data must not be None")
+        if dtype is None:
+            dtype = np.float64
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+
+        # let NIX create the entity with an empty dataset and replace the
+        # dataset with one using the chunk shape and filters of the layout
+        da = block.create_data_array(name, array_type, dtype=dtype,
+                                     shape=(0,) * len(shape),
+                                     compression=nix.Compression.No)
+        h5group = da._h5group.group
+        del h5group["data"]
+        maxshape = (None,) * len(shape)
+        if self.follows(source):
+            h5group.create_dataset("data", shape=shape, dtype=dtype,
+                                   chunks=source.chunks, maxshape=maxshape,
+                                   dcpl=source.id.get_create_plist())
+        elif (self.access == "source" and source is not None and
+                source.chunks is not None):
+            h5group.create_dataset("data", shape=shape, dtype=dtype,
+                                   chunks=source.chunks, maxshape=maxshape,
+                                   **self.filters)
+        else:
+            h5group.create_dataset("data", shape=shape, dtype=dtype,
+                                   chunks=self.chunks(shape, dtype.itemsize,
+                                                      time_axis),
+                                   maxshape=maxshape, **self.filters)
+        if data is not None:
+            da.write_direct(data)
+        return da
+
+    @classmethod
+    def from_args(cls, args, **defaults):
+        """
+        Create a Layout from command line flags and remove the flags from the
+        argument list.
+
+        Recognised flags are '--no-compression', '--deflate=<level>',
+        '--shuffle' and '--chunking=<channel|time|source|auto>'.  The first
+        three set the filters explicitly (see 'source_filters').
+
+        :param args: List of command line arguments (modified in place).
+        :rtype: Layout
+        """
+        kwargs = dict(defaults)
+        for arg in list(args):
+            if arg == "--no-compression":
+                kwargs["compression"] = False
+                kwargs["source_filters"] = False
+            elif arg == "--shuffle":
+                kwargs["shuffle"] = True
+                kwargs["source_filters"] = False
+            elif arg.startswith("--deflate="):
+                kwargs["level"] = int(arg.split("=", 1)[1])
+                kwargs["source_filters"] = False
+            elif arg.startswith("--chunking="):
+                access = arg.split("=", 1)[1]
+                kwargs["access"] = None if access == "auto" else access
+            else:
+                continue
+            args.remove(arg)
+        return cls(**kwargs)
+
+    @classmethod
+    def from_namespace(cls, args):
+        """
+        Create a Layout from command line arguments parsed with the options
+        of cli.add_layout_arguments().
+
+        :param args: argparse.Namespace
+        :rtype: Layout
+        """
+        explicit = args.no_compression or args.deflate is not None
+        return cls(compression=not args.no_compression,
+                   level=6 if args.deflate is None else args.deflate,
+                   access=None if args.chunking == "auto" else args.chunking,
+                   source_filters=not explicit)
@@ -0,0 +1,9 @@
+__all__ = ["read_epochs"]
+
+
+# epochs imports mne, which is only loaded once read_epochs is used
+def __getattr__(name):
+    if name == "read_epochs":
+        from .epochs import read_epochs
+        return read_epochs
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,208 @@
+"""
+epochs.py
+
+Cut epochs around stimuli directly from a NIX file created with mne2nix.py.
+
+Instead of importing the whole recording into MNE and epoching it there,
+'read_epochs()' reads the positions of the stimulus MultiTags (see
+'create_stimulus_multi_tag()' in mne2nix.py), computes the sample window of
+every epoch (including the pre- and post-stimulus padding given by 'tmin' and
+'tmax'), and reads only those windows from the raw data DataArray(s).
+
+Windows are sorted and overlapping or nearby windows are merged into single
+range reads, so that each part of the recording is read (and decompressed)
+at most once; neighbouring ranges only overlap where their epochs do.  A
+merged range is limited to about 'buffer_bytes' (rounded to whole chunks,
+but never shorter than one window), so that dense stimuli don't turn into
+a read of the whole recording.  Merged ranges can be read in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nixio as nix
+import mne
+
+from . import nix2mne
+from ..streaming import DEFAULT_BUFFER_BYTES
+
+EVENT_REPEATED = ("merge", "drop", "error")
+
+
+def merge_windows(starts, length, max_gap=0, max_length=None):
+    """
+    Merge sample windows [start, start + length) into sorted ranges.
+    Windows closer than 'max_gap' samples are merged into the same range as
+    long as it stays within 'max_length' samples; every window lies within
+    one range, and ranges only overlap where windows of both do.
+
+    :param starts: Start samples of the windows.
+    :param length: Length of every window in samples.
+    :param max_gap: Largest gap (in samples) between two windows that is read
+    instead of starting a new range.
+    :param max_length: Largest length of a merged range in samples (None for
+    no limit).  A single window longer than this is still one range.
+    :rtype: list of (start, stop) tuples
+    """
+    ranges = list()
+    for start in np.sort(starts):
+        stop = start + length
+        if ranges and start - ranges[-1][1] <= max_gap and \
+           (max_length is None or stop - ranges[-1][0] <= max_length):
+            ranges[-1][1] = max(ranges[-1][1], stop)
+        else:
+            ranges.append([start, stop])
+    return [(int(start), int(stop)) for start, stop in ranges]
+
+
+def handle_repeated(onsample, labels, event_id, event_repeated):
+    """
+    Resolve stimuli with the same onset sample, as mne.Epochs does with
+    'event_repeated': 'drop' keeps the first of them, 'merge' replaces them
+    by one stimulus labelled with their labels joined by '/' (with a new
+    event code) and 'error' raises a RuntimeError.  'onsample' must be
+    sorted.
+
+    :returns: The indices of the stimuli kept, their labels and the event
+    codes of these labels.
+    """
+    if event_repeated not in EVENT_REPEATED:
+        raise ValueError(f"event_repeated must be one of {EVENT_REPEATED}")
+    labels = [str(label) for label in labels]
+    first = np.flatnonzero(np.diff(onsample, prepend=-1) != 0)
+    if len(first) == len(onsample):
+        return np.arange(len(onsample)), labels, event_id
+    if event_repeated == "error":
+        raise RuntimeError("Stimuli with the same onset sample found; use "
+                           "event_repeated='merge' or 'drop'")
+    if event_repeated == "drop":
+        kept = [labels[idx] for idx in first]
+        return first, kept, {label: code for label, code in event_id.items()
+                             if label in kept}
+    event_id = dict(event_id)
+    merged = []
+    for start, stop in zip(first, list(first[1:]) + [len(onsample)]):
+        label = "/".join(sorted(set(labels[start:stop])))
+        if label not in event_id:
+            event_id[label] = max(event_id.values(), default=0) + 1
+        merged.append(label)
+    # labels only left in merged stimuli
+    return first, merged, {label: code for label, code in event_id.items()
+                           if label in merged}
+
+
+def read_epochs(nixfilename, tmin=-0.2, tmax=0.5, mtag_names=None,
+                event_id=None, baseline=None, max_gap=None, jobs=None,
+                event_repeated="merge", buffer_bytes=DEFAULT_BUFFER_BYTES,
+                verbose=None):
+    """
+    Read epochs around the stimuli of a NIX file (generated with mne2nix.py)
+    into an MNE EpochsArray without loading the full signal.
+
+    :param nixfilename: Path to the NIX file to be loaded.
+    :param tmin: Start of each epoch relative to the stimulus onset (s).
+    :param tmax: End of each epoch relative to the stimulus onset (s).
+    :param mtag_names: Names of the stimulus MultiTags to use.  Defaults to
+    all MultiTags of the raw data group.
+    :param event_id: Dictionary mapping stimulus labels to event codes.
+    Only stimuli with labels in the dictionary are epoched.  Defaults to all
+    labels, numbered in sorted order starting at 1.
+    :param baseline: Baseline correction interval passed to MNE.
+    :param max_gap: Largest gap (in samples) between two epochs that is read
+    within one range read.  Defaults to the chunk length of the raw data
+    along time, since a partially read chunk is decompressed as a whole.
+    :param jobs: Number of reader threads.
+    :param event_repeated: How stimuli with the same onset sample are
+    handled, as in mne.Epochs: 'merge' (default) combines them into one
+    epoch with a new event code, 'drop' keeps the first and 'error' raises
+    a RuntimeError (see handle_repeated()).
+    :param buffer_bytes: Size (of all channels as 64-bit floats) a merged
+    range is limited to.
+    :rtype: mne.EpochsArray
+    """
+    nixfile = nix.File(nixfilename, mode=nix.FileMode.ReadOnly)
+    try:
+        info = nix2mne.create_mne_info(nixfile.sections["Info"])
+        block = nixfile.blocks[nix2mne.DATA_BLOCK_NAME]
+        datagroup = block.groups[nix2mne.RAW_DATA_GROUP_NAME]
+        extras = nix2mne.raw_data_extras(datagroup)
+
+        # stimulus onsets and labels
+        mtags = [mtag for mtag in datagroup.multi_tags
+                 if mtag_names is None or mtag.name in mtag_names]
+        events = [nix2mne.read_mtag_events(mtag) for mtag in mtags]
+        if events:
+            onset = np.concatenate([ev[0] for ev in events])
+            labels = np.concatenate([ev[2] for ev in events])
+        else:
+            onset = np.array([])
+            labels = np.array([], dtype=str)
+        if event_id is None:
+            event_id = {label: code + 1
+                        for code, label in enumerate(np.unique(labels))}
+        selected = np.isin(labels, list(event_id))
+        onset = onset[selected]
+        labels = labels[selected]
+
+        # epoch windows in samples; windows outside the recording are dropped
+        sfreq = info["sfreq"]
+        first = int(round(tmin * sfreq))
+        nwindow = int(round((tmax - tmin) * sfreq)) + 1
+        onsample = np.round(onset * sfreq).astype(int)
+        starts = onsample + first
+        valid = (starts >= 0) & (starts + nwindow <= extras["nsamples"])
+        order = np.argsort(starts[valid], kind="stable")
+        starts = starts[valid][order]
+        onsample = onsample[valid][order]
+        labels = labels[valid][order]
+        keep, labels, event_id = handle_repeated(onsample, labels, event_id,
+                                                 event_repeated)
+        starts = starts[keep]
+        onsample = onsample[keep]
+
+        nchan = extras["orig_nchan"]
+        chunk = raw_chunk_length(block, extras)
+        if max_gap is None:
+            max_gap = chunk
+        max_length = buffer_bytes // (8 * max(nchan, 1))
+        if chunk:
+            max_length = max(max_length // chunk, 1) * chunk
+        ranges = merge_windows(starts, nwindow, max_gap, max_length)
+
+        channels = np.arange(nchan)
+        data = np.empty((len(starts), nchan, nwindow))
+
+        def read_range(rng):
+            rstart, rstop = rng
+            segment = nix2mne.read_raw_segment(nixfile, extras, channels,
+                                               rstart, rstop)
+            # the epochs within the range (neighbouring ranges can overlap)
+            first_epoch = np.searchsorted(starts, rstart)
+            last_epoch = np.searchsorted(starts, rstop - nwindow,
+                                         side="right")
+            for idx in range(first_epoch, last_epoch):
+                offset = starts[idx] - rstart
+                data[idx] = segment[:, offset:offset+nwindow]
+
+        if jobs is not None and jobs > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                list(pool.map(read_range, ranges))
+        else:
+            for rng in ranges:
+                read_range(rng)
+    finally:
+        nixfile.close()
+
+    mneevents = np.zeros((len(starts), 3), dtype=int)
+    mneevents[:, 0] = onsample
+    mneevents[:, 2] = [event_id[label] for label in labels]
+    return mne.EpochsArray(data, info, events=mneevents, tmin=first / sfreq,
+                           event_id=event_id, baseline=baseline,
+                           verbose=verbose)
+
+
+def raw_chunk_length(block, extras):
+    da = block.data_arrays[extras["data_arrays"][0]]
+    chunks = da._h5group.group["data"].chunks
+    if chunks is None:
+        return 0
+    return chunks[extras["time_axis"]]
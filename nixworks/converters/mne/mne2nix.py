@@ -2,7 +2,9 @@
 mne2nix.py
 
 Usage:
-  python mne2nix.py [--split-data] [--split-stimuli] <datafile> <montage>
+  python -m nixworks.converters.mne.mne2nix [--split-data] [--split-stimuli]
+      [--no-compression] [--deflate=<level>] [--shuffle]
+      [--chunking=<channel|time|auto>] [--restart] <datafile> <montage>
 
 Arguments:
   datafile   Either an EDF file or a BrainVision header file (vhdr).
@@ -16,6 +18,25 @@ Flags:
                     is stored in a separate MultiTag (one MultiTag per
                     stimulus type).
 
+  --no-compression  Store the raw data uncompressed.
+
+  --deflate=<level> Deflate (gzip) level 0-9 used for the raw data
+                    (default: 6).
+
+  --shuffle         Enable the byte-shuffle filter for the raw data.
+
+  --chunking=<channel|time|auto>
+                    Tune the chunk shape of the raw data for reading single
+                    channels over the whole recording ('channel') or all
+                    channels over short time windows ('time', default).
+                    'auto' leaves the chunk shape to HDF5.
+
+  --restart         Start over instead of continuing an interrupted
+                    conversion.  The NIX file is written to '<name>.nix.part'
+                    and only renamed to '<name>.nix' once it is complete; if
+                    the conversion is interrupted, running it again continues
+                    from the last complete chunk of the raw data.
+
 
 (Requires Python 3)
 
@@ -37,6 +58,9 @@ since MultiTag positions and extents don't need to specify every channel they
 reference.  However, creating multiple DataArrays makes file sizes much
 bigger.
 
+The storage layout (compression, deflate level, chunk shape) of the raw data
+is controlled by a Layout (see nixworks/converters/layout.py).
+
 Stimuli
 -------
 MNE provides stimulus information through the Raw.annotations dictionary.
@@ -62,9 +86,11 @@ import sys
 import os
 from collections.abc import Iterable, Mapping
 import mne
-import matplotlib.pyplot as plt
 import numpy as np
-import nixio as nix
+
+from ...instrument import operation
+from ..checkpoint import Checkpoint, fingerprint
+from ..layout import Layout
 
 
 DATA_BLOCK_NAME = "EEG Data Block"
@@ -75,6 +101,8 @@ RAW_DATA_TYPE = "Raw Data"
 
 
 def plot_channel(data_array, index):
+    import matplotlib.pyplot as plt
+
     signal = data_array[index]
     tdim = data_array.dimensions[1]
     datadim = data_array.dimensions[0]
@@ -132,30 +160,29 @@ def create_md_tree(section, values, block):
         prop.type = str(v.__class__)
 
 
-def write_single_da(mneraw, block):
-    # data and times
-    data = mneraw.get_data()
+def write_single_da(mneraw, block, layout, checkpoint):
+    # times; the data is written by write_data()
     time = mneraw.times
 
     nchan = mneraw.info["nchan"]
     print(f"Found {nchan} channels with {mneraw.n_times} samples per channel")
 
-    da = block.create_data_array("EEG Data", RAW_DATA_TYPE, data=data)
+    shape = (nchan, mneraw.n_times)
+    da = layout.create_data_array(block, "EEG Data", RAW_DATA_TYPE,
+                                  shape=shape, dtype=np.float64, time_axis=1)
+    checkpoint.add(da.name, da._h5group.group["data"], axis=1)
     block.groups[RAW_DATA_GROUP_NAME].data_arrays.append(da)
     da.unit = "V"
 
-    for dimlen in data.shape:
-        if dimlen == nchan:
-            # channel labels: SetDimension
-            da.append_set_dimension(labels=mneraw.ch_names)
-        elif dimlen == mneraw.n_times:
-            # times: RangeDimension
-            # NOTE: EDF always uses seconds
-            da.append_range_dimension(ticks=time, label="time", unit="s")
+    # channel labels along the first axis: SetDimension
+    da.append_set_dimension(labels=mneraw.ch_names)
+    # times along the second axis: RangeDimension
+    # NOTE: EDF always uses seconds
+    da.append_range_dimension(ticks=time, label="time", unit="s")
 
 
-def write_multi_da(mneraw, block):
-    data = mneraw.get_data()
+def write_multi_da(mneraw, block, layout, checkpoint):
+    # times; the data is written by write_data()
     time = mneraw.times
 
     nchan = mneraw.info["nchan"]
@@ -163,18 +190,11 @@ def write_multi_da(mneraw, block):
 
     print(f"Found {nchan} channels with {mneraw.n_times} samples per channel")
 
-    # find the channel dimension to iterate over it
-    for idx, dimlen in enumerate(data.shape):
-        if dimlen == nchan:
-            chanidx = idx
-            break
-    else:
-        raise RuntimeError("Could not find data dimension that matches number "
-                           "of channels")
-
-    for idx, chandata in enumerate(np.rollaxis(data, chanidx)):
-        chname = channames[idx]
-        da = block.create_data_array(chname, RAW_DATA_TYPE, data=chandata)
+    for chname in channames:
+        da = layout.create_data_array(block, chname, RAW_DATA_TYPE,
+                                      shape=(mneraw.n_times,),
+                                      dtype=np.float64)
+        checkpoint.add(da.name, da._h5group.group["data"])
         block.groups[RAW_DATA_GROUP_NAME].data_arrays.append(da)
         da.unit = "V"
 
@@ -183,6 +203,30 @@ def write_multi_da(mneraw, block):
         da.append_range_dimension(ticks=time, label="time", unit="s")
 
 
+@operation("mne2nix.data")
+def write_data(mneraw, checkpoint):
+    """
+    Write the raw data into the arrays created by 'write_single_da()' or
+    'write_multi_da()', continuing where an interrupted conversion stopped.
+    Reads at most a few blocks of samples from the Raw at a time; the
+    per-channel arrays of 'write_multi_da()' are written together, so every
+    block is read once for all channels.
+    """
+    channels = [name for name, *_ in checkpoint.arrays()
+                if name in mneraw.ch_names]
+    if channels:
+        picks = [mneraw.ch_names.index(name) for name in channels]
+
+        def read_channels(start, stop):
+            return mneraw.get_data(picks=picks, start=start, stop=stop)
+        checkpoint.fill_rows(channels, read_channels)
+    for name, *_ in checkpoint.arrays():
+        if name not in mneraw.ch_names:
+            def read(start, stop):
+                return mneraw.get_data(start=start, stop=stop)
+            checkpoint.fill(name, read)
+
+
 def separate_stimulus_types(stimuli):
     # separate stimuli based on label
     stimdict = dict()
@@ -251,35 +295,73 @@ def create_stimulus_multi_tag(stimtuples, block, mneraw, mtagname="Stimuli"):
             stimmtag.references.append(da)
 
 
+@operation("mne2nix.write_raw_mne")
 def write_raw_mne(nfname, mneraw,
-                  split_data_channels=False, split_stimuli=False):
+                  split_data_channels=False, split_stimuli=False,
+                  layout=None, resume=True, montage=None):
     """
     Writes the provided Raw MNE structure to a NIX file with the given name.
 
+    The file is written to '<nfname>.part' and renamed to 'nfname' once
+    complete (see nixworks/converters/checkpoint.py).  A conversion of the
+    same source file with the same options that was interrupted is
+    continued from the last complete chunk.
+
     :param nfname: Name for the NIX file to write to. Existing file will be
-    overwritten.
+    replaced once the conversion is complete.
     :param mneraw: An MNE Raw structure (any mne.io.BaseRaw subclass).
     :param split_data_channels: If True, each raw data channel will be stored
     in a separate DataArray.
     :param split_stimuli: If True, stimuli will be split into separate
     MultiTags based on the stimulus type (label).
+    :param layout: Storage Layout (compression and chunking) for the raw
+    data.  Defaults to deflate compression with chunks tuned for reading
+    time windows of all channels.
+    :param resume: Continue an interrupted conversion of the same source
+    file.  Raw structures not read from a file always start over.
+    :param montage: Path of the montage file applied to the Raw, if any.  A
+    conversion with another montage starts over.
     :rtype: None
     """
+    if layout is None:
+        layout = Layout()
+
+    source = mneraw.filenames[0] if mneraw.filenames else None
+    if source is None:
+        resume = False
+        key = ""
+    else:
+        key = fingerprint(source, split_data_channels, split_stimuli, layout,
+                          montage)
+    with Checkpoint.open(nfname, key, resume) as checkpoint:
+        if checkpoint.prepared:
+            print(f"Resuming conversion to '{nfname}'")
+        else:
+            write_structure(checkpoint, mneraw, split_data_channels,
+                            split_stimuli, layout)
+        write_data(mneraw, checkpoint)
+        checkpoint.finish()
+    print(f"Created NIX file at '{nfname}'")
+    print("Done")
+
+
+@operation("mne2nix.structure")
+def write_structure(checkpoint, mneraw, split_data_channels, split_stimuli,
+                    layout):
     mneinfo = mneraw.info
     extrainfo = mneraw._raw_extras
 
-    # Create NIX file
-    nf = nix.File(nfname, nix.FileMode.Overwrite)
+    nf = checkpoint.nixfile
 
     # Write Data to NIX
     block = nf.create_block(DATA_BLOCK_NAME, DATA_BLOCK_TYPE,
-                            compression=nix.Compression.DeflateNormal)
+                            compression=layout.block_compression)
     block.create_group(RAW_DATA_GROUP_NAME, RAW_DATA_GROUP_TYPE)
 
     if split_data_channels:
-        write_multi_da(mneraw, block)
+        write_multi_da(mneraw, block, layout, checkpoint)
     else:
-        write_single_da(mneraw, block)
+        write_single_da(mneraw, block, layout, checkpoint)
 
     if mneraw.annotations:
         write_stim_tags(mneraw, block, split_stimuli)
@@ -298,14 +380,12 @@ def write_raw_mne(nfname, mneraw,
         extrasmd = nf.create_section("Extras", "Raw Extras metadata")
         create_md_tree(extrasmd, extrainfo[0], block)
 
-    # all done
-    nf.close()
-    print(f"Created NIX file at '{nfname}'")
-    print("Done")
+    checkpoint.prepare()
 
 
-def main():
-    args = sys.argv
+def main(args=None):
+    if args is None:
+        args = sys.argv
     if len(args) < 2:
         print("Please provide either a BrainVision vhdr or "
               "an EDF filename as the first argument")
@@ -321,6 +401,13 @@ def main():
         splitstim = True
         args.remove("--split-stimuli")
 
+    resume = True
+    if "--restart" in args:
+        resume = False
+        args.remove("--restart")
+
+    layout = Layout.from_args(args)
+
     datafilename = args[1]
     montage = None
     if len(args) > 2:
@@ -330,10 +417,10 @@ def main():
     nfname = root + os.path.extsep + "nix"
     if ext.casefold() == ".edf".casefold():
         mneraw = mne.io.read_raw_edf(datafilename, montage=montage,
-                                     preload=True, stim_channel=False)
+                                     preload=False, stim_channel=False)
     elif ext.casefold() == ".vhdr".casefold():
         mneraw = mne.io.read_raw_brainvision(datafilename, montage=montage,
-                                             preload=True, stim_channel=False)
+                                             preload=False, stim_channel=False)
     else:
         raise RuntimeError(f"Unknown extension '{ext}'")
     print(f"Converting '{datafilename}' to NIX")
@@ -342,7 +429,8 @@ def main():
     if splitstim:
         print("  Creating one MultiTag for each stimulus type")
 
-    write_raw_mne(nfname, mneraw, splitdata, splitstim)
+    write_raw_mne(nfname, mneraw, splitdata, splitstim, layout, resume,
+                  montage)
 
     mneraw.close()
 
@@ -17,13 +17,24 @@ load all data and metadata successfully.  Refer to the "NIX Format Layout" in
 the mne2nix.py module for details.
 
 To include in a script, call the 'import_nix()' and provide a NIX filename.
+
+The returned RawNIX structure reads data lazily: opening a file only reads the
+metadata and annotations, and MNE reads the time and channel segments it
+needs from the NIX DataArray(s) on demand.  Pass 'preload=True' to read all
+data into memory immediately.
 """
 import os
 import sys
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import nixio as nix
 import mne
 
+from ...instrument import operation
+from ...memmap import data_view, memmap
+from ..streaming import can_decode, filter_pipeline, read_block
+
 
 DATA_BLOCK_NAME = "EEG Data Block"
 DATA_BLOCK_TYPE = "Recording"
@@ -50,6 +61,10 @@ def convert_prop_type(prop):
     if len(pv) == 1:
         pv = pv[0]
 
+    if pt not in typemap:
+        # types without a known constructor (e.g., MNE's NamedInt constants)
+        # are returned as stored
+        return pv
     return typemap[pt](pv)
 
 
@@ -78,81 +93,279 @@ def md_to_dict(section):
     return sdict
 
 
-def merge_data_arrays(arrays):
-    rows = [a[:] for a in arrays]
-    return np.array(rows)
+def create_mne_info(infosec):
+    nchan = infosec["nchan"]
+    sfreq = infosec["sfreq"]
+    info = mne.create_info(nchan, sfreq)
 
+    nixinfodict = md_to_dict(infosec)
+    # newer MNE versions lock the Info structure against direct updates
+    unlock = getattr(info, "_unlock", contextlib.nullcontext)
+    with unlock():
+        info.update(nixinfodict)
+    return info
 
-def create_mne_annotations(mtags):
-    onset = list()
-    duration = list()
-    description = list()
-    for mtag in mtags:
-        posshape = mtag.positions.shape
-        if len(posshape) == 1:
-            onset.extend(mtag.positions)
-            duration.extend(mtag.extents)
-        else:
-            onset.extend([p[1] for p in mtag.positions])
-            duration.extend([e[1] for e in mtag.extents])
 
-        description.extend(mtag.positions.dimensions[0].labels)
+def read_direct(data_array, out, start=None, stop=None, decode=False):
+    """
+    Read the samples [start, stop) of a 1D DataArray directly into 'out'
+    without intermediate copies.
+
+    :param data_array: The DataArray to read from.
+    :param out: C-contiguous array with length stop - start to read into.
+    :param start: First sample to read.
+    :param stop: Sample after the last sample to read.
+    :param decode: Read deflate and shuffle compressed chunks raw and
+    decode them outside of HDF5 (see streaming.read_block()), so that reads
+    in several threads decompress in parallel.
+    """
+    if len(data_array.polynom_coefficients) or data_array.expansion_origin:
+        # calibrated data need to pass through NIX
+        out[:] = data_array[start:stop]
+        return
+    dataset = data_array._h5group.group["data"]
+    mapped = memmap(dataset)
+    if mapped is not None:
+        out[:] = mapped[start:stop]
+        return
+    if decode and can_decode(dataset):
+        start, stop, _ = slice(start, stop).indices(dataset.shape[0])
+        # the chunks are decoded straight into 'out'
+        read_block(dataset, slice(start, stop), filter_pipeline(dataset),
+                   out=out)
+        return
+    dataset.read_direct(out, source_sel=np.s_[start:stop])
+
+
+def merge_data_arrays(arrays, start=None, stop=None, jobs=None):
+    """
+    Merge 1D DataArrays (one per channel) into one 2D array with shape
+    (channels, samples).
+
+    The output is allocated once and each DataArray is read directly into
+    its row.  With 'jobs' > 1 the reads run in a thread pool.  Since h5py
+    serialises all HDF5 calls, the threads read compressed chunks raw and
+    decompress them with zlib and NumPy, which run in parallel (see
+    read_direct()).
+
+    :param arrays: List of 1D DataArrays of equal length.
+    :param start: First sample to read.
+    :param stop: Sample after the last sample to read.
+    :param jobs: Number of reader threads.
+    :rtype: numpy.ndarray
+    """
+    nsamples = len(range(*slice(start, stop).indices(len(arrays[0]))))
+    dtype = np.result_type(*[a.dtype for a in arrays])
+    merged = np.empty((len(arrays), nsamples), dtype=dtype)
 
-    return mne.Annotations(onset=onset,
-                           duration=duration,
-                           description=description)
+    parallel = jobs is not None and jobs > 1
 
+    def read_row(row):
+        read_direct(arrays[row], merged[row], start, stop, decode=parallel)
 
-def import_nix(nixfilename):
+    if parallel:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(read_row, range(len(arrays))))
+    else:
+        for row in range(len(arrays)):
+            read_row(row)
+    return merged
+
+
+def read_mtag_events(mtag):
     """
-    Import a NIX file (generated with mne2nix.py) into an MNE Raw structure.
+    Read onsets, durations and labels of all positions of a MultiTag.
 
-    :param nixfilename: Path to the NIX file to be loaded.
-    :rtype: mne.io.RawArray
+    Positions, extents and labels are each read in a single slice.  For
+    multidimensional positions the last column holds the time.
+
+    :param mtag: A MultiTag created by mne2nix.py.
+    :rtype: tuple of numpy.ndarray (onset, duration, description)
     """
-    nixfile = nix.File(nixfilename, mode=nix.FileMode.ReadOnly)
+    positions = mtag.positions
+    onset = np.asarray(positions[:], dtype=float)
+    if mtag.extents is not None:
+        duration = np.asarray(mtag.extents[:], dtype=float)
+    else:
+        duration = np.zeros(onset.shape)
+    if onset.ndim > 1:
+        onset = onset[:, -1]
+        duration = duration[:, -1]
+    description = np.asarray(positions.dimensions[0].labels, dtype=str)
+    return onset, duration, description
 
-    # root, ext = os.path.splitext(nixfilename)
-    # bvfilename = root + os.extsep + "vhdr"
-    # bvfile = mne.io.read_raw_brainvision(bvfilename, stim_channel=False)
 
-    # Create MNE Info object
-    infosec = nixfile.sections["Info"]
-    nchan = infosec["nchan"]
-    sfreq = infosec["sfreq"]
-    info = mne.create_info(nchan, sfreq)
+def create_mne_annotations(mtags):
+    """
+    Create MNE Annotations from the stimulus MultiTags of a NIX file.
 
-    nixinfodict = md_to_dict(infosec)
-    info.update(nixinfodict)
+    All MultiTags (one per stimulus type when the file was written with
+    '--split-stimuli') are read and merged in one batched pass and sorted
+    by onset.
 
-    # Read raw data into MNE objects
-    datagroup = nixfile.blocks[DATA_BLOCK_NAME].groups[RAW_DATA_GROUP_NAME]
-    if len(datagroup.data_arrays) > 1:
-        # Data split: One DataArray per channel.  Merging
-        nixrawdata = merge_data_arrays(datagroup.data_arrays)
+    :param mtags: List of MultiTags created by mne2nix.py.
+    :rtype: mne.Annotations
+    """
+    events = [read_mtag_events(mtag) for mtag in mtags]
+    if not events:
+        return mne.Annotations(onset=[], duration=[], description=[])
+
+    onset, duration, description = [np.concatenate(column)
+                                    for column in zip(*events)]
+    order = np.argsort(onset, kind="stable")
+    return mne.Annotations(onset=onset[order],
+                           duration=duration[order],
+                           description=description[order])
+
+
+def find_time_axis(data_array):
+    for idx, dim in enumerate(data_array.dimensions):
+        if dim.dimension_type in (nix.DimensionType.Range,
+                                  nix.DimensionType.Sample):
+            return idx
+    raise RuntimeError(f"DataArray '{data_array.name}' has no time dimension")
+
+
+def raw_data_extras(datagroup, jobs=None):
+    """
+    Describe the layout of the raw data DataArray(s) in the data group:
+    DataArray names, time axis, number of channels and samples.
+
+    :param datagroup: The raw data Group of a file created by mne2nix.py.
+    :param jobs: Number of reader threads used for files with one DataArray
+    per channel.
+    :rtype: dict
+    """
+    arrays = [da for da in datagroup.data_arrays if da.type == RAW_DATA_TYPE]
+    time_axis = find_time_axis(arrays[0])
+    if len(arrays) > 1:
+        nchan = len(arrays)
     else:
-        nixrawdata = datagroup.data_arrays[0][:]
+        nchan = arrays[0].shape[1 - time_axis]
+    return {"data_arrays": [da.name for da in arrays],
+            "time_axis": time_axis,
+            "orig_nchan": nchan,
+            "nsamples": arrays[0].shape[time_axis],
+            "jobs": jobs}
 
-    # Create MNE RawArray
-    mnerawdata = mne.io.RawArray(nixrawdata, info)
 
-    # Add annotations: Stimuli from MultiTags
-    mtags = datagroup.multi_tags
-    annotations = create_mne_annotations(mtags)
+def read_raw_segment(nixfile, extras, channels, start, stop):
+    """
+    Read the samples [start, stop) of the given channels from the raw data
+    DataArray(s) described by 'extras'.
+
+    :param nixfile: The open NIX file.
+    :param extras: Layout of the raw data as stored in RawNIX._raw_extras.
+    :param channels: Sorted array of channel indices to read.
+    :param start: First sample to read.
+    :param stop: Sample after the last sample to read.
+    :rtype: numpy.ndarray with shape (len(channels), stop - start)
+    """
+    block = nixfile.blocks[DATA_BLOCK_NAME]
+    names = extras["data_arrays"]
+    if len(names) > 1:
+        # Data split: One DataArray per channel
+        arrays = [block.data_arrays[names[chidx]] for chidx in channels]
+        return merge_data_arrays(arrays, start, stop, extras.get("jobs"))
+
+    da = data_view(block.data_arrays[names[0]])
+    timeslice = slice(start, stop)
+    if len(channels) and np.all(np.diff(channels) == 1):
+        chanslice = slice(channels[0], channels[-1] + 1)
+    else:
+        chanslice = list(channels)
+    if extras["time_axis"] == 0:
+        return da[timeslice, chanslice].T
+    return da[chanslice, timeslice]
 
-    mnerawdata.set_annotations(annotations)
 
-    nixfile.close()
+class RawNIX(mne.io.BaseRaw):
+    """
+    MNE Raw structure reading its data from a NIX file generated with
+    mne2nix.py.
 
-    return mnerawdata
+    Only metadata and annotations are read when the object is created.  Data
+    segments are read from the NIX DataArray(s) when MNE requests them
+    (unless 'preload' is True).
+
+    :param nixfilename: Path to the NIX file to be loaded.
+    :param preload: If True, all data are read into memory on creation.
+    :param jobs: Number of reader threads used for files with one DataArray
+    per channel.
+    """
+
+    def __init__(self, nixfilename, preload=False, jobs=None, verbose=None):
+        nixfilename = os.path.abspath(nixfilename)
+        nixfile = nix.File(nixfilename, mode=nix.FileMode.ReadOnly)
+
+        # Create MNE Info object
+        info = create_mne_info(nixfile.sections["Info"])
+
+        # Find raw data DataArrays and their layout
+        datagroup = nixfile.blocks[DATA_BLOCK_NAME].groups[RAW_DATA_GROUP_NAME]
+        extras = raw_data_extras(datagroup, jobs)
+        nsamples = extras["nsamples"]
+
+        # Add annotations: Stimuli from MultiTags
+        annotations = create_mne_annotations(datagroup.multi_tags)
+
+        nixfile.close()
+
+        super(RawNIX, self).__init__(info, preload=False,
+                                     last_samps=[nsamples-1],
+                                     filenames=[nixfilename],
+                                     raw_extras=[extras],
+                                     orig_format="double", verbose=verbose)
+        # data in NIX are stored calibrated (as returned by get_data())
+        self._cals[:] = 1.0
+        self.set_annotations(annotations)
+        if preload:
+            self.load_data()
+
+    @operation("nix2mne.read_segment")
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        """Read a segment of data from the NIX file."""
+        extras = self._raw_extras[fi]
+        channels = np.arange(extras["orig_nchan"])[idx]
+        order = np.argsort(channels)
+        nixfile = nix.File(str(self.filenames[fi]),
+                           mode=nix.FileMode.ReadOnly)
+        try:
+            segment = np.empty((len(channels), stop - start))
+            segment[order] = read_raw_segment(nixfile, extras,
+                                              channels[order], start, stop)
+        finally:
+            nixfile.close()
+
+        if mult is not None:
+            data[:] = mult @ segment
+        else:
+            data[:] = segment * cals
+
+
+@operation("nix2mne.import_nix")
+def import_nix(nixfilename, preload=False, jobs=None):
+    """
+    Import a NIX file (generated with mne2nix.py) into an MNE Raw structure.
+
+    :param nixfilename: Path to the NIX file to be loaded.
+    :param preload: If True, read all data into memory.  Otherwise data are
+    read lazily as MNE requests them.
+    :param jobs: Number of reader threads used for files with one DataArray
+    per channel.
+    :rtype: RawNIX
+    """
+    return RawNIX(nixfilename, preload=preload, jobs=jobs)
 
 
-def main():
-    if len(sys.argv) < 2:
+def main(args=None):
+    if args is None:
+        args = sys.argv
+    if len(args) < 2:
         print("Please provide either a NIX filename as the first argument")
         sys.exit(1)
 
-    nixfilename = sys.argv[1]
+    nixfilename = args[1]
     import_nix(nixfilename)
 
 
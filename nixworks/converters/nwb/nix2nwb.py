@@ -1,18 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse
+import math
 import sys
 from datetime import datetime, timedelta
 
 from pathlib import Path
 
+import h5py
+import numpy as np
 import nixio as nix
 import quantities as pq
 
-start = datetime.now()
 import pynwb as nwb
-print(f"nwb loading done in: {datetime.now() - start}")
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.common import VectorData, VectorIndex
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+
+from ... import cli
+from ...instrument import operation
+from ..layout import Layout
+from ..streaming import (DEFAULT_BUFFER_BYTES, Progress, block_rows, copy,
+                         filter_pipeline, iter_blocks)
+
+# HDF5 filters that H5DataIO can recreate: deflate, shuffle, fletcher32
+H5DATAIO_FILTERS = {h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE,
+                    h5py.h5z.FILTER_FLETCHER32}
+
 
 def make_recoding_time(recording):
     '''extract date+time from metadata'''
@@ -23,55 +37,385 @@ def make_recoding_time(recording):
     return d + timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
 
 
-def convert_1d_sampled(out, data, metadata):
-    '''convert one-dimensional sampled data'''
-    spikes = data[:]
-    unit = data.unit
-    dim = data.dimensions[0]
-    q = pq.Quantity(dim.sampling_interval, dim.unit)
-    rate = (1 / q.rescale(pq.s)).rescale(pq.Hz)
-    print(f"{data.name}, 1d, sampled data: {rate} Hz", file=sys.stderr)
-    ts = nwb.TimeSeries(name=data.name, data=data[:], unit=unit, rate=float(rate))
+def h5dataio_like(source):
+    '''empty H5DataIO with the chunking and filters of 'source' (or None)'''
+    pipeline = filter_pipeline(source)
+    if source.chunks is None or \
+       not {code for code, _ in pipeline} <= H5DATAIO_FILTERS:
+        return None
+    filters = dict(pipeline)
+    deflate = filters.get(h5py.h5z.FILTER_DEFLATE)
+    return H5DataIO(shape=source.shape, dtype=source.dtype,
+                    chunks=source.chunks,
+                    compression='gzip' if deflate else None,
+                    compression_opts=deflate[0] if deflate else None,
+                    shuffle=h5py.h5z.FILTER_SHUFFLE in filters,
+                    fletcher32=h5py.h5z.FILTER_FLETCHER32 in filters)
+
+
+class DataArrayChunkIterator(AbstractDataChunkIterator):
+    '''iterate over a NIX DataArray (or h5py dataset) in blocks of rows
+
+    NWBHDF5IO.write pulls one block at a time from the iterator and writes
+    it before asking for the next, so at most one block of about
+    'buffer_bytes' is held in memory, independent of the length of the
+    recording.  Blocks are aligned to the chunks of the NWB dataset
+    ('chunks'), so every target chunk is written once, and also to the
+    chunks of the NIX dataset if the common multiple fits the buffer.
+
+    The axis 'time_axis' of the data becomes the first axis of the blocks
+    (the NWB convention).  Calibrated DataArrays (polynomial coefficients or
+    expansion origin) are read as calibrated 64-bit floats, and with a
+    'scale' factor the blocks are multiplied by it.
+    '''
+
+    def __init__(self, data, chunks=None, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 time_axis=0, scale=None):
+        self.data = data
+        self.time_axis = time_axis
+        self.scale = scale
+        shape = data.shape
+        self.shape = (shape[time_axis],) + \
+            tuple(n for idx, n in enumerate(shape) if idx != time_axis)
+        self.chunks = chunks if isinstance(chunks, tuple) else None
+        if isinstance(data, nix.DataArray):
+            source = data._h5group.group['data'].chunks
+            calibrated = len(data.polynom_coefficients) or \
+                data.expansion_origin
+        else:
+            source = data.chunks
+            calibrated = False
+        if calibrated or scale is not None:
+            self._dtype = np.dtype(np.float64)
+        else:
+            self._dtype = np.dtype(data.dtype)
+
+        step = self.chunks[0] if self.chunks else 1
+        if source:
+            common = step * source[time_axis] // \
+                math.gcd(step, source[time_axis])
+            rowbytes = int(np.prod(self.shape[1:])) * self._dtype.itemsize
+            step = common if common * rowbytes <= buffer_bytes else step
+        rows = block_rows(self.shape, self._dtype, (step,), buffer_bytes)
+        self.blocks = iter_blocks(self.shape, rows)
+        self.progress = Progress(
+            data.name, int(np.prod(self.shape)) * self._dtype.itemsize)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        slc = next(self.blocks, None)
+        if slc is None:
+            self.progress.finish()
+            raise StopIteration
+        index = [slice(None)] * len(self.shape)
+        index[self.time_axis] = slc
+        block = np.moveaxis(self.data[tuple(index)], self.time_axis, 0)
+        if self.scale is not None:
+            block = block * self.scale
+        self.progress.update(block.nbytes)
+        selection = (slc,) + tuple(slice(0, n) for n in self.shape[1:])
+        return DataChunk(data=np.ascontiguousarray(block, dtype=self._dtype),
+                         selection=selection)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def recommended_chunk_shape(self):
+        return self.chunks
+
+    def recommended_data_shape(self):
+        return self.shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return self.shape
+
+
+class ConcatChunkIterator(AbstractDataChunkIterator):
+    '''concatenate one-dimensional chunk iterators along the first axis'''
+
+    def __init__(self, iterators, chunks=None):
+        self.iterators = list(iterators)
+        self.shape = (sum(len(it) for it in self.iterators),)
+        self.chunks = chunks if isinstance(chunks, tuple) else None
+        self.current = 0
+        self.offset = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.current < len(self.iterators):
+            iterator = self.iterators[self.current]
+            chunk = next(iterator, None)
+            if chunk is not None:
+                slc = chunk.selection[0]
+                return DataChunk(data=chunk.data,
+                                 selection=(slice(slc.start + self.offset,
+                                                  slc.stop + self.offset),))
+            self.offset += len(iterator)
+            self.current += 1
+        raise StopIteration
+
+    def __len__(self):
+        return self.shape[0]
+
+    def recommended_chunk_shape(self):
+        return self.chunks
+
+    def recommended_data_shape(self):
+        return self.shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    @property
+    def maxshape(self):
+        return self.shape
+
+
+def h5dataio(data, layout, buffer_bytes=DEFAULT_BUFFER_BYTES, time_axis=0,
+             scale=None):
+    '''H5DataIO streaming 'data' with the chunking and filters of 'layout'
+
+    Data are stored with time along the first axis (the NWB convention).
+    '''
+    shape = data.shape
+    shape = (shape[time_axis],) + \
+        tuple(n for idx, n in enumerate(shape) if idx != time_axis)
+    itemsize = 8 if scale is not None else np.dtype(data.dtype).itemsize
+    chunks = layout.chunks(shape, itemsize, time_axis=0)
+    iterator = DataArrayChunkIterator(data, chunks, buffer_bytes, time_axis,
+                                      scale)
+    return H5DataIO(data=iterator, chunks=chunks, **layout.filters)
+
+
+def unit_scale(unit, target):
+    '''factor converting values in 'unit' to 'target' (None if impossible)'''
+    if not unit:
+        return None
+    try:
+        return float(pq.Quantity(1.0, unit).rescale(target))
+    except (LookupError, ValueError):
+        return None
+
+
+def time_axis(data):
+    '''index of the sampled or range (time) dimension of 'data' or None'''
+    for idx, dim in enumerate(data.dimensions):
+        if dim.dimension_type == nix.DimensionType.Sample:
+            return idx
+        if dim.dimension_type == nix.DimensionType.Range and not dim.is_alias:
+            return idx
+    return None
+
+
+def is_event_array(data):
+    '''one-dimensional alias range DataArray holding event times'''
+    dims = data.dimensions
+    return (len(dims) == 1 and
+            dims[0].dimension_type == nix.DimensionType.Range and
+            dims[0].is_alias)
+
+
+def create_electrodes(out, data, axis):
+    '''add an electrode for every channel of 'data' to the electrodes table
+
+    The electrodes get the labels of the set dimension (or the channel
+    index) and a new electrode group named after the DataArray.  Returns the
+    table region of the new electrodes.
+    '''
+    chanaxis = 1 - axis
+    nchan = data.shape[chanaxis]
+    dim = data.dimensions[chanaxis]
+    labels = None
+    if dim.dimension_type == nix.DimensionType.Set:
+        labels = dim.labels
+    if not labels:
+        labels = [str(idx) for idx in range(nchan)]
+
+    if out.electrodes is None or 'label' not in out.electrodes.colnames:
+        out.add_electrode_column('label', 'channel label of the NIX data')
+    device = out.devices.get('nix')
+    if device is None:
+        device = out.create_device(name='nix')
+    group = out.create_electrode_group(name=data.name,
+                                       description=f'channels of {data.name}',
+                                       location='unknown', device=device)
+    first = len(out.electrodes)
+    for label in labels:
+        out.add_electrode(group=group, location='unknown', label=label)
+    return out.create_electrode_table_region(list(range(first, first + nchan)),
+                                             f'channels of {data.name}')
+
+
+def convert_series(out, data, axis, pending, layout=None,
+                   buffer_bytes=DEFAULT_BUFFER_BYTES):
+    '''convert sampled or range data with one or two dimensions
+
+    'axis' is the time dimension, which becomes 'rate' and 'starting_time'
+    if sampled and 'timestamps' if it is a range dimension.  Two-dimensional
+    data with a unit of voltage become a multichannel ElectricalSeries with
+    one electrode per channel, all others a TimeSeries.
+
+    With the 'source' layout and if the NWB dataset can be created with the
+    chunking and filters of the NIX data, it is written empty and
+    (source, path) is added to 'pending' to copy the compressed chunks after
+    the NWB file has been written.  Otherwise the data are streamed in
+    blocks while the NWB file is written.
+    '''
+    if layout is None:
+        layout = Layout(access='source')
+    dim = data.dimensions[axis]
+    kwargs = dict()
+    if dim.dimension_type == nix.DimensionType.Sample:
+        q = pq.Quantity(dim.sampling_interval, dim.unit)
+        rate = (1 / q.rescale(pq.s)).rescale(pq.Hz)
+        kwargs['rate'] = float(rate)
+        offset = pq.Quantity(dim.offset or 0.0, dim.unit)
+        kwargs['starting_time'] = float(offset.rescale(pq.s))
+        print(f"{data.name}, {len(data.shape)}d, sampled data: {rate}",
+              file=sys.stderr)
+    else:
+        ticks = dim._h5group.group['ticks']
+        kwargs['timestamps'] = h5dataio(ticks, layout, buffer_bytes,
+                                        scale=unit_scale(dim.unit, pq.s))
+        print(f"{data.name}, {len(data.shape)}d, range data", file=sys.stderr)
+
+    source = data._h5group.group['data']
+    dataio = None
+    if layout.follows(source) and axis == 0 and \
+       not len(data.polynom_coefficients) and not data.expansion_origin:
+        dataio = h5dataio_like(source)
+    if dataio is not None:
+        pending.append((source, f'/acquisition/{data.name}/data'))
+    else:
+        dataio = h5dataio(data, layout, buffer_bytes, axis)
+
+    conversion = unit_scale(data.unit, pq.V)
+    if len(data.shape) == 2 and conversion is not None:
+        electrodes = create_electrodes(out, data, axis)
+        ts = nwb.ecephys.ElectricalSeries(name=data.name, data=dataio,
+                                          electrodes=electrodes,
+                                          conversion=conversion, **kwargs)
+    else:
+        ts = nwb.TimeSeries(name=data.name, data=dataio,
+                            unit=data.unit or 'n/a', **kwargs)
     out.add_acquisition(ts)
 
 
-def main():
-    '''Main entry point'''
-    parser = argparse.ArgumentParser(description='nwb2nix')
-    parser.add_argument('-v', '--version', action='store_true', default=False)
-    parser.add_argument('FILE', type=str)
-    args = parser.parse_args()
+def convert_events(out, arrays, layout=None,
+                   buffer_bytes=DEFAULT_BUFFER_BYTES):
+    '''convert event time arrays (alias range DataArrays) to a units table
+
+    Every DataArray becomes one unit whose spike times are the event times
+    in seconds; the name of the DataArray is stored in the 'label' column.
+    The event times are streamed into the ragged spike times column.
+    '''
+    if layout is None:
+        layout = Layout(access='source')
+    events = [(da, unit_scale(da.unit, pq.s)) for da in arrays]
+    for da, scale in events:
+        if scale is None:
+            print(f"Skipping {da.name}: unit '{da.unit}' is not a time",
+                  file=sys.stderr)
+    events = [(da, scale) for da, scale in events if scale is not None]
+    if not events:
+        return None
+
+    total = sum(da.shape[0] for da, _ in events)
+    chunks = layout.chunks((total,), 8, time_axis=0)
+    iterators = [DataArrayChunkIterator(da, chunks, buffer_bytes, scale=scale)
+                 for da, scale in events]
+    spike_times = VectorData(
+        name='spike_times',
+        description='the spike times for each unit in seconds',
+        data=H5DataIO(data=ConcatChunkIterator(iterators, chunks),
+                      chunks=chunks, **layout.filters))
+    index = VectorIndex(name='spike_times_index',
+                        data=np.cumsum([da.shape[0] for da, _ in events]),
+                        target=spike_times)
+    labels = VectorData(name='label', description='name of the NIX DataArray',
+                        data=[da.name for da, _ in events])
+    # the index has to come before the (iterator) column it indexes
+    out.units = nwb.misc.Units(name='units', id=list(range(len(events))),
+                               columns=[index, spike_times, labels],
+                               colnames=['spike_times', 'label'])
+    return out.units
+
+
+def copy_pending(nwbname, pending):
+    '''fill the datasets written empty by convert_series'''
+    with h5py.File(nwbname, 'a') as h5out:
+        for source, path in pending:
+            progress = Progress(path, source.size * source.dtype.itemsize)
+            copy(source, h5out[path], progress=progress)
+            progress.finish()
+
 
-    if args.version:
-        print(f"NIX: {nix.__version__}")
-        print(f"NWB: {nwb.__version__}")
-        sys.exit(0)
+@operation('nix2nwb.convert_block')
+def convert_block(b, nwbname=None, layout=None,
+                  buffer_bytes=DEFAULT_BUFFER_BYTES):
+    '''convert a block recorded with relacs to <name>.nwb (or 'nwbname')
 
+    Data are streamed from the NIX file while the NWB file is written,
+    'buffer_bytes' bounds the size of the blocks held in memory.
+    '''
+    md = b.metadata
+    recording = md['Recording']
+    name = recording['Name']
+    dt = make_recoding_time(recording)
+    # now to nwb
+
+    out = nwb.NWBFile(identifier=name,
+                      session_description=name,  #TODO
+                      session_start_time=dt)
+
+    pending = []
+    events = []
+    for data in b.data_arrays:
+        if is_event_array(data):
+            events.append(data)
+            continue
+        axis = time_axis(data)
+        if axis is None or len(data.shape) > 2:
+            print(f"Skipping {data.name}: unsupported dimensions",
+                  file=sys.stderr)
+            continue
+        convert_series(out, data, axis, pending, layout, buffer_bytes)
+    if events:
+        convert_events(out, events, layout, buffer_bytes)
+
+    nwbname = str(nwbname or f'{name}.nwb')
+    print(f'writing {nwbname}', file=sys.stderr)
+    with nwb.NWBHDF5IO(nwbname, 'w') as w, operation('nix2nwb.write'):
+        w.write(out)
+    with operation('nix2nwb.copy_pending'):
+        copy_pending(nwbname, pending)
+    return nwbname
+
+
+def run(args):
+    '''convert the file given in the parsed command line arguments'''
+    layout = Layout.from_namespace(args)
     p = Path(args.FILE).resolve()
     print(f"Loading {p}", file=sys.stderr)
     nfd = nix.File.open(str(p), nix.FileMode.ReadOnly)
     for b in nfd.blocks:
-        md = b.metadata
-        recording = md['Recording']
-        name = recording['Name']
-        dt = make_recoding_time(recording)
-        print(dt)
-        # now to nwb
-
-        out = nwb.NWBFile(identifier=name,
-                          session_description=name,  #TODO
-                          session_start_time=dt)
-
-        for data in b.data_arrays:
-            dims = data.dimensions
-            if len(dims) == 1 and dims[0].dimension_type == nix.DimensionType.Sample:
-                convert_1d_sampled(out, data, md)
-
-        print(f'writing {name}.nwb', file=sys.stderr)
-        with nwb.NWBHDF5IO(f'{name}.nwb', 'w') as w:
-            w.write(out)
-        print("all done", file=sys.stderr)
+        convert_block(b, layout=layout)
+    print("all done", file=sys.stderr)
+
 
+def main():
+    '''Main entry point, see 'nixworks nix2nwb --help' '''
+    cli.main(['nix2nwb'] + sys.argv[1:])
 
 
 if __name__ == "__main__":
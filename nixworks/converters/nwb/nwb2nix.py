@@ -5,7 +5,9 @@ import sys
 
 import dataclasses
 import datetime
-import argparse
+import concurrent.futures
+import collections
+import h5py
 import nixio as nix
 import pynwb as nwb
 
@@ -16,6 +18,14 @@ import nixio as nix
 import pynwb as nwb
 import quantities as pq
 
+from ... import cli
+from ...instrument import operation
+from ..checkpoint import Checkpoint, fingerprint
+from ..layout import Layout
+from ..streaming import (Progress, block_rows, copy, copy_dataset,
+                         iter_blocks, iter_ragged, regular_sampling)
+from hdmf.common import DynamicTable, VectorIndex
+
 
 @dataclasses.dataclass
 class Context:
@@ -23,34 +33,56 @@ class Context:
     ip: nwb.NWBFile
 
     # main items
-    block: nix.pycore.Block
-    metadata: nix.pycore.Section
+    block: nix.Block
+    metadata: nix.Section
 
     # current state
-    group: nix.pycore.Group = None
+    group: nix.Group = None
 
     #general groups
-    acq_group: nix.pycore.Group = None
+    acq_group: nix.Group = None
+
+    # storage layout of converted data
+    layout: Layout = dataclasses.field(
+        default_factory=lambda: Layout(access='source'))
+
+    # bulk data copies of datasets in the NWB file are registered here and
+    # run (resumably) once all objects are created
+    checkpoint: Checkpoint = None
+
+    def copy_data(self, name, source, target):
+        if self.checkpoint is not None and isinstance(source, h5py.Dataset):
+            self.checkpoint.add(name, target, source)
+            return
+        progress = Progress(name, source.size * source.dtype.itemsize)
+        copy(source, target, progress=progress)
+        progress.finish()
 
     @property
-    def acquisition(self) -> nix.pycore.Group:
+    def acquisition(self) -> nix.Group:
         if self.acq_group is None:
             self.acq_group = self.block.create_group('acquisition', 'nwb.acquisition')
         return self.acq_group
 
 
-def convert_time_series(ctx: Context, obj: nwb.base.TimeSeries, typename='nwb.TimeSeries') -> nix.pycore.DataArray:
-    '''convert 'obj' from nix (nf) to nwb (fin)'''
-    data = obj.data
+def convert_time_series(ctx: Context, obj: nwb.base.TimeSeries,
+                        typename='nwb.TimeSeries',
+                        name: str = None) -> nix.DataArray:
+    '''convert 'obj' from nix (nf) to nwb (fin)
 
-    arr = np.empty(data.shape, dtype=data.dtype)
-    data.read_direct(arr)
+    The DataArray is named 'name' (default: the name of the series).
+    '''
+    data = obj.data
+    name = name or obj.name
 
-    da = ctx.block.create_data_array(obj.name, typename, shape=data.shape, data=arr)
+    da = ctx.layout.create_data_array(ctx.block, name, typename,
+                                      shape=data.shape, dtype=data.dtype,
+                                      time_axis=0, source=data)
+    ctx.copy_data(name, data, da._h5group.group["data"])
     da.unit = obj.unit
 
     if obj.timestamps is not None:
-        print('TODO')
+        convert_timestamps(ctx, da, obj)
     elif obj.rate > 0.0:
         stepsize = 1.0 / obj.rate
         dim = da.append_sampled_dimension(stepsize)
@@ -68,6 +100,43 @@ def convert_time_series(ctx: Context, obj: nwb.base.TimeSeries, typename='nwb.Ti
     return da
 
 
+def convert_timestamps(ctx: Context, da: nix.DataArray,
+                       obj: nwb.base.TimeSeries):
+    '''convert the timestamps of 'obj' to the time dimension of 'da'
+
+    Regularly spaced timestamps become a SampledDimension, all others a
+    RangeDimension whose ticks are copied block by block.
+    '''
+    timestamps = obj.timestamps
+    if isinstance(timestamps, nwb.base.TimeSeries):
+        # timestamps linked from another series
+        timestamps = timestamps.timestamps
+
+    regular = regular_sampling(timestamps)
+    if regular is not None:
+        offset, interval = regular
+        dim = da.append_sampled_dimension(interval)
+        dim.unit = 's'
+        dim.label = 'time'
+        dim.offset = offset
+        return dim
+
+    # create the dimension with a placeholder and stream the ticks into a
+    # dataset with the final size
+    dim = da.append_range_dimension([0.0])
+    dim.unit = 's'
+    dim.label = 'time'
+    h5group = dim._h5group.group
+    del h5group['ticks']
+    ticks = h5group.create_dataset(
+        'ticks', shape=timestamps.shape, dtype=np.float64, maxshape=(None,),
+        chunks=ctx.layout.chunks(timestamps.shape, 8), **ctx.layout.filters)
+    progress = Progress(f'{obj.name} timestamps', timestamps.size * 8)
+    copy_dataset(timestamps, ticks, progress=progress)
+    progress.finish()
+    return dim
+
+
 def convert_voltage_clamp_series(ctx: Context, obj: nwb.icephys.VoltageClampSeries):
     '''convert obj from nwb to nix'''
     da = convert_time_series(ctx, obj, ' nwb.icephys.VoltageClampSeries')
@@ -88,30 +157,259 @@ def convert_current_clamp_series(ctx: Context, obj: nwb.icephys.CurrentClampSeri
     da = convert_time_series(ctx, obj, ' nwb.icephys.CurrentClampSeries')
 
 
-def main():
-    '''main entry point'''
-    parser = argparse.ArgumentParser(description='nwb2nix')
-    parser.add_argument('-v', '--version', action='store_true', default=False)
-    parser.add_argument('FILE', type=str)
-    args = parser.parse_args()
+def is_string(data) -> bool:
+    return h5py.check_string_dtype(data.dtype) is not None
+
+
+def split_columns(table: DynamicTable):
+    '''split the columns of 'table' into scalar and other columns
+
+    Scalar columns hold one number or string per row and go into a NIX
+    DataFrame.  Ragged columns (a VectorIndex and its target) and columns
+    with more than one dimension cannot be stored in DataFrame cells.
+    '''
+    ragged = set()
+    for col in table.columns:
+        if isinstance(col, VectorIndex):
+            ragged.update((col.name, col.target.name))
+    scalar, other = [], []
+    for col in table.columns:
+        if col.name in ragged or len(col.data.shape) != 1:
+            other.append(col)
+        else:
+            scalar.append(col)
+    return scalar, other
+
+
+def convert_data_frame(ctx: Context, table: DynamicTable, name: str,
+                       typename: str, columns) -> nix.DataFrame:
+    '''write the row ids and the scalar 'columns' of 'table' to a DataFrame
+
+    Rows are appended block by block.
+    '''
+    ids = table.id.data
+    coldict = collections.OrderedDict(id=ids.dtype)
+    for col in columns:
+        coldict[col.name] = str if is_string(col.data) else col.data.dtype
+    df = ctx.block.create_data_frame(name, typename, col_dict=coldict,
+                                     compression=ctx.layout.block_compression)
+    df.definition = table.description
+
+    rows = block_rows(ids.shape, df.data_type)
+    for slc in iter_blocks(ids.shape, rows):
+        block = np.empty(slc.stop - slc.start, dtype=df.data_type)
+        block['id'] = ids[slc]
+        for col in columns:
+            block[col.name] = col.data[slc]
+        df.append(block, axis=0)
+
+    if ctx.group is not None:
+        ctx.group.data_frames.append(df)
+    return df
+
+
+def convert_column(ctx: Context, col, name: str) -> nix.DataArray:
+    '''copy a table column that does not fit a DataFrame to a DataArray'''
+    data = col.data
+    typename = f'nwb.{type(col).__name__}'
+    if is_string(data):
+        da = ctx.block.create_data_array(
+            name, typename, dtype=nix.DataType.String, shape=data.shape,
+            compression=ctx.layout.block_compression)
+        rows = block_rows(data.shape, data.dtype)
+        for slc in iter_blocks(data.shape, rows):
+            da[slc] = data[slc]
+    else:
+        da = ctx.layout.create_data_array(ctx.block, name, typename,
+                                          shape=data.shape, dtype=data.dtype,
+                                          time_axis=0, source=data)
+        ctx.copy_data(name, data, da._h5group.group['data'])
+    for _ in data.shape:
+        da.append_set_dimension()
+    da.definition = col.description
+
+    if ctx.group is not None:
+        ctx.group.data_arrays.append(da)
+    return da
 
-    if args.version:
-        print(f"NIX: {nix.__version__}")
-        print(f"NWB: {nwb.__version__}")
-        sys.exit(0)
 
-    p = Path(args.FILE).resolve()
-    print(f"Loading {p}", file=sys.stderr)
+def convert_table(ctx: Context, table: DynamicTable, name: str,
+                  typename='nwb.DynamicTable', skip=()) -> nix.DataFrame:
+    '''convert a DynamicTable
+
+    Scalar columns become a DataFrame called 'name', every other column
+    (except those in 'skip') a DataArray called '<name>.<column>'.  Ragged
+    columns keep the NWB representation: one DataArray with the values of all
+    rows and one with the end of every row (the VectorIndex).
+    '''
+    scalar, other = split_columns(table)
+    df = convert_data_frame(ctx, table, name, typename, scalar)
+    for col in other:
+        if col.name not in skip:
+            convert_column(ctx, col, f'{name}.{col.name}')
+    return df
+
+
+def convert_intervals(ctx: Context, table: nwb.epoch.TimeIntervals,
+                      name: str) -> nix.MultiTag:
+    '''convert a TimeIntervals table to a MultiTag
+
+    The start times become the positions and the durations the extents of
+    the MultiTag.  All columns of the table are converted with convert_table
+    and the DataFrame is linked as an indexed feature.
+    '''
+    df = convert_table(ctx, table, name, 'nwb.TimeIntervals')
+
+    start = table['start_time'].data
+    stop = table['stop_time'].data
+    positions = ctx.layout.create_data_array(ctx.block, f'{name}.positions',
+                                             'nwb.TimeIntervals.positions',
+                                             shape=start.shape, time_axis=0)
+    extents = ctx.layout.create_data_array(ctx.block, f'{name}.extents',
+                                           'nwb.TimeIntervals.extents',
+                                           shape=start.shape, time_axis=0)
+    posdata = positions._h5group.group['data']
+    extdata = extents._h5group.group['data']
+    rows = block_rows(start.shape, np.float64, start.chunks)
+    for slc in iter_blocks(start.shape, rows):
+        begin = start[slc]
+        posdata[slc] = begin
+        extdata[slc] = stop[slc] - begin
+    for da in (positions, extents):
+        da.unit = 's'
+        da.append_set_dimension()
+
+    mtag = ctx.block.create_multi_tag(name, 'nwb.TimeIntervals', positions)
+    mtag.extents = extents
+    mtag.units = ['s']
+    mtag.definition = table.description
+    mtag.create_feature(df, nix.LinkType.Indexed)
 
-    f = nwb.NWBHDF5IO(str(p), 'r')
+    if ctx.group is not None:
+        ctx.group.data_arrays.extend([positions, extents])
+        ctx.group.multi_tags.append(mtag)
+    return mtag
+
+
+def convert_units(ctx: Context, units: nwb.misc.Units,
+                  name='units') -> nix.DataFrame:
+    '''convert a units table
+
+    The spike times of every unit go into an alias range DataArray called
+    '<name>.<id>.spike_times', the other columns are converted with
+    convert_table.  Spike times are read block by block and distributed to
+    the units, so the ragged spike time vector is never read as a whole.
+    '''
+    columns = {col.name: col for col in units.columns}
+    spikecols = ('spike_times', 'spike_times_index')
+    df = convert_table(ctx, units, name, 'nwb.Units', skip=spikecols)
+    if not all(col in columns for col in spikecols):
+        return df
+
+    data = columns['spike_times'].data
+    index = columns['spike_times_index'].data
+    ids = units.id.data
+    targets = []
+    end = 0
+    rows = block_rows(index.shape, index.dtype, index.chunks)
+    for slc in iter_blocks(index.shape, rows):
+        ends = index[slc].astype(np.int64)
+        counts = np.diff(ends, prepend=end)
+        end = ends[-1]
+        for uid, count in zip(ids[slc], counts):
+            da = ctx.layout.create_data_array(
+                ctx.block, f'{name}.{uid}.spike_times', 'nwb.SpikeTimes',
+                shape=(count,), dtype=data.dtype, time_axis=0)
+            da.unit = 's'
+            da.label = 'spike times'
+            da.append_range_dimension_using_self()
+            if ctx.group is not None:
+                ctx.group.data_arrays.append(da)
+            targets.append(da._h5group.group['data'])
+
+    progress = Progress(f'{name} spike times', data.size * data.dtype.itemsize)
+    for row, offset, values in iter_ragged(data, index):
+        targets[row][offset:offset+len(values)] = values
+        progress.update(values.nbytes)
+    progress.finish()
+    return df
+
+
+def convert_data_interface(ctx: Context, obj, name: str):
+    '''convert a TimeSeries, table or container of those named 'name'
+    '''
+    if isinstance(obj, nwb.base.TimeSeries):
+        convert_time_series(ctx, obj, name=name)
+    elif isinstance(obj, nwb.misc.Units):
+        convert_units(ctx, obj, name)
+    elif isinstance(obj, nwb.epoch.TimeIntervals):
+        convert_intervals(ctx, obj, name)
+    elif isinstance(obj, DynamicTable):
+        convert_table(ctx, obj, name)
+    elif isinstance(obj, nwb.core.MultiContainerInterface):
+        # LFP, BehavioralTimeSeries, Position, ...
+        for child in obj.children:
+            convert_data_interface(ctx, child, f'{name}.{child.name}')
+    else:
+        print(f"Skipping {name} ({type(obj)})", file=sys.stderr)
+
+
+def convert_processing_module(ctx: Context,
+                              module: nwb.base.ProcessingModule) -> nix.Group:
+    '''convert a processing module to a group of the same name'''
+    ctx.group = ctx.block.create_group(module.name, 'nwb.ProcessingModule')
+    ctx.group.definition = module.description
+    for name, obj in module.data_interfaces.items():
+        convert_data_interface(ctx, obj, f'{module.name}.{name}')
+    return ctx.group
+
+
+@operation('nwb2nix.convert_file')
+def convert_file(nwbpath: Path, nixpath: Path, layout: Layout = None,
+                 jobs: int = 1, resume: bool = True):
+    '''convert the NWB file at nwbpath to a new NIX file at nixpath
+
+    The conversion is checkpointed (see checkpoint.py): it writes to
+    '<nixpath>.part', which is renamed to nixpath once complete.  If a
+    conversion of the same file with the same layout was interrupted, it
+    continues from the last complete chunk of every array, unless 'resume'
+    is False.
+
+    The data of all series are copied in a pipeline with 'jobs' reader
+    threads prefetching and decoding chunks while one writer commits them to
+    the NIX file.
+    '''
+    if layout is None:
+        layout = Layout(access='source')
+    key = fingerprint(nwbpath, layout)
+    with Checkpoint.open(nixpath, key, resume) as checkpoint:
+        if checkpoint.prepared:
+            print(f"Resuming {nwbpath}", file=sys.stderr)
+        else:
+            convert_structure(nwbpath, checkpoint, layout)
+        with h5py.File(str(nwbpath), 'r') as h5file, operation('nwb2nix.copy'):
+            checkpoint.copy(h5file, jobs)
+        return checkpoint.finish()
+
+
+@operation('nwb2nix.structure')
+def convert_structure(nwbpath: Path, checkpoint: Checkpoint, layout: Layout):
+    '''create all objects of the NIX file for the NWB file at nwbpath
+
+    Bulk data copies are registered with the checkpoint instead of run.
+    '''
+    print(f"Loading {nwbpath}", file=sys.stderr)
+
+    f = nwb.NWBHDF5IO(str(nwbpath), 'r')
     fin = f.read()
 
-    basename = p.stem
-    nf = nix.File.open(basename + '.nix', nix.FileMode.Overwrite)
+    basename = nwbpath.stem
+    nf = checkpoint.nixfile
     block = nf.create_block(basename, 'nwb.file')
 
     md = nf.create_section(basename, 'recording')
-    ctx = Context(nf=nf, ip=fin, block=block, metadata=md)
+    ctx = Context(nf=nf, ip=fin, block=block, metadata=md, layout=layout,
+                  checkpoint=checkpoint)
 
     sst = fin.session_start_time.astimezone(datetime.timezone.utc)
 
@@ -131,6 +429,102 @@ def main():
         elif isinstance(obj, nwb.base.TimeSeries):
             convert_time_series(ctx, obj)
 
+    for name, module in fin.processing.items():
+        print(f"{name} ({type(module)})")
+        convert_processing_module(ctx, module)
+
+    if fin.stimulus:
+        ctx.group = block.create_group('stimulus', 'nwb.stimulus')
+        for name, obj in fin.stimulus.items():
+            print(f"{name} ({type(obj)})")
+            convert_data_interface(ctx, obj, f'stimulus.{name}')
+
+    if fin.intervals:
+        ctx.group = block.create_group('intervals', 'nwb.intervals')
+        for name, table in fin.intervals.items():
+            print(f"{name} ({type(table)})")
+            convert_intervals(ctx, table, name)
+
+    if fin.units is not None:
+        ctx.group = block.create_group('units', 'nwb.units')
+        convert_units(ctx, fin.units)
+
+    checkpoint.prepare()
+    f.close()
+
+
+def output_paths(nwbpaths, outdir: Path):
+    '''map every input path to <outdir>/<stem>.nix
+
+    Raises a ValueError if several inputs have the same stem (compared
+    case-insensitively), since their conversions would write the same file.
+    '''
+    outputs = {}
+    seen = {}
+    for p in nwbpaths:
+        key = p.stem.casefold()
+        if key in seen:
+            raise ValueError(f"{seen[key]} and {p} would both be converted "
+                             f"to {outdir / (p.stem + '.nix')}")
+        seen[key] = p
+        outputs[p] = outdir / (p.stem + '.nix')
+    return outputs
+
+
+def convert_batch(nwbpaths, outdir: Path, layout: Layout = None, jobs: int = 1,
+                  processes: int = None, resume: bool = True):
+    '''convert many NWB files in a process pool
+
+    Each file is converted by convert_file in its own process, writing
+    <outdir>/<stem>.nix; inputs with the same stem are rejected (see
+    output_paths).  Returns a dictionary mapping every input path to the
+    created NIX file or the exception raised by its conversion.
+    '''
+    outputs = output_paths(nwbpaths, outdir)
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = {pool.submit(convert_file, p, outputs[p], layout, jobs,
+                               resume): p for p in nwbpaths}
+        for future in concurrent.futures.as_completed(futures):
+            p = futures[future]
+            try:
+                results[p] = future.result()
+            except Exception as exc:
+                results[p] = exc
+    return results
+
+
+def run(args):
+    '''convert the files given in the parsed command line arguments'''
+    layout = Layout.from_namespace(args)
+    outdir = Path(args.output_dir)
+    paths = [Path(fname).resolve() for fname in args.FILE]
+    try:
+        outputs = output_paths(paths, outdir)
+    except ValueError as exc:
+        sys.exit(str(exc))
+    if len(paths) == 1:
+        p = paths[0]
+        convert_file(p, outputs[p], layout, args.jobs, not args.restart)
+        return
+
+    results = convert_batch(paths, outdir, layout, args.jobs, args.processes,
+                            not args.restart)
+    failed = 0
+    for p, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"FAILED {p}: {result}", file=sys.stderr)
+        else:
+            print(f"{p} -> {result}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    '''main entry point, see 'nixworks nwb2nix --help' '''
+    cli.main(['nwb2nix'] + sys.argv[1:])
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,613 @@
+"""
+streaming.py
+
+Bounded-memory copies between HDF5 datasets for the converters.
+
+NWB and NIX data are both stored in HDF5 datasets.  Instead of reading a
+whole source dataset into memory and creating the target from it, the
+converters create the target dataset with its final shape and data type and
+copy the data block by block.  Blocks span whole rows along the first axis
+(the time axis in NWB) and are aligned to the chunking of the source
+dataset, so every source chunk is read and decompressed exactly once.  A
+single buffer is reused for all blocks, which bounds the memory used by a
+copy regardless of the length of the recording.
+
+When source and target have the same data type, chunk shape and filter
+pipeline (e.g., when the target was created with the creation properties of
+the source), the stored chunks are copied as they are with HDF5 direct chunk
+reads and writes, skipping decompression and recompression entirely.  'copy()'
+picks this fast path when possible and falls back to 'copy_dataset()'
+otherwise.
+
+'copy_pipelined()' copies several datasets with a pool of reader threads
+prefetching upcoming blocks while the calling thread writes.  Since h5py
+serialises all HDF5 calls, readers fetch the stored chunks of deflate and
+shuffle compressed datasets raw and decode them with zlib and NumPy, which
+run in parallel outside the HDF5 library.  Likewise, if the target uses
+these filters, the readers also encode the target chunks and the writer
+only stores them with direct chunk writes.
+"""
+import sys
+import time
+import zlib
+import math
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+from ..instrument import count_read
+
+
+DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+def block_rows(shape, dtype, chunks=None, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Number of rows (along the first axis) to copy at once.
+
+    The number of rows is a multiple of the chunk length along the first
+    axis (if the dataset is chunked) and fits into 'buffer_bytes', but is
+    never less than one chunk row.
+
+    :param shape: Shape of the dataset.
+    :param dtype: Data type of the dataset.
+    :param chunks: Chunk shape of the dataset or None.
+    :param buffer_bytes: Target size of the copy buffer.
+    :rtype: int
+    """
+    if not len(shape):
+        return 1
+    rowbytes = max(int(np.prod(shape[1:])) * np.dtype(dtype).itemsize, 1)
+    step = chunks[0] if chunks else 1
+    rows = max(buffer_bytes // rowbytes // step, 1) * step
+    return max(min(rows, shape[0]), 1)
+
+
+def iter_blocks(shape, rows, first=0):
+    """
+    Yield slices along the first axis covering 'shape' in blocks of 'rows',
+    beginning at row 'first'.
+    """
+    for start in range(first, shape[0], rows):
+        yield slice(start, min(start + rows, shape[0]))
+
+
+def regular_sampling(timestamps, tolerance=0.01):
+    """
+    Detect regularly spaced timestamps.
+
+    Returns (offset, interval) if every timestamp deviates less than
+    'tolerance' sampling intervals from offset + index * interval, else
+    None.  The timestamps are checked block by block and the check stops at
+    the first deviating block.
+    """
+    n = timestamps.shape[0]
+    if n < 2:
+        return None
+    first = float(timestamps[0])
+    interval = (float(timestamps[n-1]) - first) / (n - 1)
+    if interval <= 0:
+        return None
+    maxdev = tolerance * interval
+    rows = block_rows(timestamps.shape, timestamps.dtype,
+                      getattr(timestamps, 'chunks', None))
+    for slc in iter_blocks(timestamps.shape, rows):
+        expected = first + np.arange(slc.start, slc.stop) * interval
+        if np.max(np.abs(timestamps[slc] - expected)) > maxdev:
+            return None
+    return first, interval
+
+
+def iter_ragged(data, index, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Split a ragged column into its rows block by block.
+
+    A ragged column (e.g., the spike times of an NWB units table) stores the
+    values of all rows back to back in 'data', and 'index' holds the end
+    (exclusive) of every row in 'data'.  Both datasets are read in
+    chunk-aligned blocks of at most 'buffer_bytes', so neither is ever read
+    as a whole.  Yields (row, offset, values) for every part of a row that
+    lies in a data block, where 'offset' is the position of 'values' within
+    the row.  Empty rows are skipped.
+
+    :param data: Dataset with the values of all rows.
+    :param index: Dataset with the end of every row in 'data'.
+    :param buffer_bytes: Target size of the read blocks.
+    """
+    rows = block_rows(data.shape, data.dtype, data.chunks, buffer_bytes)
+    iblocks = iter_blocks(index.shape, block_rows(index.shape, index.dtype,
+                                                  index.chunks, buffer_bytes))
+    ends = np.empty(0, dtype=np.int64)  # ends of the rows not done yet
+    first = 0  # row number of ends[0]
+    start = 0  # start of row 'first' in data
+    for dslc in iter_blocks(data.shape, rows):
+        # drop the rows ending before this block and read index blocks until
+        # the rows overlapping this block are known
+        while True:
+            done = int(np.searchsorted(ends, dslc.start, side="right"))
+            if done:
+                start = int(ends[done-1])
+                ends = ends[done:]
+                first += done
+            if len(ends) and ends[-1] >= dslc.stop:
+                break
+            islc = next(iblocks, None)
+            if islc is None:
+                break
+            ends = np.concatenate((ends, index[islc].astype(np.int64)))
+
+        values = data[dslc]
+        starts = np.concatenate(([start], ends[:-1]))
+        for idx, (rstart, rend) in enumerate(zip(starts, ends)):
+            if rstart >= dslc.stop:
+                break
+            lo = max(rstart, dslc.start)
+            hi = min(rend, dslc.stop)
+            if hi > lo:
+                yield (first + idx, int(lo - rstart),
+                       values[lo-dslc.start:hi-dslc.start])
+
+
+class Progress:
+    """
+    Progress and throughput report for a copy, written to stderr.
+
+    :param name: Name of the copied object shown in the report.
+    :param total: Total number of bytes to copy.
+    :param interval: Minimum time (s) between two reports.
+    :param file: Stream to write to.  Defaults to sys.stderr.
+    """
+
+    def __init__(self, name, total, interval=1.0, file=None):
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.file = file
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def throughput(self):
+        """Throughput in bytes per second."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, nbytes):
+        self.done += nbytes
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(end="\r")
+
+    def report(self, end="\n"):
+        percent = 100 * self.done / self.total if self.total else 100
+        print(f"  {self.name}: {percent:5.1f}% "
+              f"{self.done / 2**20:.1f} MiB "
+              f"({self.throughput / 2**20:.1f} MiB/s)",
+              file=self.file or sys.stderr, end=end, flush=True)
+
+    def finish(self):
+        self.report()
+
+
+def copy_dataset(source, target, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 progress=None):
+    """
+    Copy the contents of an HDF5 dataset into another dataset of the same
+    shape block by block.
+
+    :param source: Source h5py.Dataset.
+    :param target: Target h5py.Dataset with the same shape.
+    :param buffer_bytes: Target size of the copy buffer.
+    :param progress: Progress object to report to.
+    """
+    if source.shape != target.shape:
+        raise ValueError(f"Shape mismatch: {source.shape} != {target.shape}")
+    if not len(source.shape):
+        target[()] = source[()]
+        return
+
+    rows = block_rows(source.shape, source.dtype, source.chunks,
+                      buffer_bytes)
+    buffer = np.empty((rows,) + source.shape[1:], dtype=source.dtype)
+    for slc in iter_blocks(source.shape, rows):
+        nrows = slc.stop - slc.start
+        if not nrows:
+            continue
+        source.read_direct(buffer, source_sel=np.s_[slc],
+                           dest_sel=np.s_[:nrows])
+        target.write_direct(buffer, source_sel=np.s_[:nrows],
+                            dest_sel=np.s_[slc])
+        if progress is not None:
+            progress.update(buffer[:nrows].nbytes)
+
+
+def filter_pipeline(dataset):
+    """
+    The filter pipeline of an HDF5 dataset as a list of (filter code,
+    filter parameters) tuples.
+
+    :param dataset: h5py.Dataset
+    :rtype: list of tuple
+    """
+    plist = dataset.id.get_create_plist()
+    pipeline = list()
+    for idx in range(plist.get_nfilters()):
+        code, _, values, _ = plist.get_filter(idx)
+        pipeline.append((code, tuple(values)))
+    return pipeline
+
+
+def can_copy_chunks(source, target):
+    """
+    True if the stored chunks of 'source' can be copied into 'target' without
+    decoding: same shape, data type, chunk shape and filter pipeline.
+    """
+    return (source.chunks is not None and
+            source.shape == target.shape and
+            source.dtype == target.dtype and
+            source.chunks == target.chunks and
+            filter_pipeline(source) == filter_pipeline(target))
+
+
+def read_raw_chunk(dataset, offset):
+    """
+    Read the chunk at 'offset' of 'dataset' as it is stored, reporting the
+    read to an active instrument.Recorder.
+
+    :returns: The filter mask and the stored bytes.
+    """
+    t0 = time.perf_counter()
+    filter_mask, chunk = dataset.id.read_direct_chunk(offset)
+    count_read(len(chunk), time.perf_counter() - t0)
+    return filter_mask, chunk
+
+
+def chunk_nbytes(dataset, offset):
+    """
+    Size in bytes of the (decoded) values of the chunk at 'offset' of
+    'dataset'; chunks at the end of the dataset are counted as far as they
+    lie within it.
+    """
+    count = 1
+    for start, length, size in zip(offset, dataset.chunks, dataset.shape):
+        count *= max(min(length, size - start), 0)
+    return count * dataset.dtype.itemsize
+
+
+def copy_chunks(source, target, progress=None):
+    """
+    Copy all allocated chunks of 'source' into 'target' as they are stored
+    (still compressed) using HDF5 direct chunk reads and writes.  The caller
+    must make sure the datasets are compatible (see 'can_copy_chunks()').
+
+    :param source: Source h5py.Dataset.
+    :param target: Target h5py.Dataset.
+    :param progress: Progress object to report to.  Reports the size of the
+    values of the chunks (see 'chunk_nbytes()'), like the other copies,
+    not the size stored.
+    """
+    for idx in range(source.id.get_num_chunks()):
+        info = source.id.get_chunk_info(idx)
+        filter_mask, chunk = read_raw_chunk(source, info.chunk_offset)
+        target.id.write_direct_chunk(info.chunk_offset, chunk, filter_mask)
+        if progress is not None:
+            progress.update(chunk_nbytes(source, info.chunk_offset))
+
+
+def copy(source, target, buffer_bytes=DEFAULT_BUFFER_BYTES, progress=None):
+    """
+    Copy the contents of 'source' into 'target', copying raw chunks if
+    possible and decoded blocks otherwise.
+
+    :param source: Source h5py.Dataset.
+    :param target: Target h5py.Dataset with the same shape.
+    :param buffer_bytes: Target size of the copy buffer.
+    :param progress: Progress object to report to.
+    :returns: True if raw chunks were copied.
+    :rtype: bool
+    """
+    if can_copy_chunks(source, target):
+        copy_chunks(source, target, progress)
+        return True
+    copy_dataset(source, target, buffer_bytes, progress)
+    return False
+
+
+# filters 'decode_chunk()' can undo outside of HDF5
+DECODABLE_FILTERS = {h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE}
+
+
+def can_decode(dataset):
+    """
+    True if the stored chunks of 'dataset' can be decoded by
+    'decode_chunk()'.
+    """
+    return (dataset.chunks is not None and
+            all(code in DECODABLE_FILTERS
+                for code, _ in filter_pipeline(dataset)))
+
+
+def decode_chunk(raw, pipeline, filter_mask, dtype, chunks):
+    """
+    Decode a chunk as returned by a direct chunk read.
+
+    :param raw: The stored chunk bytes.
+    :param pipeline: Filter pipeline of the dataset (see 'filter_pipeline()').
+    :param filter_mask: Filter mask of the chunk (bit i set: filter i was
+    not applied).
+    :param dtype: Data type of the dataset.
+    :param chunks: Chunk shape of the dataset.
+    :rtype: numpy.ndarray with shape 'chunks'
+    """
+    data = raw
+    for idx in reversed(range(len(pipeline))):
+        if filter_mask & (1 << idx):
+            continue
+        code, values = pipeline[idx]
+        if code == h5py.h5z.FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif code == h5py.h5z.FILTER_SHUFFLE:
+            itemsize = values[0] if values else dtype.itemsize
+            shuffled = np.frombuffer(data, dtype=np.uint8)
+            data = shuffled.reshape(itemsize, -1).T.tobytes()
+        else:
+            raise ValueError(f"Cannot decode HDF5 filter {code}")
+    return np.frombuffer(data, dtype=dtype).reshape(chunks)
+
+
+def encode_chunk(chunk, pipeline):
+    """
+    Encode a chunk for a direct chunk write to a dataset with the given
+    filter pipeline (see 'can_decode()').
+
+    :param chunk: Contiguous array with the full chunk shape.
+    :param pipeline: Filter pipeline of the target dataset.
+    :rtype: bytes
+    """
+    data = chunk.tobytes()
+    for code, values in pipeline:
+        if code == h5py.h5z.FILTER_SHUFFLE:
+            itemsize = values[0] if values else chunk.dtype.itemsize
+            unshuffled = np.frombuffer(data, dtype=np.uint8)
+            data = unshuffled.reshape(-1, itemsize).T.tobytes()
+        elif code == h5py.h5z.FILTER_DEFLATE:
+            data = zlib.compress(data, values[0] if values else 6)
+        else:
+            raise ValueError(f"Cannot encode HDF5 filter {code}")
+    return data
+
+
+def chunk_offsets(shape, chunks, rows):
+    """
+    Offsets of all chunks of a dataset with the given shape and chunk shape
+    starting within the rows 'rows' (a range along the first axis).
+    """
+    offsets = [range(rows.start, rows.stop, chunks[0])]
+    offsets += [range(0, dimlen, clen)
+                for dimlen, clen in zip(shape[1:], chunks[1:])]
+    return itertools.product(*offsets)
+
+
+def encode_block(block, start, shape, chunks, dtype, pipeline):
+    """
+    Split the rows [start, start + len(block)) of a dataset into chunks and
+    encode them.  'start' must be aligned to the chunk length of the first
+    axis.  Partial chunks at the edges of the dataset are padded with zeros.
+
+    :rtype: list of (chunk offset, encoded bytes) tuples
+    """
+    encoded = list()
+    block = np.asarray(block, dtype=dtype)
+    rows = range(start, start + block.shape[0])
+    for offset in chunk_offsets(shape, chunks, rows):
+        region = tuple(slice(o, min(o + c, dimlen))
+                       for o, c, dimlen in zip(offset, chunks, shape))
+        region = (slice(region[0].start - start,
+                        region[0].stop - start),) + region[1:]
+        part = block[region]
+        if part.shape != tuple(chunks):
+            chunk = np.zeros(chunks, dtype=dtype)
+            chunk[tuple(slice(0, n) for n in part.shape)] = part
+            part = chunk
+        encoded.append((offset, encode_chunk(np.ascontiguousarray(part),
+                                             pipeline)))
+    return encoded
+
+
+def read_block(dataset, slc, pipeline=None, out=None):
+    """
+    Read the rows 'slc' (with start and stop set) of 'dataset'.  If a filter
+    pipeline is given (see 'can_decode()'), the chunks are read raw and
+    decoded outside of HDF5, and the rows of every chunk within 'slc' are
+    copied into the block.
+
+    :param dataset: Source h5py.Dataset.
+    :param slc: Slice along the first axis.
+    :param pipeline: Filter pipeline of the dataset or None.
+    :param out: C-contiguous array with the shape of the rows to read into
+    instead of a new one.
+    :rtype: numpy.ndarray
+    """
+    if pipeline is None:
+        if out is None:
+            return dataset[slc]
+        dataset.read_direct(out, source_sel=np.s_[slc])
+        return out
+
+    shape = dataset.shape
+    chunks = dataset.chunks
+    dtype = dataset.dtype
+    block = out
+    if block is None:
+        block = np.empty((slc.stop - slc.start,) + shape[1:], dtype=dtype)
+    first = slc.start - slc.start % chunks[0]
+    for offset in chunk_offsets(shape, chunks, range(first, slc.stop)):
+        target = tuple(slice(start, min(start + clen, dimlen))
+                       for start, clen, dimlen in zip(offset, chunks, shape))
+        # the rows of the chunk within 'slc'
+        low = max(target[0].start, slc.start)
+        high = min(target[0].stop, slc.stop)
+        region = (slice(low - slc.start, high - slc.start),) + target[1:]
+        info = dataset.id.get_chunk_info_by_coord(offset)
+        if info.byte_offset is None:
+            # chunk not allocated
+            block[region] = dataset.fillvalue
+            continue
+        filter_mask, raw = read_raw_chunk(dataset, offset)
+        chunk = decode_chunk(raw, pipeline, filter_mask, dtype, chunks)
+        block[region] = chunk[(slice(low - offset[0], high - offset[0]),) +
+                              tuple(slice(0, t.stop - t.start)
+                                    for t in target[1:])]
+    return block
+
+
+def transfer_block(source, slc, pipeline, target_info=None):
+    """
+    Read (and decode) the rows 'slc' of 'source'.  If 'target_info' (shape,
+    chunks, dtype, pipeline of the target) is given, the block is also
+    encoded into target chunks.
+
+    :returns: The block and the encoded chunks (or None).
+    """
+    block = read_block(source, slc, pipeline)
+    if target_info is None:
+        return block, None
+    return block, encode_block(block, slc.start, *target_info)
+
+
+def read_chunks(source, slc):
+    """
+    Read the allocated chunks of 'source' starting in the rows 'slc' as they
+    are stored.  'slc.start' must be aligned to the chunks of 'source'.
+
+    :returns: List of (offset, filter_mask, data) tuples for
+    'Dataset.id.write_direct_chunk()'.
+    """
+    chunks = []
+    for offset in chunk_offsets(source.shape, source.chunks,
+                                range(slc.start, slc.stop)):
+        info = source.id.get_chunk_info_by_coord(offset)
+        if info.byte_offset is None:
+            continue
+        filter_mask, chunk = read_raw_chunk(source, offset)
+        chunks.append((offset, chunk, filter_mask))
+    return chunks
+
+
+def copy_pipelined(tasks, jobs, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                   start=None, committed=None):
+    """
+    Copy several datasets with 'jobs' reader threads prefetching blocks
+    while the calling thread writes them in order.
+
+    Datasets allowing raw chunk copies (see 'can_copy_chunks()') are copied
+    that way.  At most 2 * jobs blocks are in flight, and the blocks are
+    sized so that they fit into 'buffer_bytes' together.  If the target is
+    compressed with filters 'encode_chunk()' supports, blocks are aligned to
+    the chunks of both datasets and encoded by the readers as well.
+
+    :param tasks: List of (source, target, progress) tuples; progress may be
+    None.
+    :param jobs: Number of reader threads.
+    :param buffer_bytes: Memory budget for blocks in flight.
+    :param start: Optional list with the first row to copy for every task,
+    for resuming an interrupted copy.  It is rounded down to the block
+    alignment, so a few rows may be copied again.
+    :param committed: Optional callable 'committed(index, rows)' called
+    after the first 'rows' rows of task 'index' are written.  If it is
+    given, raw chunk copies are done block by block as well.
+    """
+    prefetch = 2 * jobs
+    blockbytes = buffer_bytes // prefetch
+
+    def steps(pool):
+        # ("copy", ...) copies a whole dataset in the writer, ("block", ...)
+        # writes one block read by the pool, ("chunks", ...) the raw chunks
+        # of one block read by the pool, ("done", ...) ends a dataset
+        for index, (source, target, progress) in enumerate(tasks):
+            if source.shape != target.shape:
+                raise ValueError(f"Shape mismatch: {source.shape} != "
+                                 f"{target.shape}")
+            first = start[index] if start is not None else 0
+            if not len(source.shape) or first >= source.shape[0]:
+                step = "copy" if first == 0 else "done"
+                yield step, source, target, progress, index
+                continue
+            if can_copy_chunks(source, target):
+                if committed is None and first == 0:
+                    yield "copy", source, target, progress, index
+                    continue
+                step = source.chunks[0]
+                rows = block_rows(source.shape, source.dtype, (step,),
+                                  blockbytes)
+                for slc in iter_blocks(source.shape, rows,
+                                       first - first % step):
+                    future = pool.submit(read_chunks, source, slc)
+                    yield "chunks", source, target, progress, (index, slc,
+                                                               future)
+                yield "done", source, target, progress, index
+                continue
+            pipeline = filter_pipeline(source) if can_decode(source) else None
+            step = source.chunks[0] if source.chunks else 1
+            target_info = None
+            if can_decode(target) and filter_pipeline(target):
+                tstep = target.chunks[0]
+                step = step * tstep // math.gcd(step, tstep)
+                rowbytes = target.dtype.itemsize * \
+                    int(np.prod(target.shape[1:]))
+                if step * rowbytes <= 4 * blockbytes:
+                    target_info = (target.shape, target.chunks, target.dtype,
+                                   filter_pipeline(target))
+            rows = block_rows(source.shape, source.dtype, (step,), blockbytes)
+            for slc in iter_blocks(source.shape, rows, first - first % step):
+                future = pool.submit(transfer_block, source, slc, pipeline,
+                                     target_info)
+                yield "block", source, target, progress, (index, slc, future)
+            yield "done", source, target, progress, index
+
+    def write(step, source, target, progress, payload):
+        if step == "copy":
+            copy(source, target, progress=progress)
+        if step in ("copy", "done"):
+            if committed is not None:
+                committed(payload, source.shape[0] if source.shape else 0)
+            if progress is not None:
+                progress.finish()
+            return
+        index, slc, future = payload
+        if step == "chunks":
+            nbytes = 0
+            for offset, chunk, filter_mask in future.result():
+                target.id.write_direct_chunk(offset, chunk, filter_mask)
+                nbytes += chunk_nbytes(source, offset)
+        else:
+            block, encoded = future.result()
+            if encoded is None:
+                target.write_direct(np.ascontiguousarray(block),
+                                    dest_sel=np.s_[slc])
+            else:
+                for offset, chunk in encoded:
+                    target.id.write_direct_chunk(offset, chunk)
+            nbytes = block.nbytes
+        if progress is not None:
+            progress.update(nbytes)
+        if committed is not None:
+            committed(index, slc.stop)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        inflight = deque()
+        for step in steps(pool):
+            inflight.append(step)
+            if len(inflight) >= prefetch:
+                write(*inflight.popleft())
+        while inflight:
+            write(*inflight.popleft())
@@ -0,0 +1,489 @@
+"""
+verify.py
+
+Usage:
+  nixworks verify [--hash] [--tolerance=<t>] [--jobs=<n>]
+                  [--max-ranges=<n>] <source> <target>
+
+Compare the signals of a converted file with those of its source, e.g. an NWB
+file with the NIX file created from it by nwb2nix (or the other way around
+with nix2nwb), or an EDF/BrainVision file with the NIX file created by
+mne2nix.
+
+Signals are matched by name: NIX DataArrays with a sampled or range time
+dimension by their name, NWB TimeSeries by the name nwb2nix gives them
+('<series>' in acquisition, '<module>.<series>' in processing modules,
+'stimulus.<series>' for stimuli).  MNE readable files (and NIX files
+compared with them, read through nix2mne) contain a single signal 'raw'.
+
+Both signals are read in blocks of time aligned to the chunks of the source
+and compared block by block in a pool of reader threads, so memory use is
+bounded by the block size times the number of threads, independent of the
+size of the recording.  Two comparison methods are available:
+
+- 'diff' (default): per channel maximum absolute difference; samples that
+  differ by more than 'tolerance' are reported as ranges (start, stop) of
+  sample indices, merged across blocks.  NaN equals NaN.
+- 'hash': per channel digest (BLAKE2b) of the stored bytes of every block,
+  for bit-exact copies; blocks with different digests are reported as
+  mismatching ranges.  The digests of the blocks of a channel are combined
+  into one digest per channel.
+
+Besides the data, the shapes, sampling rates, units (taking the NWB
+'conversion' factor into account) and the number of annotations (NIX
+MultiTag positions, rows of NWB intervals tables, MNE annotations) are
+compared.
+
+NWB and NIX files are read with h5py directly, so pynwb is not needed; mne
+is only imported for MNE readable files.
+"""
+import sys
+import math
+import hashlib
+import dataclasses
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+import nixio as nix
+import quantities as pq
+
+from ..arrays import sampling_rate, time_dimension
+from ..instrument import operation
+from .streaming import (DEFAULT_BUFFER_BYTES, block_rows, can_decode,
+                        filter_pipeline, iter_blocks, read_block,
+                        regular_sampling)
+
+
+NIX_EXTENSIONS = (".nix", ".h5")
+NWB_EXTENSIONS = (".nwb",)
+
+
+class Signal:
+    """
+    A signal with 'nsamples' samples of 'nchannels' channels.  'read()'
+    returns the samples [start, stop) as an array of shape
+    (stop - start, nchannels).
+
+    :param name: Name used to match signals of two files.
+    :param shape: (samples, channels).
+    :param rate: Sampling rate in Hz or None (irregular sampling).
+    :param unit: Unit of the values.
+    :param conversion: Factor converting the values to 'unit'.
+    :param chunk: Chunk length along time of the stored data or None.
+    """
+
+    def __init__(self, name, shape, rate=None, unit=None, conversion=1.0,
+                 chunk=None):
+        self.name = name
+        self.shape = tuple(shape)
+        self.rate = rate
+        self.unit = unit
+        self.conversion = conversion
+        self.chunk = chunk
+
+    def read(self, start, stop):
+        raise NotImplementedError
+
+
+class DatasetSignal(Signal):
+    """
+    Signal stored in an HDF5 dataset with the time along 'time_axis' (NIX
+    DataArrays and NWB TimeSeries).  Chunks of deflate/shuffle compressed
+    datasets with time along the first axis are decoded outside of HDF5, so
+    that reader threads decompress in parallel.
+    """
+
+    def __init__(self, name, dataset, time_axis=0, **kwargs):
+        shape = dataset.shape
+        nchan = int(np.prod([n for idx, n in enumerate(shape)
+                             if idx != time_axis]))
+        chunk = dataset.chunks[time_axis] if dataset.chunks else None
+        super().__init__(name, (shape[time_axis], nchan), chunk=chunk,
+                         **kwargs)
+        self.dataset = dataset
+        self.time_axis = time_axis
+        self.pipeline = None
+        if time_axis == 0 and can_decode(dataset):
+            self.pipeline = filter_pipeline(dataset)
+
+    def read(self, start, stop):
+        if (self.pipeline is not None and self.chunk and
+                start % self.chunk == 0):
+            block = read_block(self.dataset, slice(start, stop),
+                               self.pipeline)
+        else:
+            index = [slice(None)] * self.dataset.ndim
+            index[self.time_axis] = slice(start, stop)
+            block = self.dataset[tuple(index)]
+        block = np.moveaxis(block, self.time_axis, 0)
+        return block.reshape(stop - start, self.shape[1])
+
+
+class MNESignal(Signal):
+    """Signal of an MNE Raw object, read in volts (SI units)."""
+
+    def __init__(self, raw):
+        super().__init__("raw", (raw.n_times, len(raw.ch_names)),
+                         rate=raw.info["sfreq"], unit="V")
+        self.raw = raw
+
+    def read(self, start, stop):
+        return self.raw.get_data(start=start, stop=stop).T
+
+
+@dataclasses.dataclass
+class Mismatch:
+    signal: str
+    channel: int
+    start: int
+    stop: int
+    maxdiff: float = None
+
+
+@dataclasses.dataclass
+class Report:
+    source: str
+    target: str
+    signals: list = dataclasses.field(default_factory=list)
+    missing: list = dataclasses.field(default_factory=list)
+    metadata: list = dataclasses.field(default_factory=list)
+    mismatches: list = dataclasses.field(default_factory=list)
+    # per signal: maximum absolute difference ('diff') or digest ('hash')
+    # of every channel
+    channels: dict = dataclasses.field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return not (self.missing or self.metadata or self.mismatches)
+
+    def print(self, file=None):
+        file = file or sys.stdout
+        print(f"{self.source} <-> {self.target}", file=file)
+        for name in self.signals:
+            values = self.channels.get(name, [])
+            summary = ""
+            if isinstance(values, np.ndarray) and len(values):
+                summary = f", max abs diff {values.max():g}"
+            print(f"  {name}: {len(values)} channels{summary}", file=file)
+        for name in self.missing:
+            print(f"  MISSING {name}", file=file)
+        for message in self.metadata:
+            print(f"  METADATA {message}", file=file)
+        for m in self.mismatches:
+            diff = "" if m.maxdiff is None else \
+                f" (max abs diff {m.maxdiff:g})"
+            print(f"  MISMATCH {m.signal} channel {m.channel} samples "
+                  f"[{m.start}, {m.stop}){diff}", file=file)
+        print("OK" if self.ok else "FAILED", file=file)
+
+
+def file_kind(path):
+    suffix = Path(path).suffix.lower()
+    if suffix in NIX_EXTENSIONS:
+        return "nix"
+    if suffix in NWB_EXTENSIONS:
+        return "nwb"
+    return "mne"
+
+
+def nix_signals(nixfile):
+    """Signals and annotation count of an open NIX file."""
+    signals = dict()
+    annotations = 0
+    for block in nixfile.blocks:
+        for mtag in block.multi_tags:
+            annotations += mtag.positions.shape[0]
+        for da in block.data_arrays:
+            axis = time_dimension(da)
+            if axis is None or da.name in signals:
+                continue
+            dim = da.dimensions[axis]
+            rate = None
+            if dim.dimension_type == nix.DimensionType.Sample:
+                rate = sampling_rate(dim.sampling_interval, dim.unit)
+            signals[da.name] = DatasetSignal(
+                da.name, da._h5group.group["data"], axis, rate=rate,
+                unit=da.unit)
+    return signals, annotations
+
+
+def nwb_time_series(group, name, signals):
+    if "data" in group and isinstance(group["data"], h5py.Dataset) and \
+       ("starting_time" in group or "timestamps" in group):
+        data = group["data"]
+        rate = None
+        if "starting_time" in group:
+            rate = float(group["starting_time"].attrs["rate"])
+        else:
+            # nwb2nix stores regular timestamps as a sampled dimension
+            regular = regular_sampling(group["timestamps"])
+            if regular is not None:
+                rate = 1.0 / regular[1]
+        signals[name] = DatasetSignal(
+            name, data, 0, rate=rate, unit=data.attrs.get("unit"),
+            conversion=float(data.attrs.get("conversion", 1.0)))
+        return
+    # containers of series (LFP, BehavioralTimeSeries, ...)
+    for key, child in group.items():
+        if isinstance(child, h5py.Group):
+            nwb_time_series(child, f"{name}.{key}", signals)
+
+
+def nwb_signals(h5file):
+    """Signals and annotation count of an open NWB file."""
+    signals = dict()
+    for name, group in h5file.get("acquisition", {}).items():
+        nwb_time_series(group, name, signals)
+    for module, mgroup in h5file.get("processing", {}).items():
+        for name, group in mgroup.items():
+            if isinstance(group, h5py.Group):
+                nwb_time_series(group, f"{module}.{name}", signals)
+    for name, group in h5file.get("stimulus/presentation", {}).items():
+        nwb_time_series(group, f"stimulus.{name}", signals)
+    annotations = sum(table["id"].shape[0]
+                      for table in h5file.get("intervals", {}).values()
+                      if "id" in table)
+    return signals, annotations
+
+
+def mne_signals(raw):
+    """Signals and annotation count of an MNE Raw object."""
+    return {"raw": MNESignal(raw)}, len(raw.annotations)
+
+
+def open_signals(path, kinds, stack):
+    """
+    Open 'path' and return its signals and annotation count.  Files to close
+    are added to the list 'stack'.
+    """
+    kind = file_kind(path)
+    if kind == "nix" and "mne" in kinds:
+        from .mne import nix2mne
+        return mne_signals(nix2mne.import_nix(str(path)))
+    if kind == "nix":
+        nixfile = nix.File.open(str(path), nix.FileMode.ReadOnly)
+        stack.append(nixfile)
+        return nix_signals(nixfile)
+    if kind == "nwb":
+        h5file = h5py.File(str(path), "r")
+        stack.append(h5file)
+        return nwb_signals(h5file)
+    import mne
+    return mne_signals(mne.io.read_raw(str(path), preload=False,
+                                       verbose="error"))
+
+
+def normalized_unit(unit):
+    """None for missing units ('n/a' is written by nix2nwb)."""
+    if unit is None:
+        return None
+    unit = str(unit).strip()
+    return None if unit.casefold() in ("", "n/a", "none") else unit
+
+
+def compare_units(source, target):
+    """
+    True if the values of both signals are in the same unit, taking the
+    conversion factors into account.
+    """
+    sunit, tunit = normalized_unit(source.unit), normalized_unit(target.unit)
+    if sunit is None or tunit is None or sunit == tunit:
+        return sunit == tunit and math.isclose(
+            source.conversion, target.conversion, rel_tol=1e-9)
+    try:
+        q = pq.Quantity(source.conversion, sunit).rescale(tunit)
+    except (LookupError, ValueError, TypeError):
+        return sunit.casefold() == tunit.casefold()
+    return math.isclose(float(q), target.conversion, rel_tol=1e-9)
+
+
+def compare_metadata(source, target):
+    messages = list()
+    if source.shape != target.shape:
+        messages.append(f"{source.name}: shape {source.shape} != "
+                        f"{target.shape}")
+    if (source.rate is None) != (target.rate is None) or \
+       (source.rate is not None and
+            not math.isclose(source.rate, target.rate, rel_tol=1e-9)):
+        messages.append(f"{source.name}: sampling rate {source.rate} != "
+                        f"{target.rate}")
+    if not compare_units(source, target):
+        messages.append(f"{source.name}: unit {source.conversion:g} "
+                        f"{source.unit} != {target.conversion:g} "
+                        f"{target.unit}")
+    return messages
+
+
+def value_ranges(bad):
+    """
+    (start, stop) ranges of consecutive True values of a 1D boolean array.
+    """
+    edges = np.diff(np.concatenate(([0], bad.view(np.int8), [0])))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+def diff_block(source, target, start, stop, tolerance):
+    """
+    Per channel maximum absolute difference and mismatching ranges of the
+    samples [start, stop).
+    """
+    a = np.asarray(source.read(start, stop), dtype=np.float64)
+    b = np.asarray(target.read(start, stop), dtype=np.float64)
+    diff = np.abs(a - b)
+    nans = np.isnan(a) | np.isnan(b)
+    if nans.any():
+        # NaN equals NaN, NaN against a number is an infinite difference
+        diff[nans] = np.where(np.isnan(a) & np.isnan(b), 0.0, np.inf)[nans]
+    maxdiff = diff.max(axis=0) if len(diff) else np.zeros(a.shape[1])
+    ranges = list()
+    for channel in np.flatnonzero(maxdiff > tolerance):
+        column = diff[:, channel]
+        for lo, hi in value_ranges(column > tolerance):
+            ranges.append((int(channel), start + int(lo), start + int(hi),
+                           float(column[lo:hi].max())))
+    return maxdiff, ranges
+
+
+def hash_block(source, target, start, stop):
+    """
+    Per channel digests of the samples [start, stop) of both signals and the
+    mismatching channels.
+    """
+    a = source.read(start, stop)
+    b = target.read(start, stop)
+    digests = list()
+    ranges = list()
+    for channel in range(a.shape[1]):
+        da = hashlib.blake2b(np.ascontiguousarray(a[:, channel]).tobytes(),
+                             digest_size=16).digest()
+        db = hashlib.blake2b(np.ascontiguousarray(b[:, channel]).tobytes(),
+                             digest_size=16).digest()
+        digests.append(da)
+        if da != db or a.dtype != b.dtype:
+            ranges.append((channel, start, stop, None))
+    return digests, ranges
+
+
+def merge_ranges(mismatches, name, ranges, max_ranges):
+    """
+    Add the ranges of a block to the list of mismatches of signal 'name',
+    extending the last mismatch of a channel if the range continues it.
+    Stops adding new ranges for a channel after 'max_ranges'.
+    """
+    for channel, start, stop, maxdiff in ranges:
+        last = mismatches[channel]
+        if last and last[-1].stop == start:
+            last[-1].stop = stop
+            if maxdiff is not None:
+                last[-1].maxdiff = max(last[-1].maxdiff, maxdiff)
+        elif len(last) < max_ranges:
+            last.append(Mismatch(name, channel, start, stop, maxdiff))
+
+
+@operation("verify.signal")
+def compare_signal(source, target, method="diff", tolerance=0.0, jobs=1,
+                   buffer_bytes=DEFAULT_BUFFER_BYTES, max_ranges=100):
+    """
+    Compare the data of two signals of equal shape block by block.
+
+    :returns: The per channel maximum absolute differences ('diff') or
+    digests ('hash'), and the list of mismatching ranges.
+    """
+    nsamples, nchan = source.shape
+    chunks = (source.chunk,) if source.chunk else None
+    rows = block_rows((nsamples, nchan), np.float64, chunks,
+                      buffer_bytes // 2)
+    if method == "hash":
+        def task(slc):
+            return hash_block(source, target, slc.start, slc.stop)
+        hashes = [hashlib.blake2b(digest_size=32) for _ in range(nchan)]
+    else:
+        def task(slc):
+            return diff_block(source, target, slc.start, slc.stop, tolerance)
+        maxdiff = np.zeros(nchan)
+    mismatches = [[] for _ in range(nchan)]
+
+    def collect(result):
+        values, ranges = result
+        if method == "hash":
+            for h, digest in zip(hashes, values):
+                h.update(digest)
+        else:
+            np.fmax(maxdiff, values, out=maxdiff)
+        merge_ranges(mismatches, source.name, ranges, max_ranges)
+
+    blocks = iter_blocks((nsamples,), rows)
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        pending = deque()
+        for slc in blocks:
+            pending.append(pool.submit(task, slc))
+            if len(pending) >= 2 * max(jobs, 1):
+                collect(pending.popleft().result())
+        while pending:
+            collect(pending.popleft().result())
+
+    if method == "hash":
+        values = [h.hexdigest() for h in hashes]
+    else:
+        values = maxdiff
+    return values, [m for channel in mismatches for m in channel]
+
+
+@operation("verify")
+def verify(source, target, method="diff", tolerance=0.0, jobs=1,
+           buffer_bytes=DEFAULT_BUFFER_BYTES, max_ranges=100):
+    """
+    Compare the signals and metadata of two files.
+
+    :param source: Path to the original file.
+    :param target: Path to the converted file.
+    :param method: 'diff' or 'hash'.
+    :param tolerance: Largest absolute difference accepted by 'diff'.
+    :param jobs: Number of reader threads.
+    :param buffer_bytes: Size of the blocks read from both files.
+    :param max_ranges: Maximum number of mismatching ranges reported per
+    channel.
+    :rtype: Report
+    """
+    if method not in ("diff", "hash"):
+        raise ValueError(f"Unknown comparison method '{method}'")
+    kinds = {file_kind(source), file_kind(target)}
+    report = Report(str(source), str(target))
+    stack = list()
+    try:
+        srcsignals, srcannotations = open_signals(source, kinds, stack)
+        tgtsignals, tgtannotations = open_signals(target, kinds, stack)
+        if srcannotations != tgtannotations:
+            report.metadata.append(f"annotations: {srcannotations} != "
+                                   f"{tgtannotations}")
+        report.missing = sorted(set(srcsignals) ^ set(tgtsignals))
+        for name in sorted(set(srcsignals) & set(tgtsignals)):
+            src, tgt = srcsignals[name], tgtsignals[name]
+            report.signals.append(name)
+            messages = compare_metadata(src, tgt)
+            report.metadata.extend(messages)
+            if src.shape != tgt.shape:
+                continue
+            values, mismatches = compare_signal(src, tgt, method, tolerance,
+                                                jobs, buffer_bytes,
+                                                max_ranges)
+            report.channels[name] = values
+            report.mismatches.extend(mismatches)
+    finally:
+        for f in stack:
+            f.close()
+    return report
+
+
+def run(args):
+    """verify the files given in the parsed command line arguments"""
+    report = verify(args.SOURCE, args.TARGET,
+                    method="hash" if args.hash else "diff",
+                    tolerance=args.tolerance, jobs=args.jobs,
+                    max_ranges=args.max_ranges)
+    report.print()
+    if not report.ok:
+        sys.exit(1)
@@ -0,0 +1,155 @@
+"""
+dask_io.py
+
+NIX DataArrays and DataFrames as dask collections.
+
+    from nixworks.dask_io import dask_array, dask_dataframe
+
+    signal = dask_array(block.data_arrays["signal"])
+    signal.mean(axis=0).compute()
+
+    events = dask_dataframe(block.data_frames["events"])
+    events.groupby("channel").size().compute()
+
+'dask_array()' splits a DataArray into the chunks of its HDF5 dataset
+(contiguous datasets into blocks of rows of about 'buffer_bytes'), so no
+HDF5 chunk is read by more than one task.  'dask_dataframe()' splits a NIX
+DataFrame into partitions of consecutive rows, aligned to the chunks of the
+dataset; the index of the partitions is the row number, as in
+'table.write_to_pandas()'.
+
+The collections only refer to the file by name, block and object names.
+Every task opens the file read only, reads its part and closes the file
+again, so the graphs can be pickled and run with the threaded, process and
+distributed schedulers.  Contiguous datasets are read through a memory map
+(see memmap.py), calibrated DataArrays through nixio, which applies the
+calibration.  The file must not be written while a computation runs.
+"""
+import numpy as np
+import pandas as pd
+import nixio as nix
+import dask.array
+import dask.dataframe
+
+from .instrument import operation
+from .memmap import array_view
+from .converters.streaming import DEFAULT_BUFFER_BYTES, block_rows
+from .table.table import frame_from_rows
+
+
+def calibrated(data_array):
+    """True if nixio applies a calibration when reading the DataArray."""
+    return bool(len(data_array.polynom_coefficients) or
+                data_array.expansion_origin)
+
+
+class DataArraySource:
+    """
+    Picklable stand-in for a DataArray, which opens the file on every read.
+    """
+
+    def __init__(self, filename, block, name, shape, dtype):
+        self.filename = filename
+        self.block = block
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.ndim = len(shape)
+
+    @operation("dask.read")
+    def __getitem__(self, key):
+        nixfile = nix.File.open(self.filename, nix.FileMode.ReadOnly)
+        try:
+            da = nixfile.blocks[self.block].data_arrays[self.name]
+            if calibrated(da):
+                return np.asarray(da[key], dtype=self.dtype)
+            return np.asarray(array_view(da._h5group.group["data"])[key])
+        finally:
+            nixfile.close()
+
+
+def dataset_chunks(dataset, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Dask chunks matching the HDF5 chunks of a dataset, or blocks of rows for
+    contiguous datasets.
+
+    :param dataset: The h5py.Dataset.
+    :param buffer_bytes: Size of a block of rows of a contiguous dataset.
+    :rtype: tuple
+    """
+    if dataset.chunks is not None:
+        return dataset.chunks
+    rows = block_rows(dataset.shape, dataset.dtype, None, buffer_bytes)
+    return (rows,) + dataset.shape[1:]
+
+
+def dask_array(data_array, chunks=None, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    The values of a DataArray as a dask array.
+
+    :param data_array: The DataArray.
+    :type data_array: nix.DataArray
+    :param chunks: Chunks of the dask array (anything 'dask.array.from_array'
+                   accepts), by default the chunks of the HDF5 dataset.
+    :param buffer_bytes: Size of the chunks of contiguous datasets.
+    :rtype: dask.array.Array
+    """
+    dataset = data_array._h5group.group["data"]
+    dtype = np.dtype(float) if calibrated(data_array) else dataset.dtype
+    source = DataArraySource(dataset.file.filename, data_array._parent.name,
+                             data_array.name, dataset.shape, dtype)
+    if chunks is None:
+        chunks = dataset_chunks(dataset, buffer_bytes)
+    name = "nix-{}-{}".format(data_array.id, dask.base.tokenize(
+        source.filename, source.block, data_array.id, source.shape, chunks))
+    return dask.array.from_array(source, chunks=chunks, name=name,
+                                 lock=False, asarray=True,
+                                 meta=np.empty((0,) * source.ndim, dtype))
+
+
+@operation("dask.read")
+def read_rows(rows, filename, block, name):
+    """
+    Read the rows 'rows' (a range) of a DataFrame as a pandas DataFrame.
+    """
+    nixfile = nix.File.open(filename, nix.FileMode.ReadOnly)
+    try:
+        dataframe = nixfile.blocks[block].data_frames[name]
+        dataset = array_view(dataframe._h5group.group["data"])
+        frame = frame_from_rows(dataset[rows.start:rows.stop],
+                                dataframe.column_names)
+    finally:
+        nixfile.close()
+    frame.index = pd.RangeIndex(rows.start, rows.stop)
+    return frame
+
+
+def dask_dataframe(dataframe, rows=None, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    A NIX DataFrame as a dask DataFrame with partitions of consecutive rows.
+
+    :param dataframe: The NIX DataFrame.
+    :type dataframe: nix.DataFrame
+    :param rows: Number of rows per partition, by default as many chunks of
+                 the dataset as fit into 'buffer_bytes'.
+    :type rows: int
+    :param buffer_bytes: Size of the partitions.
+    :rtype: dask.dataframe.DataFrame
+    """
+    if not isinstance(dataframe, nix.DataFrame):
+        raise TypeError("The given object is not a DataFrame")
+    dataset = dataframe._h5group.group["data"]
+    if rows is None:
+        rows = block_rows(dataset.shape, dataset.dtype, dataset.chunks,
+                          buffer_bytes)
+    length = dataset.shape[0]
+    parts = [range(start, min(start + rows, length))
+             for start in range(0, length, rows)] or [range(0, 0)]
+    meta = frame_from_rows(np.empty(0, dataset.dtype),
+                           dataframe.column_names)
+    divisions = [part.start for part in parts] + [max(length - 1, 0)]
+    return dask.dataframe.from_map(
+        read_rows, parts, args=(dataset.file.filename,
+                                dataframe._parent.name, dataframe.name),
+        meta=meta, divisions=divisions, enforce_metadata=False,
+        label="nix-" + dataframe.name)
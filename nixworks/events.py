@@ -0,0 +1,376 @@
+"""
+events.py
+
+Usage:
+  nixworks events --array=<name> --threshold=<value> [--std] [--peak]
+                  [--dead-time=<time>] [--multitag] [--output=<name>]
+                  [--jobs=<n>] <file>
+
+Threshold and peak detection of events in sampled DataArrays.
+
+    from nixworks.events import detect_events
+
+    # spikes: negative peaks below 5 standard deviations of every channel
+    arrays = detect_events(data_array, "spikes", -5.0, relative=True,
+                           peak=True, dead_time=0.001, jobs=4)
+    EventPlotter(arrays[0]).plot()
+
+An event is an excursion of the signal beyond the threshold: above it for
+positive thresholds, below it for negative ones.  An event lasts from the
+first sample beyond the threshold to the last one; its time is that of the
+first sample or, with 'peak', that of the most extreme sample.  With
+'relative', the threshold is given in standard deviations from the mean of
+every channel, taken from the cached statistics (see stats.py).  Events
+closer than 'dead_time' to the previous event of their channel are
+dropped.
+
+The source is read in chunk-aligned blocks along its sampled dimension (see
+converters/streaming.py).  Crossings, excursion ends and peaks of a block
+are found with vectorised NumPy operations on all samples at once; an
+excursion that is still open at the end of a block is carried over to the
+next one, as is the time of the last event for the dead time, so events
+across block boundaries are found exactly once and as if the signal had
+been read at once.  The channels are split into 'jobs' groups that are
+processed in parallel threads (NumPy releases the GIL for the work on whole
+blocks), the results are appended to the output after every block.
+
+The events are written either
+
+- as one DataArray of event times with an alias range dimension per
+  channel (named '<name>' for a single channel and '<name> <label>'
+  otherwise), as drawn by the EventPlotter, or
+- with 'multitag' as a MultiTag '<name>' referencing the source that tags
+  the excursions: their starts and durations are the positions and extents
+  in the DataArrays '<name> positions' and '<name> extents', which hold the
+  channel index along the channel dimension of two-dimensional sources.
+  With 'peak', the peak times are an indexed feature '<name> peaks'.
+
+Either way, the metadata of the outputs is a provenance section (see
+preprocess.py) recording the source and the detection parameters.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nixio as nix
+
+from .arrays import calibrate, time_dimension
+from .instrument import operation
+from .stats import read_values, statistics
+from .converters.streaming import (DEFAULT_BUFFER_BYTES, block_rows,
+                                   can_decode, filter_pipeline, iter_blocks)
+from .preprocess import record_provenance
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+def segment_peaks(values, starts, stops):
+    """
+    Index and value of the maximum of every segment [starts[i], stops[i])
+    of 'values' (all segments must be non-empty).
+    """
+    lengths = stops - starts
+    if not len(lengths):
+        return EMPTY, np.empty(0)
+    offsets = np.cumsum(lengths) - lengths
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    index = np.arange(lengths.sum()) - offsets[segment] + starts[segment]
+    segment_values = values[index]
+    maxima = np.maximum.reduceat(segment_values, offsets)
+    first = np.flatnonzero(segment_values == maxima[segment])
+    _, pick = np.unique(segment[first], return_index=True)
+    return index[first[pick]], maxima
+
+
+class ChannelDetector:
+    """
+    Detection state of one channel: the open excursion at the end of the
+    last block and the last event (for the dead time).
+    """
+
+    def __init__(self, threshold, sign, peak, dead_time):
+        self.sign = sign
+        self.level = sign * threshold
+        self.peak = peak
+        self.dead_time = dead_time
+        self.position = 0
+        # open excursion: start, peak index, peak value
+        self.open = None
+        self.last = None
+
+    def __call__(self, values):
+        """
+        Events that ended in this block, as arrays of (global) start, stop
+        and event sample indices.
+        """
+        values = self.sign * values
+        count = len(values)
+        above = values >= self.level
+        ended = EMPTY, EMPTY, EMPTY
+        if self.open is not None and count and not above[0]:
+            # the open excursion ended exactly at the block boundary
+            start, peak, _ = self.open
+            self.open = None
+            ended = (np.array([start]), np.array([self.position]),
+                     np.array([peak]))
+        edges = np.diff(above.astype(np.int8),
+                        prepend=np.int8(self.open is not None))
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+        if self.open is not None:
+            starts = np.concatenate(([0], starts))
+        if len(stops) < len(starts):
+            stops = np.concatenate((stops, [count]))
+
+        if self.peak:
+            peaks, maxima = segment_peaks(values, starts, stops)
+        else:
+            peaks, maxima = starts, None
+        starts = starts + self.position
+        stops = stops + self.position
+        peaks = peaks + self.position
+
+        if self.open is not None and len(starts):
+            # continuation of the excursion open at the end of the last block
+            start, peak, maximum = self.open
+            starts[0] = start
+            if not self.peak or maximum >= maxima[0]:
+                peaks[0] = peak
+                if self.peak:
+                    maxima[0] = maximum
+        self.open = None
+        if len(starts) and above[-1]:
+            self.open = (starts[-1], peaks[-1],
+                         maxima[-1] if self.peak else None)
+            starts, stops, peaks = starts[:-1], stops[:-1], peaks[:-1]
+        self.position += count
+        starts, stops, peaks = (
+            np.concatenate((before, after)).astype(np.int64)
+            for before, after in zip(ended, (starts, stops, peaks)))
+        return self.select(starts, stops, peaks)
+
+    def finish(self):
+        """The excursion still open at the end of the signal."""
+        if self.open is None:
+            return EMPTY, EMPTY, EMPTY
+        start, peak, _ = self.open
+        self.open = None
+        return self.select(np.array([start]), np.array([self.position]),
+                           np.array([peak]))
+
+    def select(self, starts, stops, peaks):
+        """Drop events within the dead time of the event before."""
+        if self.dead_time and len(peaks):
+            keep = []
+            index = 0
+            if self.last is not None:
+                index = np.searchsorted(peaks, self.last + self.dead_time)
+            while index < len(peaks):
+                keep.append(index)
+                index = np.searchsorted(peaks, peaks[index] + self.dead_time)
+            starts, stops, peaks = starts[keep], stops[keep], peaks[keep]
+        if len(peaks):
+            self.last = peaks[-1]
+        return starts, stops, peaks
+
+
+class EventWriter:
+    """Appends events to alias range DataArrays or a MultiTag."""
+
+    def __init__(self, source, name, channels, labels, multitag, peak,
+                 description):
+        self.time_axis = time_dimension(source)
+        dim = source.dimensions[self.time_axis]
+        self.interval = dim.sampling_interval
+        self.offset = dim.offset or 0.0
+        self.channels = channels
+        self.ndim = len(source.shape)
+        block = source._parent
+        rate = 1.0 / self.interval
+        self.outputs = []
+        self.mtag = None
+        if not multitag:
+            for label in labels:
+                da = block.create_data_array(
+                    name if len(channels) == 1 else f"{name} {label}",
+                    "nixworks.events", dtype=nix.DataType.Double,
+                    shape=(0,))
+                da.append_range_dimension_using_self()
+                da.label = dim.label
+                da.unit = dim.unit
+                record_provenance(source, da, [description], rate)
+                self.outputs.append(da)
+            return
+
+        shape = (0,) if self.ndim == 1 else (0, 2)
+        positions = block.create_data_array(
+            f"{name} positions", "nixworks.events.positions",
+            dtype=nix.DataType.Double, shape=shape)
+        extents = block.create_data_array(
+            f"{name} extents", "nixworks.events.extents",
+            dtype=nix.DataType.Double, shape=shape)
+        self.outputs = [positions, extents]
+        if peak:
+            peaks = block.create_data_array(
+                f"{name} peaks", "nixworks.events.peaks",
+                dtype=nix.DataType.Double, shape=(0,))
+            peaks.label = dim.label
+            peaks.unit = dim.unit
+            self.outputs.append(peaks)
+        for da in self.outputs:
+            for _ in da.shape:
+                da.append_set_dimension()
+            record_provenance(source, da, [description], rate)
+        self.mtag = block.create_multi_tag(name, "nixworks.events",
+                                           positions)
+        self.mtag.extents = extents
+        self.mtag.references.append(source)
+        self.mtag.metadata = positions.metadata
+        if peak:
+            self.mtag.create_feature(peaks, nix.LinkType.Indexed)
+
+    def write(self, events):
+        """Append the events (start, stop, event index per channel)."""
+        if self.mtag is None:
+            for da, (_, _, peaks) in zip(self.outputs, events):
+                if len(peaks):
+                    da.append(self.offset + peaks * self.interval)
+            return
+        rows, lengths, times = [], [], []
+        for channel, (starts, stops, peaks) in zip(self.channels, events):
+            start = self.offset + starts * self.interval
+            duration = (stops - starts) * self.interval
+            times.append(self.offset + peaks * self.interval)
+            if self.ndim == 1:
+                rows.append(start)
+                lengths.append(duration)
+                continue
+            position = np.zeros((len(starts), 2))
+            extent = np.zeros((len(starts), 2))
+            position[:, self.time_axis] = start
+            position[:, 1 - self.time_axis] = channel
+            extent[:, self.time_axis] = duration
+            rows.append(position)
+            lengths.append(extent)
+        if not sum(len(row) for row in rows):
+            return
+        for da, values in zip(self.outputs, (rows, lengths, times)):
+            da.append(np.concatenate(values), axis=0)
+
+
+@operation("events.detect")
+def detect_events(data_array, name, threshold, relative=False, peak=False,
+                  dead_time=0.0, multitag=False, jobs=1,
+                  buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Detect threshold crossings or peaks in a DataArray with a sampled
+    dimension and write their times to new DataArrays or a MultiTag.
+
+    :param data_array: The source DataArray (1 or 2 dimensions).
+    :type data_array: nix.DataArray
+    :param name: Name of the output (see module docstring).
+    :param threshold: Threshold (one value or one per channel).
+    Negative thresholds detect excursions below the threshold.
+    :param relative: Threshold in standard deviations from the mean.
+    :param peak: Time events at their peak instead of their start.
+    :param dead_time: Minimum time between two events of a channel (in the
+    unit of the sampled dimension).
+    :param multitag: Write a MultiTag instead of alias range DataArrays.
+    :param jobs: Number of threads the channels are split over.  As with
+    stats.compute_statistics(), do not call this inside a loop over a NIX
+    container when jobs > 1.
+    :param buffer_bytes: Size of the blocks read at once.
+    :returns: The event DataArrays or the MultiTag.
+    """
+    time_axis = time_dimension(data_array)
+    if time_axis is None or data_array.dimensions[time_axis].dimension_type \
+            != nix.DimensionType.Sample:
+        raise ValueError(f"DataArray {data_array.name} has no sampled "
+                         "dimension")
+    if len(data_array.shape) > 2:
+        raise ValueError("Only DataArrays with 1 or 2 dimensions can be "
+                         "searched for events")
+    channel_axis = 1 - time_axis if len(data_array.shape) == 2 else None
+    dataset = data_array._h5group.group["data"]
+    length = dataset.shape[time_axis]
+    channels = dataset.shape[channel_axis] if channel_axis is not None else 1
+    labels = [str(idx) for idx in range(channels)]
+    if channel_axis is not None:
+        dim = data_array.dimensions[channel_axis]
+        if dim.dimension_type == nix.DimensionType.Set and dim.labels:
+            labels = list(dim.labels)
+
+    calibrated = len(data_array.polynom_coefficients) or \
+        data_array.expansion_origin
+    thresholds = np.broadcast_to(np.asarray(threshold, dtype=float),
+                                 (channels,))
+    signs = np.where(thresholds < 0, -1.0, 1.0)
+    if relative:
+        # the statistics are those of the calibrated values
+        stats = statistics(data_array)
+        if stats.channels != channels:
+            stats = stats.overall()
+        thresholds = stats.mean + thresholds * stats.std
+    interval = data_array.dimensions[time_axis].sampling_interval
+    dead_samples = int(np.ceil(dead_time / interval)) if dead_time else 0
+    detectors = [ChannelDetector(level, sign, peak, dead_samples)
+                 for level, sign in zip(thresholds, signs)]
+
+    description = (f"{'peaks' if peak else 'crossings'} beyond "
+                   f"{np.asarray(threshold).tolist()}"
+                   f"{' standard deviations' if relative else ''}, "
+                   f"dead time {dead_time:g}")
+    writer = EventWriter(data_array, name, list(range(channels)), labels,
+                         multitag, peak, description)
+    pipeline = None
+    if time_axis == 0 and can_decode(dataset):
+        pipeline = filter_pipeline(dataset)
+    chunks = (dataset.chunks[time_axis],) if dataset.chunks else None
+    rows = block_rows((length, channels), dataset.dtype, chunks,
+                      buffer_bytes)
+    groups = [group for group in np.array_split(np.arange(channels),
+                                                max(jobs, 1)) if len(group)]
+
+    def task(group, values):
+        return [detectors[idx](values[:, idx]) for idx in group]
+
+    nixfile = data_array.file
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        for slc in iter_blocks((length,), rows):
+            values = read_values(dataset, slc, time_axis, channel_axis,
+                                 pipeline)
+            if calibrated:
+                values = calibrate(values, data_array)
+            results = pool.map(task, groups, [values] * len(groups))
+            writer.write([events for result in results
+                          for events in result])
+            nixfile.flush()
+    writer.write([detector.finish() for detector in detectors])
+    return writer.mtag if multitag else writer.outputs
+
+
+def run(args):
+    """detect events in a DataArray of a NIX file"""
+    nixfile = nix.File.open(args.FILE, nix.FileMode.ReadWrite)
+    try:
+        for block in nixfile.blocks:
+            if args.array in block.data_arrays:
+                source = block.data_arrays[args.array]
+                break
+        else:
+            sys.exit(f"No DataArray named {args.array}")
+        name = args.output or f"{args.array} events"
+        try:
+            result = detect_events(source, name, args.threshold, args.std,
+                                   args.peak, args.dead_time, args.multitag,
+                                   args.jobs)
+        except ValueError as exc:
+            sys.exit(str(exc))
+        if args.multitag:
+            print(f"{block.name}/{result.name}: "
+                  f"{result.positions.shape[0]} events")
+        else:
+            for da in result:
+                print(f"{block.name}/{da.name}: {da.shape[0]} events")
+    finally:
+        nixfile.close()
@@ -0,0 +1,353 @@
+"""
+instrument.py
+
+Opt-in instrumentation of the HDF5 I/O caused by nixworks operations.
+
+Usage:
+
+    from nixworks import instrument
+
+    with instrument.Recorder() as recorder:
+        plotter.plot()
+    recorder.print()
+    recorder.save("profile.json")                 # summary and all events
+    recorder.save("profile.trace.json", "trace")  # chrome://tracing, Perfetto
+    recorder.save("profile.folded", "folded")     # flamegraph.pl, speedscope
+
+or 'nixworks --profile=profile.json <command> ...' on the command line.
+
+nixworks marks its high-level operations (plot windows, table import and
+export, converter stages) with 'operation()', which works as a context
+manager and as a decorator.  While a Recorder is active, every operation
+records its wall time and the HDF5 activity that happened while it was the
+innermost running operation:
+
+- reads: calls of h5py's Dataset.__getitem__() and Dataset.read_direct(),
+  and raw chunk reads reported by the converters with 'count_read()'
+- bytes: bytes returned by these reads (stored, i.e. compressed, bytes for
+  raw chunk reads)
+- attrs: attribute reads (h5py AttributeManager.__getitem__(), which NIX
+  uses for names, units, labels and the like)
+- io_seconds: time spent in these calls
+
+Reads made by worker threads are attributed to the innermost operation of
+the thread that started the Recorder, unless the worker runs an operation
+of its own.  Without an active Recorder, h5py is left untouched and
+'operation()' only costs a function call.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+
+COUNTERS = ("reads", "bytes", "attrs", "io_seconds")
+
+# the active Recorder (only one at a time)
+_recorder = None
+
+
+class Event:
+    """
+    One run of an operation.  Counters hold the activity while this was the
+    innermost operation ('self' counts).
+    """
+
+    __slots__ = ("name", "parent", "thread", "start", "duration", "reads",
+                 "bytes", "attrs", "io_seconds")
+
+    def __init__(self, name, parent, thread, start):
+        self.name = name
+        self.parent = parent
+        self.thread = thread
+        self.start = start
+        self.duration = 0.0
+        self.reads = 0
+        self.bytes = 0
+        self.attrs = 0
+        self.io_seconds = 0.0
+
+    def stack(self, events):
+        names = []
+        event = self
+        while event is not None:
+            names.append(event.name)
+            event = events[event.parent] if event.parent is not None \
+                else None
+        return names[::-1]
+
+
+class Recorder:
+    """
+    Collects the events of all operations run while it is active (see the
+    module docstring).  The Recorder itself is the root operation, named
+    'name'.
+    """
+
+    def __init__(self, name="nixworks"):
+        self.name = name
+        self.events = []
+        self._lock = threading.Lock()
+        self._stacks = dict()
+        self._main = None
+        self._originals = []
+        self._origin = 0.0
+
+    def __enter__(self):
+        global _recorder
+        if _recorder is not None:
+            raise RuntimeError("Another Recorder is already active")
+        self._main = threading.get_ident()
+        self._origin = time.perf_counter()
+        self.events = [Event(self.name, None, self._main, 0.0)]
+        self._stacks = {self._main: [0]}
+        self._patch()
+        _recorder = self
+        return self
+
+    def __exit__(self, *exc):
+        global _recorder
+        _recorder = None
+        self._unpatch()
+        self.events[0].duration = time.perf_counter() - self._origin
+
+    # event bookkeeping
+
+    def _current(self):
+        """
+        Index of the innermost operation of the calling thread (or of the
+        thread that started the Recorder).
+        """
+        stack = self._stacks.get(threading.get_ident())
+        if not stack:
+            stack = self._stacks[self._main]
+        return stack[-1]
+
+    def begin(self, name):
+        thread = threading.get_ident()
+        with self._lock:
+            parent = self._current()
+            self.events.append(Event(name, parent, thread,
+                                     time.perf_counter() - self._origin))
+            index = len(self.events) - 1
+            self._stacks.setdefault(thread, []).append(index)
+        return index
+
+    def end(self, index):
+        event = self.events[index]
+        event.duration = time.perf_counter() - self._origin - event.start
+        with self._lock:
+            stack = self._stacks[event.thread]
+            stack.remove(index)
+
+    def count(self, reads=0, nbytes=0, attrs=0, seconds=0.0):
+        with self._lock:
+            event = self.events[self._current()]
+            event.reads += reads
+            event.bytes += nbytes
+            event.attrs += attrs
+            event.io_seconds += seconds
+
+    # h5py hooks
+
+    def _patch(self):
+        import h5py
+
+        def dataset_getitem(original):
+            def __getitem__(dataset, *args, **kwargs):
+                t0 = time.perf_counter()
+                result = original(dataset, *args, **kwargs)
+                self.count(1, getattr(result, "nbytes", 0),
+                           seconds=time.perf_counter() - t0)
+                return result
+            return __getitem__
+
+        def dataset_read_direct(original):
+            def read_direct(dataset, dest, source_sel=None, dest_sel=None):
+                t0 = time.perf_counter()
+                original(dataset, dest, source_sel, dest_sel)
+                nbytes = dest[dest_sel].nbytes if dest_sel is not None \
+                    else dest.nbytes
+                self.count(1, nbytes, seconds=time.perf_counter() - t0)
+            return read_direct
+
+        def attrs_getitem(original):
+            def __getitem__(attrs, name):
+                t0 = time.perf_counter()
+                result = original(attrs, name)
+                self.count(attrs=1, seconds=time.perf_counter() - t0)
+                return result
+            return __getitem__
+
+        hooks = [(h5py.Dataset, "__getitem__", dataset_getitem),
+                 (h5py.Dataset, "read_direct", dataset_read_direct),
+                 (h5py.AttributeManager, "__getitem__", attrs_getitem)]
+        for cls, attr, hook in hooks:
+            original = cls.__dict__[attr]
+            self._originals.append((cls, attr, original))
+            setattr(cls, attr, hook(original))
+
+    def _unpatch(self):
+        for cls, attr, original in reversed(self._originals):
+            setattr(cls, attr, original)
+        self._originals = []
+
+    # results
+
+    def summary(self):
+        """
+        Totals per operation name, sorted by time: number of calls,
+        inclusive wall time and the inclusive counters (including nested
+        operations).
+        """
+        inclusive = [dict.fromkeys(COUNTERS, 0) for _ in self.events]
+        # children always come after their parents
+        for index in range(len(self.events) - 1, -1, -1):
+            event = self.events[index]
+            totals = inclusive[index]
+            for counter in COUNTERS:
+                totals[counter] += getattr(event, counter)
+            if event.parent is not None:
+                for counter in COUNTERS:
+                    inclusive[event.parent][counter] += totals[counter]
+
+        # count nested runs of the same operation only once
+        summary = dict()
+        for index, event in enumerate(self.events):
+            names = event.stack(self.events)
+            entry = summary.setdefault(event.name, {
+                "name": event.name, "calls": 0, "seconds": 0.0,
+                **dict.fromkeys(COUNTERS, 0)})
+            entry["calls"] += 1
+            if event.name in names[:-1]:
+                continue
+            entry["seconds"] += event.duration
+            for counter in COUNTERS:
+                entry[counter] += inclusive[index][counter]
+        return sorted(summary.values(), key=lambda e: e["seconds"],
+                      reverse=True)
+
+    def to_dict(self):
+        events = [{"name": e.name, "parent": e.parent, "thread": e.thread,
+                   "start": e.start, "seconds": e.duration,
+                   **{c: getattr(e, c) for c in COUNTERS}}
+                  for e in self.events]
+        return {"summary": self.summary(), "events": events}
+
+    def trace(self):
+        """
+        The events in the Chrome trace event format (complete events with
+        the counters as arguments).
+        """
+        pid = os.getpid()
+        return {"traceEvents": [
+            {"name": e.name, "ph": "X", "pid": pid, "tid": e.thread,
+             "ts": e.start * 1e6, "dur": e.duration * 1e6,
+             "args": {c: getattr(e, c) for c in COUNTERS}}
+            for e in self.events]}
+
+    def folded(self, weight="time"):
+        """
+        Folded stacks ('root;operation;nested value' per line) for
+        flamegraph.pl or speedscope.  'weight' is "time" (self time in
+        microseconds), "bytes" or "reads".
+        """
+        selftime = [e.duration for e in self.events]
+        for e in self.events:
+            if e.parent is not None and \
+                    e.thread == self.events[e.parent].thread:
+                selftime[e.parent] -= e.duration
+        lines = dict()
+        for index, e in enumerate(self.events):
+            if weight == "time":
+                value = int(max(selftime[index], 0.0) * 1e6)
+            elif weight in ("bytes", "reads"):
+                value = getattr(e, weight)
+            else:
+                raise ValueError(f"Unknown weight '{weight}'")
+            key = ";".join(e.stack(self.events))
+            lines[key] = lines.get(key, 0) + value
+        return "".join(f"{key} {value}\n" for key, value in lines.items()
+                       if value)
+
+    def save(self, filename, fmt="json"):
+        """
+        Write the results to 'filename' as "json" (summary and events),
+        "trace" (Chrome trace events) or "folded" (folded stacks weighted by
+        time).
+        """
+        with open(filename, "w") as outfile:
+            if fmt == "json":
+                json.dump(self.to_dict(), outfile, indent=2)
+            elif fmt == "trace":
+                json.dump(self.trace(), outfile)
+            elif fmt == "folded":
+                outfile.write(self.folded())
+            else:
+                raise ValueError(f"Unknown format '{fmt}'")
+
+    def print(self, file=None):
+        file = file or sys.stderr
+        print(f"{'operation':<32} {'calls':>6} {'seconds':>9} {'reads':>8} "
+              f"{'MiB':>9} {'attrs':>8} {'io s':>8}", file=file)
+        for entry in self.summary():
+            print(f"{entry['name']:<32} {entry['calls']:>6} "
+                  f"{entry['seconds']:>9.3f} {entry['reads']:>8} "
+                  f"{entry['bytes'] / 2**20:>9.2f} {entry['attrs']:>8} "
+                  f"{entry['io_seconds']:>8.3f}", file=file)
+
+
+class operation(contextlib.ContextDecorator):
+    """
+    Mark a high-level operation, as a context manager or a decorator:
+
+        with operation("nwb2nix.copy"):
+            ...
+
+        @operation("table.export")
+        def write_to_pandas(dataframe):
+            ...
+
+    Does nothing unless a Recorder is active.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._index = None
+
+    def _recreate_cm(self):
+        # a fresh instance for every call of a decorated function, so that
+        # recursive and concurrent calls don't share state
+        return type(self)(self.name)
+
+    def __enter__(self):
+        recorder = _recorder
+        if recorder is not None:
+            self._index = recorder.begin(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        recorder = _recorder
+        if self._index is not None and recorder is not None:
+            recorder.end(self._index)
+        self._index = None
+        return False
+
+
+def count_read(nbytes, seconds=0.0):
+    """
+    Report a read that bypasses the h5py hooks (e.g., a raw chunk read with
+    'DatasetID.read_direct_chunk()') to the active Recorder.
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(1, nbytes, seconds=seconds)
+
+
+def active():
+    """
+    True if a Recorder is active.
+    """
+    return _recorder is not None
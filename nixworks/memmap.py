@@ -0,0 +1,82 @@
+"""
+memmap.py
+
+Zero-copy reads of contiguous, uncompressed datasets.
+
+HDF5 stores a dataset without chunking and filters ('contiguous' layout) as
+one block of raw values at a fixed offset in the file.  Reading a window of
+such a dataset through h5py or nixio copies it through the HDF5 library
+into a new array.  Mapping the block into memory with 'numpy.memmap'
+instead serves every window from the operating system's page cache without
+copies; only the pages actually touched are read from disk.
+
+    from nixworks.memmap import data_view
+
+    data = data_view(data_array)   # np.memmap or the DataArray itself
+    window = data[start:stop]
+
+A dataset is mapped if
+
+- its layout is contiguous and its storage is allocated in the file (no
+  external storage, no compact datasets),
+- its values have a fixed size (no variable length strings),
+- its file is opened read only with the default (sec2) file driver, so that
+  nothing in HDF5's caches can be newer than the file on disk.
+
+'data_view()' also requires that the DataArray has no polynomial
+calibration or expansion origin, which NIX applies when reading.  In all
+other cases the DataArray (or dataset) itself is returned, so callers can
+slice the result either way.  The plotters, nix2mne and the table readers
+use these functions.
+"""
+import h5py
+import numpy as np
+
+
+def mappable(dataset):
+    """
+    True if the h5py.Dataset can be read through a memory map (see module
+    docstring).
+    """
+    if dataset.chunks is not None or not dataset.size:
+        return False
+    if dataset.dtype.hasobject:
+        return False
+    h5file = dataset.file
+    if h5file.mode != "r" or h5file.driver != "sec2":
+        return False
+    dcpl = dataset.id.get_create_plist()
+    if dcpl.get_layout() != h5py.h5d.CONTIGUOUS or dcpl.get_external_count():
+        return False
+    return dataset.id.get_offset() is not None
+
+
+def memmap(dataset):
+    """
+    A read only numpy.memmap of an h5py.Dataset, or None if it cannot be
+    mapped.
+    """
+    if not mappable(dataset):
+        return None
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode="r",
+                     offset=dataset.id.get_offset(), shape=dataset.shape)
+
+
+def array_view(dataset):
+    """
+    The memory map of an h5py.Dataset if it can be mapped, otherwise the
+    dataset.
+    """
+    mapped = memmap(dataset)
+    return dataset if mapped is None else mapped
+
+
+def data_view(data_array):
+    """
+    The memory map of the data of a DataArray if it can be mapped and needs
+    no calibration, otherwise the DataArray.
+    """
+    if len(data_array.polynom_coefficients) or data_array.expansion_origin:
+        return data_array
+    mapped = memmap(data_array._h5group.group["data"])
+    return data_array if mapped is None else mapped
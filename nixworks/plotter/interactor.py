@@ -247,55 +247,52 @@ class Interactor(object):
         '''
         Managing Tagged areas during interaction
 
-        :param tag: Tag to be marked
+        Tags and MultiTags are drawn with a TagOverlay, which only draws the
+        entries in the visible x range and follows the zoom sliders.
+
+        :param tag: Tag or MultiTag to be marked
         :return: None
         '''
+        self._clear_tag()
         if tag is None:
-            if self.mpl_tag:
-                self.mpl_tag.remove()
-                self.mpl_tag = None
-        else:
-            ref = tag.references
-            for i, da_tag in enumerate(self.arrays):
-                if da_tag not in ref:
-                    try:
-                        self.plotter_list[i].sc.set_visible(False)
-                    except AttributeError:
-                        self.plotter_list[i].lines.set_visible(False)
-                    self.check_box[i].value = False
-            x1, = tag.position[0:1]
-            y1 = 0
-            # In case the Tag is an area
-            if tag.extent:
-                if self.mpl_tag:
-                    self.mpl_tag.remove()
-                    self.mpl_tag = None
-                # For Images, tag will be shown in form of a rectangle
-                if any(isinstance(pl, nixplt.ImagePlotter)
-                       for pl in self.plotter_list):
-                    tagged = patches.Rectangle((tag.position[1],
-                                               tag.position[0]), tag.extent[0],
-                                               tag.extent[1], linewidth=1,
-                                               edgecolor='r', facecolor='none')
-                    self.ax.add_patch(tagged)
-                else:
-                    # Highlighting tagged areas in other part
-                    tagged = plt.axvspan(x1, x1 + tag.extent[0],
-                                         facecolor='#2ca02c', alpha=0.5,
-                                         zorder=1)
-                self.mpl_tag = tagged
-            else:
-                # In case if the Tag is just one point
-                if self.mpl_tag:
-                    self.mpl_tag.remove()
-                    self.mpl_tag = None
-                tagged = plt.plot(x1, y1, 'ro')
-                self.mpl_tag = tagged
+            return
+        ref = tag.references
+        for i, da_tag in enumerate(self.arrays):
+            if da_tag not in ref:
+                try:
+                    self.plotter_list[i].sc.set_visible(False)
+                except AttributeError:
+                    self.plotter_list[i].lines.set_visible(False)
+                self.check_box[i].value = False
+        # For Images, a Tag with an extent is shown as a rectangle
+        if isinstance(tag, nix.Tag) and tag.extent and \
+                any(isinstance(pl, nixplt.ImagePlotter)
+                    for pl in self.plotter_list):
+            tagged = patches.Rectangle((tag.position[1], tag.position[0]),
+                                       tag.extent[0], tag.extent[1],
+                                       linewidth=1, edgecolor='r',
+                                       facecolor='none')
+            self.ax.add_patch(tagged)
+            self.mpl_tag = tagged
+            return
+        for i, da_tag in enumerate(self.arrays):
+            if da_tag in ref:
+                self.mpl_tag = nixplt.TagOverlay(
+                    self.ax, da_tag, self.plotter_list[i].xdim,
+                    tags=[tag.id])
+                break
+        self.fig.canvas.draw_idle()
+
+    def _clear_tag(self):
+        if self.mpl_tag:
+            self.mpl_tag.remove()
+            self.mpl_tag = None
 
     @staticmethod
     def _reverse_search_tag(data_arrays):
         '''
-        Search for tags which referenced the data_arrays in the parameter
+        Search for tags and multi tags which referenced the data_arrays in
+        the parameter
         Only for data_arrays within the same block
 
         :param data_arrays: List of DataArrays
@@ -304,7 +301,7 @@ class Interactor(object):
         tag_list = [None]
         blk = data_arrays[0]._parent
         for ref_da in data_arrays:
-            for tag in blk.tags:
+            for tag in list(blk.tags) + list(blk.multi_tags):
                 if ref_da in tag.references and tag not in tag_list:
                     tag_list.append(tag)
         return tag_list
@@ -2,9 +2,15 @@ import os
 import subprocess
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
 from matplotlib.widgets import Slider
 import nixio as nix
 
+from ..instrument import operation
+from ..memmap import data_view
+from ..stats import statistics
+from ..tagindex import tag_index
+
 
 def guess_best_xdim(array):
     data_extent = array.shape
@@ -93,6 +99,68 @@ class Plotter(object):
     def show(self):
         plt.show()
 
+    def overlay_tags(self, tags=None):
+        """
+        Mark the Tags and MultiTag entries referencing the array in the
+        visible x range (see TagOverlay).
+        """
+        self.tag_overlay = TagOverlay(self.axis, self.array, self.xdim, tags)
+        return self.tag_overlay
+
+
+class TagOverlay(object):
+    """
+    Draws the Tags and MultiTag entries referencing a DataArray (or only
+    those given by id or name in 'tags') that overlap the x range of an
+    axis, and redraws them when the x limits change.  The intervals come
+    from the cached TagIndex of the block (see nixworks/tagindex.py), so
+    only the visible events are drawn.  At most 'maxevents' are drawn.
+    """
+
+    def __init__(self, axis, data_array, xdim, tags=None, maxevents=10000,
+                 color="#2ca02c"):
+        self.axis = axis
+        self.array = data_array
+        self.tags = tags
+        self.maxevents = maxevents
+        self.color = color
+        unit = getattr(data_array.dimensions[xdim], "unit", None)
+        self.index = tag_index(data_array._parent, xdim, unit)
+        self.artists = []
+        self.callback = axis.callbacks.connect("xlim_changed", self.update)
+        self.update(axis)
+
+    @operation("TagOverlay.update")
+    def update(self, axis=None):
+        low, high = self.axis.get_xlim()
+        _, _, starts, ends = self.index.overlapping(low, high, self.array,
+                                                    self.tags)
+        starts, ends = starts[:self.maxevents], ends[:self.maxevents]
+        self.clear()
+        transform = self.axis.get_xaxis_transform()
+        spans = ends > starts
+        if spans.any():
+            rectangles = [[(start, 0), (start, 1), (end, 1), (end, 0)]
+                          for start, end in zip(starts[spans], ends[spans])]
+            self.artists.append(self.axis.add_collection(PolyCollection(
+                rectangles, transform=transform, facecolor=self.color,
+                alpha=0.5, zorder=1), autolim=False))
+        if not spans.all():
+            points = starts[~spans]
+            lines = [[(point, 0), (point, 1)] for point in points]
+            self.artists.append(self.axis.add_collection(LineCollection(
+                lines, transform=transform, color=self.color, zorder=1),
+                autolim=False))
+
+    def clear(self):
+        for artist in self.artists:
+            artist.remove()
+        self.artists = []
+
+    def remove(self):
+        self.clear()
+        self.axis.callbacks.disconnect(self.callback)
+
 
 class EventPlotter(Plotter):
 
@@ -108,6 +176,7 @@ class EventPlotter(Plotter):
         else:
             self.xdim = xdim
 
+    @operation("EventPlotter.plot")
     def plot(self, axis=None):
         if axis is None:
             self.fig = plt.figure(figsize=[5.5, 2.])
@@ -151,6 +220,7 @@ class CategoryPlotter(Plotter):
         else:
             self.xdim = xdim
 
+    @operation("CategoryPlotter.plot")
     def plot(self, axis=None):
         if axis is None:
             self.fig = plt.figure()
@@ -220,6 +290,7 @@ class ImagePlotter(Plotter):
         self.array = data_array
         self.image = None
 
+    @operation("ImagePlotter.plot")
     def plot(self, axis=None):
         dim_count = len(self.array.dimensions)
         if axis is None:
@@ -237,7 +308,7 @@ class ImagePlotter(Plotter):
             return None
 
     def plot_2d(self):
-        data = self.array[:]
+        data = data_view(self.array)[:]
         x = self.array.dimensions[0].axis(data.shape[0])
         y = self.array.dimensions[1].axis(data.shape[1])
         xlabel = create_label(self.array.dimensions[0])
@@ -245,7 +316,11 @@ class ImagePlotter(Plotter):
         self.image = self.axis.imshow(data, extent=[x[0], x[-1], y[0], y[-1]])
         self.axis.set_xlabel(xlabel)
         self.axis.set_ylabel(ylabel)
-        self.axis.set
+        if data.ndim == 2:
+            # colour scale of the whole array from the cached statistics
+            low, high = statistics(self.array).limits()
+            if low is not None and np.isfinite([low, high]).all():
+                self.image.set_clim(low, high)
         return self.axis
 
     def plot_3d(self):
@@ -260,6 +335,8 @@ class LinePlotter(Plotter):
 
     def __init__(self, data_array, xdim=-1):
         self.array = data_array
+        # windows are read from a memory map where possible
+        self.data = data_view(data_array)
         self.lines = []
         self.dim_count = len(data_array.dimensions)
         if xdim == -1:
@@ -272,8 +349,17 @@ class LinePlotter(Plotter):
         self.fig = None
         self.axis = None
 
-    def plot(self, axis=None, maxpoints=100000):
+    @operation("LinePlotter.plot")
+    def plot(self, axis=None, maxpoints=100000, autoscale=True):
+        """
+        Plot the first 'maxpoints' samples; the slider moves the window.
+
+        With 'autoscale', the y-axis covers the values of the whole array
+        (from the cached statistics, see nixworks/stats.py, computed once in
+        a chunked pass if needed), so it stays fixed while the window moves.
+        """
         self.maxpoints = maxpoints
+        self.autoscale = autoscale
         if axis is None:
             self.fig = plt.figure()
             self.axis = self.fig.add_axes([0.15, .2, 0.8, 0.75])
@@ -305,6 +391,7 @@ class LinePlotter(Plotter):
             self.__draw(start, end)
         self.fig.canvas.draw_idle()
 
+    @operation("LinePlotter.window")
     def __draw(self, start, end):
         if self.dim_count == 1:
             self.__draw_1d(start, end)
@@ -317,7 +404,7 @@ class LinePlotter(Plotter):
         if end > self.array.shape[self.xdim]:
             end = self.array.shape[self.xdim]
 
-        y = self.array[int(start):int(end)]
+        y = self.data[int(start):int(end)]
         dim = self.array.dimensions[self.xdim]
         x = np.asarray(dim.axis(len(y), int(start)))
 
@@ -345,9 +432,9 @@ class LinePlotter(Plotter):
 
         for i, l in enumerate(labels):
             if (self.xdim == 0):
-                y = self.array[int(start):int(end), i]
+                y = self.data[int(start):int(end), i]
             else:
-                y = self.array[i, int(start):int(end)]
+                y = self.data[i, int(start):int(end)]
 
             if len(self.lines) <= i:
                 ll, = self.axis.plot(x, y, label=l)
@@ -358,8 +445,18 @@ class LinePlotter(Plotter):
 
         self.axis.set_xlim([x[0], x[-1]])
 
+    def __set_ylim(self):
+        if not self.autoscale:
+            return
+        low, high = statistics(self.array).limits()
+        if low is None or not np.isfinite([low, high]).all():
+            return
+        margin = (high - low) * 0.05 or abs(low) * 0.05 or 1.0
+        self.axis.set_ylim([low - margin, high + margin])
+
     def plot_array_1d(self):
         self.__draw_1d(0, self.maxpoints)
+        self.__set_ylim()
         xlabel = create_label(self.array.dimensions[self.xdim])
         ylabel = create_label(self.array)
         self.axis.set_xlabel(xlabel)
@@ -368,6 +465,7 @@ class LinePlotter(Plotter):
 
     def plot_array_2d(self):
         self.__draw_2d(0, self.maxpoints)
+        self.__set_ylim()
         xlabel = create_label(self.array.dimensions[self.xdim])
         ylabel = create_label(self.array)
         self.axis.set_xlabel(xlabel)
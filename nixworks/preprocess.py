@@ -0,0 +1,444 @@
+"""
+preprocess.py
+
+Usage:
+  nixworks preprocess --array=<name> [--output=<name>] [--reference=<ch>]
+                      [--highpass=<f>] [--lowpass=<f>] [--bandpass=<f> <f>]
+                      [--notch=<f>...] [--fir=<taps>] [--decimate=<n>...]
+                      [--jobs=<n>] <file>
+
+Filter, re-reference and decimate sampled DataArrays block by block and
+write the results as new DataArrays.
+
+    from nixworks.preprocess import Bandpass, Decimate, Notch, Reference
+    from nixworks.preprocess import preprocess
+
+    steps = [Reference(), Bandpass(1.0, 40.0), Notch(50.0), Decimate(4)]
+    filtered = preprocess(data_array, steps, "eeg 1-40 Hz", jobs=4)
+
+The source is read in chunk-aligned blocks along its sampled dimension (see
+converters/streaming.py), so memory use depends on the block size and the
+number of channels, not on the length of the recording.  The filters are
+causal and keep their state from one block to the next, so the result is
+the same as filtering the whole recording at once:
+
+- IIR filters ('Highpass', 'Lowpass', 'Bandpass', 'Bandstop', 'Notch') run
+  as second order sections with scipy.signal.sosfilt, which takes and
+  returns the filter state ('zi').
+- FIR filters ('FIR', or any of the band filters with 'taps') are applied by
+  overlap-save: every block is convolved together with the last 'taps - 1'
+  samples of the block before.
+- 'Decimate' low-pass filters (Chebyshev type I, as scipy.signal.decimate)
+  and keeps every n-th sample, counting samples across blocks.
+- 'Reference' subtracts the mean of some channels (all by default, common
+  average reference) from every channel.
+
+All filters start in the steady state of the first sample, as if the signal
+had been constant before the recording started, which avoids the onset
+transient of high-pass filters on signals with an offset.  Filtering is not
+zero-phase: forward-backward filtering needs the whole signal.
+
+The channels are split into 'jobs' groups, each with its own filter state,
+which are filtered in parallel threads (scipy's filters release the GIL).
+Referencing needs all channels and is applied to the whole block first; as
+all other steps are linear and the same for every channel, this gives the
+same result as referencing at any later point.
+
+The result is a float64 DataArray on the block of the source, with the same
+dimension order, a sampled dimension with the decimated sampling interval
+and the labels of the source.  Its metadata is a section of the type
+'nixworks.provenance' (below the section 'nixworks.provenance' of the
+file) that holds the name and id of the source and a description of every
+step.
+"""
+import sys
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nixio as nix
+from scipy import signal
+
+from .arrays import calibrate, sampling_rate, time_dimension
+from .instrument import operation
+from .stats import read_values
+from .converters.layout import Layout
+from .converters.streaming import (DEFAULT_BUFFER_BYTES, block_rows,
+                                   can_decode, filter_pipeline, iter_blocks)
+
+SECTION_NAME = SECTION_TYPE = "nixworks.provenance"
+
+
+class SOSFilter:
+    """IIR filter (second order sections) with state along axis 0."""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def __call__(self, block):
+        if self.zi is None:
+            zi = signal.sosfilt_zi(self.sos)
+            self.zi = zi[:, :, np.newaxis] * block[0]
+        block, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return block
+
+
+class FIRFilter:
+    """FIR filter applied by overlap-save along axis 0."""
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps)[:, np.newaxis]
+        self.history = None
+
+    def __call__(self, block):
+        if self.history is None:
+            self.history = np.repeat(block[:1], len(self.taps) - 1, axis=0)
+        extended = np.concatenate((self.history, block))
+        self.history = extended[len(extended) - len(self.taps) + 1:]
+        return signal.oaconvolve(extended, self.taps, mode="valid", axes=0)
+
+
+class Downsample:
+    """Keep every 'factor'-th sample, counting samples across blocks."""
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.position = 0
+
+    def __call__(self, block):
+        first = -self.position % self.factor
+        self.position += len(block)
+        return block[first::self.factor]
+
+
+@dataclasses.dataclass
+class BandFilter:
+    """
+    Butterworth (or other 'ftype' of scipy.signal.iirfilter) IIR filter, or
+    an FIR filter with 'taps' coefficients (scipy.signal.firwin).
+    """
+    frequencies: tuple
+    btype: str
+    order: int = 4
+    ftype: str = "butter"
+    taps: int = None
+
+    factor = 1
+
+    def start(self, rate):
+        if self.taps:
+            return FIRFilter(signal.firwin(
+                self.taps, self.frequencies, pass_zero=self.btype, fs=rate))
+        return SOSFilter(signal.iirfilter(
+            self.order, self.frequencies, btype=self.btype, ftype=self.ftype,
+            output="sos", fs=rate))
+
+    def describe(self):
+        frequencies = " - ".join(f"{f:g}" for f in
+                                 np.atleast_1d(self.frequencies))
+        if self.taps:
+            return f"{self.btype} {frequencies} Hz, FIR ({self.taps} taps)"
+        return (f"{self.btype} {frequencies} Hz, IIR ({self.ftype}, "
+                f"order {self.order})")
+
+
+def Highpass(frequency, **kwargs):
+    return BandFilter(frequency, "highpass", **kwargs)
+
+
+def Lowpass(frequency, **kwargs):
+    return BandFilter(frequency, "lowpass", **kwargs)
+
+
+def Bandpass(low, high, **kwargs):
+    return BandFilter((low, high), "bandpass", **kwargs)
+
+
+def Bandstop(low, high, **kwargs):
+    return BandFilter((low, high), "bandstop", **kwargs)
+
+
+@dataclasses.dataclass
+class Notch:
+    """IIR notch filter (scipy.signal.iirnotch)."""
+    frequency: float
+    quality: float = 30.0
+
+    factor = 1
+
+    def start(self, rate):
+        b, a = signal.iirnotch(self.frequency, self.quality, fs=rate)
+        return SOSFilter(signal.tf2sos(b, a))
+
+    def describe(self):
+        return f"notch {self.frequency:g} Hz (Q {self.quality:g})"
+
+
+@dataclasses.dataclass
+class FIR:
+    """FIR filter with the given coefficients."""
+    taps: np.ndarray
+
+    factor = 1
+
+    def start(self, rate):
+        return FIRFilter(self.taps)
+
+    def describe(self):
+        return f"FIR ({len(self.taps)} taps)"
+
+
+@dataclasses.dataclass
+class Decimate:
+    """
+    Anti-aliasing low-pass filter at 0.8 times the new Nyquist frequency
+    and downsampling by 'factor'.
+    """
+    factor: int
+    order: int = 8
+
+    def start(self, rate):
+        sos = signal.cheby1(self.order, 0.05, 0.8 / self.factor,
+                            output="sos")
+        return Chain([SOSFilter(sos), Downsample(self.factor)])
+
+    def describe(self):
+        return f"decimate by {self.factor} (Chebyshev I, order {self.order})"
+
+
+@dataclasses.dataclass
+class Reference:
+    """
+    Subtract the mean of the given channels (indices or labels of the
+    channel dimension, all channels if None) from every channel.
+    """
+    channels: tuple = None
+
+    factor = 1
+
+    def describe(self):
+        if self.channels is None:
+            return "common average reference"
+        return "reference " + ", ".join(str(c) for c in self.channels)
+
+    def indices(self, labels):
+        if self.channels is None:
+            return None
+        return [labels.index(c) if isinstance(c, str) else c
+                for c in self.channels]
+
+
+class Chain:
+    """Processing steps applied one after the other."""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __call__(self, block):
+        for step in self.steps:
+            block = step(block)
+        return block
+
+
+def output_length(length, steps):
+    """Number of samples left of 'length' after the decimation steps."""
+    for step in steps:
+        length = -(-length // step.factor)
+    return length
+
+
+def create_output(source, name, time_axis, length, interval, layout):
+    """The DataArray for the results, with the dimensions of the source."""
+    shape = list(source.shape)
+    shape[time_axis] = length
+    block = source._parent
+    output = layout.create_data_array(block, name, source.type, shape=shape,
+                                      dtype=np.float64, time_axis=time_axis)
+    output.unit = source.unit
+    output.label = source.label
+    for idx, dim in enumerate(source.dimensions):
+        if idx == time_axis:
+            sampled = output.append_sampled_dimension(
+                interval, label=dim.label, unit=dim.unit)
+            sampled.offset = dim.offset
+        elif dim.dimension_type == nix.DimensionType.Set:
+            output.append_set_dimension(labels=dim.labels)
+        elif dim.dimension_type == nix.DimensionType.Sample:
+            sampled = output.append_sampled_dimension(
+                dim.sampling_interval, label=dim.label, unit=dim.unit)
+            sampled.offset = dim.offset
+        else:
+            output.append_range_dimension(dim.ticks, label=dim.label,
+                                          unit=dim.unit)
+    return output
+
+
+def record_provenance(source, output, steps, rate):
+    """
+    Link a section describing how 'output' was computed from 'source' to
+    it.  'steps' are descriptions of the processing steps.
+    """
+    nixfile = source.file
+    if SECTION_NAME in nixfile.sections:
+        parent = nixfile.sections[SECTION_NAME]
+    else:
+        parent = nixfile.create_section(SECTION_NAME, SECTION_TYPE)
+    section = parent.create_section(f"DataArray {output.id}", SECTION_TYPE)
+    section["Source"] = source.id
+    section["SourceName"] = source.name
+    section["Steps"] = list(steps) or ["copy"]
+    section["SamplingRate"] = rate
+    output.metadata = section
+    return section
+
+
+@operation("preprocess")
+def preprocess(data_array, steps, name, jobs=1, layout=None,
+               buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Apply processing steps to a DataArray with a sampled dimension and write
+    the result to a new DataArray.
+
+    :param data_array: The source DataArray (1 or 2 dimensions).
+    :type data_array: nix.DataArray
+    :param steps: Processing steps ('BandFilter', 'Notch', 'FIR',
+    'Decimate', 'Reference'), applied in order.
+    :param name: Name of the new DataArray.
+    :param jobs: Number of threads the channels are split over.  As with
+    stats.compute_statistics(), do not call this inside a loop over a NIX
+    container when jobs > 1.
+    :param layout: Storage layout of the result (default: Layout()).
+    :param buffer_bytes: Size of the blocks read at once.
+    :rtype: nix.DataArray
+    """
+    time_axis = time_dimension(data_array)
+    if time_axis is None or data_array.dimensions[time_axis].dimension_type \
+            != nix.DimensionType.Sample:
+        raise ValueError(f"DataArray {data_array.name} has no sampled "
+                         "dimension")
+    if len(data_array.shape) > 2:
+        raise ValueError("Only DataArrays with 1 or 2 dimensions can be "
+                         "processed")
+    channel_axis = 1 - time_axis if len(data_array.shape) == 2 else None
+    dim = data_array.dimensions[time_axis]
+    rate = sampling_rate(dim.sampling_interval, dim.unit) or \
+        1.0 / dim.sampling_interval
+    factor = int(np.prod([step.factor for step in steps]))
+
+    references = [step for step in steps if isinstance(step, Reference)]
+    filters = [step for step in steps if not isinstance(step, Reference)]
+    labels = []
+    if channel_axis is not None:
+        channel_dim = data_array.dimensions[channel_axis]
+        if channel_dim.dimension_type == nix.DimensionType.Set:
+            labels = list(channel_dim.labels)
+    references = [step.indices(labels) for step in references]
+
+    dataset = data_array._h5group.group["data"]
+    length = dataset.shape[time_axis]
+    channels = dataset.shape[channel_axis] if channel_axis is not None else 1
+    groups = [group for group in np.array_split(np.arange(channels),
+                                                max(jobs, 1)) if len(group)]
+    chains = []
+    for _ in groups:
+        current = rate
+        chain = []
+        for step in filters:
+            chain.append(step.start(current))
+            current /= step.factor
+        chains.append(Chain(chain))
+
+    output = create_output(data_array, name, time_axis,
+                           output_length(length, filters),
+                           dim.sampling_interval * factor,
+                           layout or Layout())
+    target = output._h5group.group["data"]
+    record_provenance(data_array, output,
+                      [step.describe() for step in steps], rate / factor)
+    calibrated = len(data_array.polynom_coefficients) or \
+        data_array.expansion_origin
+
+    pipeline = None
+    if time_axis == 0 and can_decode(dataset):
+        pipeline = filter_pipeline(dataset)
+    chunks = (dataset.chunks[time_axis],) if dataset.chunks else None
+    rows = block_rows((length, channels), np.float64, chunks, buffer_bytes)
+
+    def task(chain, values):
+        return chain(values)
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        for slc in iter_blocks((length,), rows):
+            values = read_values(dataset, slc, time_axis, channel_axis,
+                                 pipeline).astype(np.float64)
+            if calibrated:
+                values = calibrate(values, data_array)
+            for indices in references:
+                reference = values if indices is None else values[:, indices]
+                values -= reference.mean(axis=1, keepdims=True)
+            if len(groups) == 1:
+                result = chains[0](values)
+            else:
+                result = np.concatenate(list(pool.map(
+                    task, chains, [values[:, group] for group in groups])),
+                    axis=1)
+            count = len(result)
+            if not count:
+                continue
+            index = slice(written, written + count)
+            if channel_axis is None:
+                target[index] = result[:, 0]
+            elif time_axis == 0:
+                target[index] = result
+            else:
+                target[:, index] = result.T
+            written += count
+    return output
+
+
+def steps_from_args(args):
+    """Processing steps given on the command line."""
+    steps = []
+    if args.reference:
+        channels = None
+        if args.reference != "average":
+            channels = [int(c) if c.isdigit() else c
+                        for c in args.reference.split(",")]
+        steps.append(Reference(channels))
+    taps = {"taps": args.fir} if args.fir else {}
+    if args.highpass:
+        steps.append(Highpass(args.highpass, **taps))
+    if args.lowpass:
+        steps.append(Lowpass(args.lowpass, **taps))
+    if args.bandpass:
+        steps.append(Bandpass(*args.bandpass, **taps))
+    for frequency in args.notch or ():
+        steps.append(Notch(frequency))
+    for factor in args.decimate or ():
+        steps.append(Decimate(factor))
+    return steps
+
+
+def run(args):
+    """filter, reference and decimate a DataArray of a NIX file"""
+    steps = steps_from_args(args)
+    nixfile = nix.File.open(args.FILE, nix.FileMode.ReadWrite)
+    try:
+        for block in nixfile.blocks:
+            if args.array in block.data_arrays:
+                source = block.data_arrays[args.array]
+                break
+        else:
+            sys.exit(f"No DataArray named {args.array}")
+        name = args.output or f"{args.array} (preprocessed)"
+        try:
+            output = preprocess(source, steps, name, args.jobs)
+        except ValueError as exc:
+            sys.exit(str(exc))
+        for step in steps:
+            print(step.describe())
+        print(f"{block.name}/{output.name}: {output.shape}")
+    finally:
+        nixfile.close()
@@ -0,0 +1,360 @@
+"""
+spectral.py
+
+Usage:
+  nixworks spectral --array=<name> [--welch] [--channel=<channel>]
+                    [--nperseg=<n>] [--noverlap=<n>] [--nfft=<n>]
+                    [--window=<window>] [--output=<name>] [--restart]
+                    [--jobs=<n>] <file>
+
+Spectrograms and Welch power spectral densities of sampled DataArrays,
+computed window by window and written to new DataArrays.
+
+    from nixworks.spectral import Segments, spectrogram, welch
+
+    segments = Segments(nperseg=1024, noverlap=512)
+    sgram = spectrogram(data_array, "lfp spectrogram", segments, channel=3)
+    ImagePlotter(sgram).plot()
+    psd = welch(data_array, "lfp psd", segments)
+    LinePlotter(psd).plot()
+
+The source is read in blocks of consecutive segments along its sampled
+dimension, so memory use depends on the block size, not on the length of
+the recording.  Every segment is detrended (mean removed), multiplied by
+the window and transformed with scipy.fft; the results match
+scipy.signal.spectrogram and scipy.signal.welch with the same window (Hann
+by default, as 'welch') and 'density' scaling (one-sided, in
+<unit>^2/Hz).  With 'jobs' > 1 the transforms of a block run in that many
+threads (scipy.fft releases the GIL).
+
+A spectrogram has the dimensions time (sampled, one sample per segment,
+at the centre of the segment), frequency (sampled, in Hz) and, unless a
+single channel is selected or the source has only one, channel (set, with
+the labels of the source).  A Welch PSD has the dimensions frequency and
+channel.
+
+The computation can be interrupted and continued: the metadata section of
+the result (see preprocess.py) holds the parameters and the number of
+segments completed, which is flushed to the file after every block.
+Calling 'spectrogram()' or 'welch()' again with the same name and
+parameters continues from there (a Welch PSD keeps the running mean of the
+segments done so far); with other parameters it raises a ValueError unless
+'restart' is set.
+"""
+import sys
+import dataclasses
+
+import numpy as np
+import nixio as nix
+import scipy.fft
+from scipy import signal
+
+from .arrays import calibrate, sampling_rate, time_dimension
+from .instrument import operation
+from .converters.layout import Layout
+from .converters.streaming import DEFAULT_BUFFER_BYTES
+from .preprocess import SECTION_TYPE, record_provenance
+
+
+@dataclasses.dataclass
+class Segments:
+    """
+    Segmentation of a signal for spectral estimates (the parameters of
+    scipy.signal.spectrogram).  'noverlap' defaults to half a segment,
+    'nfft' to 'nperseg'.
+    """
+    nperseg: int = 256
+    noverlap: int = None
+    nfft: int = None
+    window: str = "hann"
+
+    def __post_init__(self):
+        if self.noverlap is None:
+            self.noverlap = self.nperseg // 2
+        if self.nfft is None:
+            self.nfft = self.nperseg
+        if not 0 <= self.noverlap < self.nperseg:
+            raise ValueError("noverlap must be smaller than nperseg")
+        if self.nfft < self.nperseg:
+            raise ValueError("nfft must not be smaller than nperseg")
+
+    @property
+    def step(self):
+        return self.nperseg - self.noverlap
+
+    @property
+    def frequencies(self):
+        return self.nfft // 2 + 1
+
+    def count(self, length):
+        """Number of segments of a signal with 'length' samples."""
+        if length < self.nperseg:
+            return 0
+        return (length - self.nperseg) // self.step + 1
+
+    def describe(self):
+        return (f"{self.window} window, {self.nperseg} samples, overlap "
+                f"{self.noverlap}, nfft {self.nfft}")
+
+
+def power(values, rate, segments, workers=1):
+    """
+    Power spectral densities of the segments of 'values' (samples,
+    channels) as an array of shape (segments, channels, frequencies).
+    """
+    window = signal.get_window(segments.window, segments.nperseg)
+    frames = np.lib.stride_tricks.sliding_window_view(
+        values, segments.nperseg, axis=0)[::segments.step]
+    frames = (frames - frames.mean(axis=-1, keepdims=True)) * window
+    spectrum = scipy.fft.rfft(frames, n=segments.nfft, axis=-1,
+                              workers=workers)
+    psd = spectrum.real ** 2 + spectrum.imag ** 2
+    psd *= 1.0 / (rate * (window ** 2).sum())
+    # one-sided: all but DC (and Nyquist for even nfft) count twice
+    psd[..., 1:None if segments.nfft % 2 else -1] *= 2
+    return psd
+
+
+class Source:
+    """The sampled DataArray and the channels to analyse."""
+
+    def __init__(self, data_array, channel=None):
+        time_axis = time_dimension(data_array)
+        if time_axis is None or data_array.dimensions[time_axis]. \
+                dimension_type != nix.DimensionType.Sample:
+            raise ValueError(f"DataArray {data_array.name} has no sampled "
+                             "dimension")
+        if len(data_array.shape) > 2:
+            raise ValueError("Only DataArrays with 1 or 2 dimensions can be "
+                             "analysed")
+        self.data_array = data_array
+        self.dataset = data_array._h5group.group["data"]
+        self.time_axis = time_axis
+        self.channel_axis = 1 - time_axis if len(data_array.shape) == 2 \
+            else None
+        self.dim = data_array.dimensions[time_axis]
+        self.rate = sampling_rate(self.dim.sampling_interval,
+                                  self.dim.unit) or \
+            1.0 / self.dim.sampling_interval
+        self.length = data_array.shape[time_axis]
+        self.labels = []
+        channels = 1
+        if self.channel_axis is not None:
+            channels = data_array.shape[self.channel_axis]
+            dim = data_array.dimensions[self.channel_axis]
+            if dim.dimension_type == nix.DimensionType.Set:
+                self.labels = list(dim.labels)
+        self.channels = list(range(channels))
+        if channel is not None:
+            if isinstance(channel, str):
+                channel = self.labels.index(channel)
+            self.channels = [channel]
+        self.labels = [self.labels[idx] for idx in self.channels] \
+            if self.labels else []
+        self.calibrated = len(data_array.polynom_coefficients) or \
+            data_array.expansion_origin
+
+    def read(self, start, stop):
+        """The samples [start, stop) of the channels, as (samples, channels)"""
+        # only the selected channel (or all of them) is read
+        index = [slice(start, stop)] * self.dataset.ndim
+        if self.channel_axis is not None:
+            index[self.channel_axis] = slice(self.channels[0],
+                                             self.channels[-1] + 1)
+        values = self.dataset[tuple(index)]
+        if self.channel_axis is None:
+            values = values.reshape(-1, 1)
+        elif self.channel_axis == 0:
+            values = values.T
+        values = values.astype(np.float64)
+        if self.calibrated:
+            values = calibrate(values, self.data_array)
+        return values
+
+    def blocks(self, segments, first, buffer_bytes, workers):
+        """
+        Power spectral densities of the segments from 'first' on, in blocks
+        of (first segment, array of shape (segments, channels, frequencies)).
+        """
+        total = segments.count(self.length)
+        size = 8 * len(self.channels) * (segments.nperseg + 2 * segments.nfft)
+        count = max(buffer_bytes // size, 1)
+        for start in range(first, total, count):
+            stop = min(start + count, total)
+            values = self.read(start * segments.step,
+                               (stop - 1) * segments.step + segments.nperseg)
+            yield start, power(values, self.rate, segments, workers)
+
+    def add_channel_dimension(self, output):
+        if len(self.channels) > 1:
+            output.append_set_dimension(labels=self.labels or None)
+
+    def psd_unit(self):
+        unit = self.data_array.unit
+        return f"{unit}^2/Hz" if unit else None
+
+
+def open_output(source, name, shape, parameters, description, rate,
+                restart, add_dimensions):
+    """
+    The DataArray for the results and the number of segments already done,
+    creating it (with the dimensions added by 'add_dimensions(output)' and
+    its provenance section) if it does not exist yet.
+    """
+    block = source.data_array._parent
+    if name in block.data_arrays:
+        output = block.data_arrays[name]
+        section = output.metadata
+        resumable = section is not None and section.type == SECTION_TYPE \
+            and "Parameters" in section.props and \
+            section["Parameters"] == parameters and \
+            section["Source"] == source.data_array.id and \
+            output.shape == shape
+        if resumable and not restart:
+            return output, int(section["Completed"])
+        if not restart:
+            raise ValueError(f"DataArray {name} exists and was computed "
+                             "differently")
+        if section is not None:
+            del section.parent.sections[section.name]
+        del block.data_arrays[name]
+    output = Layout().create_data_array(block, name, "nixworks.spectral",
+                                        shape=shape, dtype=np.float64,
+                                        time_axis=0)
+    output.unit = source.psd_unit()
+    add_dimensions(output)
+    section = record_provenance(source.data_array, output, [description],
+                                rate)
+    section["Parameters"] = parameters
+    section["Completed"] = 0
+    return output, 0
+
+
+def append_frequency_dimension(output, source, segments):
+    dim = output.append_sampled_dimension(source.rate / segments.nfft,
+                                          label="frequency", unit="Hz")
+    dim.offset = 0.0
+
+
+@operation("spectral.spectrogram")
+def spectrogram(data_array, name, segments=None, channel=None, jobs=1,
+                restart=False, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Compute (or continue computing) the spectrogram of a sampled DataArray
+    into a new DataArray.
+
+    :param data_array: The source DataArray (1 or 2 dimensions).
+    :type data_array: nix.DataArray
+    :param name: Name of the new DataArray.
+    :param segments: Segment length, overlap and window (default:
+    Segments()).
+    :param channel: Index or label of a single channel to analyse.
+    :param jobs: Number of threads for the transforms.
+    :param restart: Start over if the DataArray 'name' already exists.
+    :param buffer_bytes: Memory used for a block of segments.
+    :rtype: nix.DataArray
+    """
+    segments = segments or Segments()
+    source = Source(data_array, channel)
+    windows = segments.count(source.length)
+    shape = (windows, segments.frequencies)
+    if len(source.channels) > 1:
+        shape += (len(source.channels),)
+    parameters = repr(("spectrogram", dataclasses.astuple(segments),
+                       source.channels))
+    interval = source.dim.sampling_interval
+
+    def add_dimensions(output):
+        dim = output.append_sampled_dimension(
+            interval * segments.step, label=source.dim.label,
+            unit=source.dim.unit)
+        # every segment is placed at its centre
+        dim.offset = (source.dim.offset or 0.0) + \
+            interval * segments.nperseg / 2
+        append_frequency_dimension(output, source, segments)
+        source.add_channel_dimension(output)
+
+    output, first = open_output(
+        source, name, shape, parameters, "spectrogram, " +
+        segments.describe(), source.rate / segments.step, restart,
+        add_dimensions)
+
+    target = output._h5group.group["data"]
+    section = output.metadata
+    nixfile = data_array.file
+    for start, psd in source.blocks(segments, first, buffer_bytes, jobs):
+        if len(source.channels) > 1:
+            target[start:start + len(psd)] = psd.transpose(0, 2, 1)
+        else:
+            target[start:start + len(psd)] = psd[:, 0]
+        section["Completed"] = start + len(psd)
+        nixfile.flush()
+    return output
+
+
+@operation("spectral.welch")
+def welch(data_array, name, segments=None, channel=None, jobs=1,
+          restart=False, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Compute (or continue computing) the Welch power spectral density of a
+    sampled DataArray (the mean of the spectrogram over time) into a new
+    DataArray.  The parameters are those of 'spectrogram()'.
+
+    :rtype: nix.DataArray
+    """
+    segments = segments or Segments()
+    source = Source(data_array, channel)
+    shape = (segments.frequencies,)
+    if len(source.channels) > 1:
+        shape += (len(source.channels),)
+    parameters = repr(("welch", dataclasses.astuple(segments),
+                       source.channels))
+
+    def add_dimensions(output):
+        append_frequency_dimension(output, source, segments)
+        source.add_channel_dimension(output)
+
+    output, first = open_output(
+        source, name, shape, parameters, "Welch PSD, " +
+        segments.describe(), source.rate, restart, add_dimensions)
+
+    target = output._h5group.group["data"]
+    section = output.metadata
+    nixfile = data_array.file
+    total = np.zeros((segments.frequencies, len(source.channels)))
+    if first:
+        total += target[:].reshape(total.shape) * first
+    for start, psd in source.blocks(segments, first, buffer_bytes, jobs):
+        total += psd.sum(axis=0).T
+        done = start + len(psd)
+        target[:] = (total / done).reshape(shape)
+        section["Completed"] = done
+        nixfile.flush()
+    return output
+
+
+def run(args):
+    """compute the spectrogram or Welch PSD of a DataArray of a NIX file"""
+    segments = Segments(args.nperseg, args.noverlap, args.nfft, args.window)
+    channel = args.channel
+    if channel is not None and channel.isdigit():
+        channel = int(channel)
+    nixfile = nix.File.open(args.FILE, nix.FileMode.ReadWrite)
+    try:
+        for block in nixfile.blocks:
+            if args.array in block.data_arrays:
+                source = block.data_arrays[args.array]
+                break
+        else:
+            sys.exit(f"No DataArray named {args.array}")
+        compute = welch if args.welch else spectrogram
+        name = args.output or \
+            f"{args.array} ({'psd' if args.welch else 'spectrogram'})"
+        try:
+            output = compute(source, name, segments, channel, args.jobs,
+                             args.restart)
+        except ValueError as exc:
+            sys.exit(str(exc))
+        print(f"{block.name}/{output.name}: {output.shape}")
+    finally:
+        nixfile.close()
@@ -0,0 +1,574 @@
+"""
+stats.py
+
+Usage:
+  nixworks stats [--array=<name>...] [--bins=<n>] [--jobs=<n>] [--refresh]
+                 <file>
+
+Per channel statistics of DataArrays, computed in one chunked pass and
+cached in the file.
+
+    from nixworks.stats import statistics
+
+    stats = statistics(data_array)
+    stats.minimum, stats.maximum, stats.mean, stats.std, stats.nans
+    counts, edges = stats.histogram_of(channel)
+    low, high = stats.limits()
+
+'compute_statistics()' reads a dataset in chunk-aligned blocks along one
+axis in a pool of reader threads (deflate/shuffle compressed chunks are
+decoded outside of HDF5, see converters/streaming.py), so memory use is
+bounded by the block size times the number of threads.  Every block yields
+partial statistics, which are merged: counts and extremes directly, means
+and variances with the pairwise update of Chan et al.
+
+The histograms have a fixed number of bins per channel.  Bin widths are
+powers of two and bins start at multiples of their width, so a histogram
+of one block can be merged exactly with that of another: when the range
+grows, neighbouring bins are combined (the width doubles) until the values
+of both fit.  No second pass over the data is needed to find the range
+first, at the cost of the histogram covering up to four times the range of
+the values.  NaN and infinite values are counted separately and ignored
+by all other statistics.
+
+For DataArrays with a sampled or range time dimension and two dimensions,
+the statistics are computed per channel (along the other dimension), for
+all other arrays (1D signals, images) over all values.  They describe the
+calibrated values of DataArrays with polynomial coefficients or an
+expansion origin, as returned by nixio and drawn by the plotters.
+
+'statistics()' stores the results in a section named 'nixworks.statistics'
+of the file, with one subsection per DataArray ('DataArray <id>'), and
+reuses them as long as the content fingerprint of the data matches.  The
+fingerprint covers shape, data type, the chunk index of the dataset (offset,
+size and filter mask of every stored chunk), a digest of a few sampled rows
+and the calibration of the DataArray, and is computed without reading the
+whole array.  Changes that keep
+the size of every stored chunk and miss the sampled rows (e.g., rewriting
+values of an uncompressed array in place) are not detected; use
+'refresh=True' (or '--refresh') after such changes.  Files opened read only
+are not modified; their statistics are only cached in memory.
+
+The command computes (or loads) the statistics of all DataArrays in a NIX
+file (or of the named ones) and prints them.
+"""
+import sys
+import hashlib
+import functools
+import dataclasses
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nixio as nix
+
+from .arrays import calibrate, time_dimension
+from .instrument import operation
+from .converters.streaming import (DEFAULT_BUFFER_BYTES, block_rows,
+                                   can_decode, filter_pipeline, iter_blocks,
+                                   read_block)
+
+
+SECTION_NAME = "nixworks.statistics"
+SECTION_TYPE = "nixworks.statistics"
+DEFAULT_BINS = 64
+# rows hashed at each of the sampled positions of the fingerprint
+SAMPLE_POSITIONS = 16
+SAMPLE_ROWS = 16
+
+# statistics of arrays in read only files: (file, id) -> ArrayStatistics
+_memory = dict()
+
+
+@dataclasses.dataclass
+class ArrayStatistics:
+    """
+    Statistics of the channels of an array.  All fields are arrays with one
+    value (or histogram row) per channel.  Except for the numbers of NaN
+    and infinite values, they describe the finite values; channels without
+    any have NaN statistics.
+    """
+    count: np.ndarray           # number of finite values
+    nans: np.ndarray            # number of NaN values
+    infs: np.ndarray            # number of infinite values
+    minimum: np.ndarray
+    maximum: np.ndarray
+    mean: np.ndarray
+    m2: np.ndarray              # sum of squared deviations from the mean
+    histogram: np.ndarray       # (channels, bins) counts of finite values
+    start: np.ndarray           # left edge of the first bin
+    width: np.ndarray           # bin width (a power of two, 0 if empty)
+    channel_axis: int = None
+    fingerprint: str = ""
+
+    @property
+    def channels(self):
+        return len(self.count)
+
+    @property
+    def bins(self):
+        return self.histogram.shape[1]
+
+    @property
+    def std(self):
+        """Population standard deviation."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0,
+                            np.sqrt(self.m2 / np.maximum(self.count, 1)),
+                            np.nan)
+
+    def histogram_of(self, channel=0):
+        """
+        Counts and bin edges (bins + 1 values) of the histogram of a channel.
+        """
+        edges = self.start[channel] + \
+            np.arange(self.bins + 1) * self.width[channel]
+        return self.histogram[channel], edges
+
+    def limits(self, channels=None):
+        """
+        Smallest and largest finite value over the given channels (default:
+        all); (None, None) if there are none.
+        """
+        select = slice(None) if channels is None else list(channels)
+        low, high = self.minimum[select], self.maximum[select]
+        if np.all(np.isnan(low)):
+            return None, None
+        return float(np.nanmin(low)), float(np.nanmax(high))
+
+    def merge(self, other):
+        """
+        Combine the statistics of two parts of the same channels.
+        """
+        count = self.count + other.count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.where(count > 0,
+                                other.count / np.maximum(count, 1), 0.0)
+            delta = np.where(other.count > 0, other.mean, 0.0) - \
+                np.where(self.count > 0, self.mean, 0.0)
+            mean = np.where(self.count > 0, self.mean, 0.0) + delta * fraction
+            m2 = self.m2 + other.m2 + delta**2 * self.count * fraction
+        histogram, start, width = merge_histograms(
+            (self.histogram, self.start, self.width),
+            (other.histogram, other.start, other.width))
+        return ArrayStatistics(
+            count=count, nans=self.nans + other.nans,
+            infs=self.infs + other.infs,
+            minimum=np.fmin(self.minimum, other.minimum),
+            maximum=np.fmax(self.maximum, other.maximum),
+            mean=np.where(count > 0, mean, np.nan), m2=m2,
+            histogram=histogram, start=start, width=width,
+            channel_axis=self.channel_axis, fingerprint=self.fingerprint)
+
+    def overall(self):
+        """
+        The statistics of all channels combined into one channel.
+        """
+        merged = self.channel(0)
+        for idx in range(1, self.channels):
+            merged = merged.merge(self.channel(idx))
+        merged.channel_axis = None
+        return merged
+
+    def channel(self, idx):
+        select = slice(idx, idx + 1)
+        return ArrayStatistics(
+            count=self.count[select], nans=self.nans[select],
+            infs=self.infs[select],
+            minimum=self.minimum[select], maximum=self.maximum[select],
+            mean=self.mean[select], m2=self.m2[select],
+            histogram=self.histogram[select], start=self.start[select],
+            width=self.width[select], channel_axis=self.channel_axis,
+            fingerprint=self.fingerprint)
+
+
+def histogram_grid(low, high, bins, width=None):
+    """
+    Start and power of two width per channel of the bins that cover the
+    values [low, high] (one value per channel) with 'bins' bins that are no
+    narrower than 'width'.
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        span = (high - low) / bins
+        # bins of a single value get a width well below its magnitude
+        tiny = np.maximum(np.maximum(np.abs(low), np.abs(high)) * 2.0**-20,
+                          2.0**-1000)
+        needed = np.maximum(span, tiny)
+        if width is not None:
+            needed = np.maximum(needed, width)
+        width = 2.0 ** np.ceil(np.log2(needed))
+        start = np.floor(low / width) * width
+        # alignment can push 'high' out of the last bin: widen once more
+        for _ in range(4):
+            short = start + bins * width <= high
+            if not np.any(short):
+                break
+            width = np.where(short, width * 2, width)
+            start = np.floor(low / width) * width
+    return start, width
+
+
+def occupied(histogram, start, width):
+    """
+    Lower edge of the first and upper edge of the last non empty bin per
+    channel (NaN for empty histograms).
+    """
+    nonzero = histogram > 0
+    anything = nonzero.any(axis=1)
+    first = np.argmax(nonzero, axis=1)
+    last = histogram.shape[1] - 1 - np.argmax(nonzero[:, ::-1], axis=1)
+    low = np.where(anything, start + first * width, np.nan)
+    high = np.where(anything, start + (last + 1) * width, np.nan)
+    return low, high
+
+
+def rebin(histogram, start, width, newstart, newwidth):
+    """
+    Move the counts of a histogram into a coarser grid.  Every old bin lies
+    within one new bin, since the widths are powers of two and all bins are
+    aligned to multiples of their width.
+    """
+    channels, bins = histogram.shape
+    centers = start[:, None] + (np.arange(bins) + 0.5) * width[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = np.floor((centers - newstart[:, None]) / newwidth[:, None])
+    index = np.clip(np.nan_to_num(index), 0, bins - 1).astype(np.int64)
+    index += np.arange(channels)[:, None] * bins
+    return np.bincount(index.ravel(), weights=histogram.ravel(),
+                       minlength=channels * bins).reshape(channels, bins) \
+        .astype(np.int64)
+
+
+def merge_histograms(first, second):
+    """
+    Merge two (histogram, start, width) tuples into a grid covering both.
+    """
+    hist1, start1, width1 = first
+    hist2, start2, width2 = second
+    bins = hist1.shape[1]
+    low1, high1 = occupied(hist1, start1, width1)
+    low2, high2 = occupied(hist2, start2, width2)
+    low, high = np.fmin(low1, low2), np.fmax(high1, high2)
+    empty = np.isnan(low)
+    # the upper edge itself is exclusive
+    start, width = histogram_grid(np.where(empty, 0.0, low),
+                                  np.where(empty, 0.0, high), bins,
+                                  np.fmax(np.where(np.isnan(low1), 0, width1),
+                                          np.where(np.isnan(low2), 0, width2)))
+    start = np.where(empty, 0.0, start)
+    width = np.where(empty, 0.0, width)
+    histogram = rebin(hist1, start1, width1, start, width) + \
+        rebin(hist2, start2, width2, start, width)
+    return histogram, start, width
+
+
+def block_statistics(values, bins):
+    """
+    Statistics of a block of values with shape (samples, channels).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    channels = values.shape[1]
+    nans = np.isnan(values)
+    finite = np.isfinite(values)
+    count = finite.sum(axis=0)
+    empty = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        minimum = np.min(values, axis=0, where=finite, initial=np.inf)
+        maximum = np.max(values, axis=0, where=finite, initial=-np.inf)
+        mean = np.sum(values, axis=0, where=finite) / np.maximum(count, 1)
+        m2 = np.sum((values - mean)**2, axis=0, where=finite)
+    minimum[empty] = maximum[empty] = 0.0
+    start, width = histogram_grid(minimum, maximum, bins)
+    start[empty] = width[empty] = 0.0
+    minimum[empty] = maximum[empty] = mean[empty] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = np.floor((values - start) / np.where(width > 0, width, 1.0))
+    index = np.clip(np.nan_to_num(index), 0, bins - 1).astype(np.int64)
+    index += np.arange(channels) * bins
+    histogram = np.bincount(index[finite], minlength=channels * bins)
+    return ArrayStatistics(
+        count=count.astype(np.int64),
+        nans=nans.sum(axis=0).astype(np.int64),
+        infs=(len(values) - count - nans.sum(axis=0)).astype(np.int64),
+        minimum=minimum, maximum=maximum, mean=mean, m2=m2,
+        histogram=histogram.reshape(channels, bins).astype(np.int64),
+        start=start, width=width)
+
+
+def read_values(dataset, slc, axis, channel_axis, pipeline=None):
+    """
+    Read the index range 'slc' along 'axis' as an array of shape (values,
+    channels).
+    """
+    if pipeline is not None:
+        block = read_block(dataset, slc, pipeline)
+    else:
+        index = [slice(None)] * dataset.ndim
+        index[axis] = slc
+        block = dataset[tuple(index)]
+    if channel_axis is None:
+        return block.reshape(-1, 1)
+    block = np.moveaxis(block, channel_axis, -1)
+    return block.reshape(-1, block.shape[-1])
+
+
+@operation("stats.compute")
+def compute_statistics(dataset, axis=0, channel_axis=None, bins=DEFAULT_BINS,
+                       jobs=1, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                       transform=None):
+    """
+    Compute the statistics of an h5py.Dataset in one pass.
+
+    :param dataset: The dataset to read.
+    :param axis: Axis along which the dataset is read in blocks.
+    :param channel_axis: Axis along which the channels lie, or None for
+    statistics over all values.
+    :param bins: Number of histogram bins per channel.
+    :param jobs: Number of reader threads.  h5py holds its lock while a
+    group is iterated, so with more than one job this must not be called
+    inside a loop over a NIX container (iterate over a list of it instead).
+    :param buffer_bytes: Size of the blocks read at once.
+    :param transform: Function applied to the values of every block before
+    the statistics are taken (e.g. a calibration).
+    :rtype: ArrayStatistics
+    """
+    shape = dataset.shape
+    if channel_axis is not None and channel_axis < 0:
+        channel_axis += len(shape)
+    channels = shape[channel_axis] if channel_axis is not None else 1
+    empty = block_statistics(np.empty((0, channels)), bins)
+    empty.channel_axis = channel_axis
+    if not len(shape) or not dataset.size:
+        if not len(shape):
+            values = np.asarray(dataset[()]).reshape(1, 1)
+            if transform is not None:
+                values = transform(values)
+            return empty.merge(block_statistics(values, bins))
+        return empty
+
+    pipeline = None
+    if axis == 0 and can_decode(dataset):
+        pipeline = filter_pipeline(dataset)
+    length = shape[axis]
+    rest = tuple(n for idx, n in enumerate(shape) if idx != axis)
+    chunks = (dataset.chunks[axis],) if dataset.chunks else None
+    # the float64 copy of a block is what counts
+    rows = block_rows((length,) + rest, np.float64, chunks, buffer_bytes)
+
+    def task(slc):
+        values = read_values(dataset, slc, axis, channel_axis, pipeline)
+        if transform is not None:
+            values = transform(values)
+        return block_statistics(values, bins)
+
+    result = empty
+    if jobs <= 1:
+        for slc in iter_blocks((length,), rows):
+            result = result.merge(task(slc))
+        return result
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for slc in iter_blocks((length,), rows):
+            pending.append(pool.submit(task, slc))
+            if len(pending) >= 2 * jobs:
+                result = result.merge(pending.popleft().result())
+        while pending:
+            result = result.merge(pending.popleft().result())
+    return result
+
+
+def fingerprint(dataset, *extra):
+    """
+    Digest of the shape, data type, chunk index and a few sampled rows of
+    an h5py.Dataset (see module docstring) and of 'extra' values.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((dataset.shape, dataset.dtype.str,
+                        dataset.chunks)).encode())
+    if extra:
+        digest.update(repr(extra).encode())
+
+    def add_chunk(info):
+        digest.update(repr((info.chunk_offset, info.filter_mask,
+                            info.byte_offset, info.size)).encode())
+
+    if dataset.chunks is not None:
+        if hasattr(dataset.id, "chunk_iter"):
+            dataset.id.chunk_iter(add_chunk)
+        else:
+            for idx in range(dataset.id.get_num_chunks()):
+                add_chunk(dataset.id.get_chunk_info(idx))
+    else:
+        digest.update(repr(dataset.id.get_offset()).encode())
+    if dataset.shape and dataset.size:
+        length = dataset.shape[0]
+        positions = np.unique(np.linspace(0, max(length - SAMPLE_ROWS, 0),
+                                          SAMPLE_POSITIONS).astype(int))
+        for pos in positions:
+            digest.update(np.ascontiguousarray(
+                dataset[pos:pos + SAMPLE_ROWS]).tobytes())
+    elif not dataset.shape:
+        digest.update(np.asarray(dataset[()]).tobytes())
+    return digest.hexdigest()
+
+
+def channel_axis_of(data_array):
+    """
+    Axis along which the statistics of a DataArray are split into channels
+    and the axis to read it along: (channel axis or None, read axis).
+    """
+    axis = time_dimension(data_array)
+    if axis is None:
+        return None, 0
+    if len(data_array.shape) == 2:
+        return 1 - axis, axis
+    return None, axis
+
+
+def writable(nixfile):
+    return nixfile._h5file.mode != "r"
+
+
+def entry_name(data_array):
+    # a bare id would be looked up as the id of the section itself
+    return f"DataArray {data_array.id}"
+
+
+def load_statistics(nixfile, data_array):
+    """
+    The statistics of a DataArray stored in its file or None.
+    """
+    if SECTION_NAME not in nixfile.sections:
+        return None
+    section = nixfile.sections[SECTION_NAME]
+    name = entry_name(data_array)
+    if name not in section.sections:
+        return None
+    sub = section.sections[name]
+
+    def values(name, dtype=np.float64):
+        return np.array(sub.props[name].values, dtype=dtype)
+
+    bins = int(sub["Bins"])
+    axis = int(sub["ChannelAxis"])
+    count = values("Count", np.int64)
+    return ArrayStatistics(
+        count=count, nans=values("NaNs", np.int64),
+        infs=values("Infs", np.int64),
+        minimum=values("Minimum"), maximum=values("Maximum"),
+        mean=values("Mean"), m2=values("M2"),
+        histogram=values("Histogram", np.int64).reshape(len(count), bins),
+        start=values("HistogramStart"), width=values("HistogramWidth"),
+        channel_axis=axis if axis >= 0 else None,
+        fingerprint=sub["Fingerprint"])
+
+
+def store_statistics(nixfile, data_array, stats):
+    """
+    Store the statistics of a DataArray in its file, replacing older ones.
+    """
+    if SECTION_NAME in nixfile.sections:
+        section = nixfile.sections[SECTION_NAME]
+    else:
+        section = nixfile.create_section(SECTION_NAME, SECTION_TYPE)
+    name = entry_name(data_array)
+    if name in section.sections:
+        del section.sections[name]
+    sub = section.create_section(name, SECTION_TYPE + ".array")
+    sub["Fingerprint"] = stats.fingerprint
+    sub["Bins"] = stats.bins
+    sub["ChannelAxis"] = -1 if stats.channel_axis is None \
+        else stats.channel_axis
+    for name, values in (("Count", stats.count), ("NaNs", stats.nans),
+                         ("Infs", stats.infs),
+                         ("Minimum", stats.minimum),
+                         ("Maximum", stats.maximum), ("Mean", stats.mean),
+                         ("M2", stats.m2),
+                         ("HistogramStart", stats.start),
+                         ("HistogramWidth", stats.width),
+                         ("Histogram", stats.histogram.ravel())):
+        sub[name] = values.tolist()
+    nixfile.flush()
+
+
+def statistics(data_array, bins=DEFAULT_BINS, jobs=1, refresh=False,
+               buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    The statistics of the (calibrated) values of a DataArray, from the
+    cache in its file if the fingerprint of its data and calibration still
+    matches, otherwise computed and stored.
+
+    :param data_array: A nix.DataArray.
+    :param bins: Number of histogram bins per channel.
+    :param jobs: Number of reader threads.
+    :param refresh: Compute the statistics even if they are cached.
+    :param buffer_bytes: Size of the blocks read at once.
+    :rtype: ArrayStatistics
+    """
+    nixfile = data_array.file
+    dataset = data_array._h5group.group["data"]
+    coefficients = tuple(data_array.polynom_coefficients)
+    origin = data_array.expansion_origin
+    transform = None
+    if len(coefficients) or origin:
+        transform = functools.partial(calibrate, data_array=data_array)
+        key = fingerprint(dataset, coefficients, origin)
+    else:
+        key = fingerprint(dataset)
+    memkey = (nixfile._h5file.filename, data_array.id)
+    if not refresh:
+        stats = _memory.get(memkey)
+        if stats is None:
+            stats = load_statistics(nixfile, data_array)
+        if stats is not None and stats.fingerprint == key and \
+           stats.bins == bins:
+            return stats
+
+    channel_axis, axis = channel_axis_of(data_array)
+    stats = compute_statistics(dataset, axis, channel_axis, bins, jobs,
+                               buffer_bytes, transform)
+    stats.fingerprint = key
+    if writable(nixfile):
+        store_statistics(nixfile, data_array, stats)
+        _memory.pop(memkey, None)
+    else:
+        _memory[memkey] = stats
+    return stats
+
+
+def print_statistics(name, stats, file=None):
+    file = file or sys.stdout
+    print(f"{name}:", file=file)
+    print(f"  {'channel':>7} {'count':>12} {'NaNs':>8} {'min':>12} "
+          f"{'max':>12} {'mean':>12} {'std':>12}", file=file)
+    std = stats.std
+    for idx in range(stats.channels):
+        print(f"  {idx:>7} {stats.count[idx]:>12} {stats.nans[idx]:>8} "
+              f"{stats.minimum[idx]:>12.6g} {stats.maximum[idx]:>12.6g} "
+              f"{stats.mean[idx]:>12.6g} {std[idx]:>12.6g}", file=file)
+
+
+def run(args):
+    """print (and cache) the statistics of the arrays of a NIX file"""
+    nixfile = nix.File.open(args.FILE, nix.FileMode.ReadWrite)
+    try:
+        found = set()
+        for block in nixfile.blocks:
+            # h5py holds its lock while iterating a group, which would block
+            # the reader threads
+            for da in list(block.data_arrays):
+                if args.array and da.name not in args.array:
+                    continue
+                if not np.issubdtype(da.dtype, np.number):
+                    continue
+                found.add(da.name)
+                stats = statistics(da, args.bins, args.jobs, args.refresh)
+                print_statistics(f"{block.name}/{da.name}", stats)
+        missing = set(args.array or ()) - found
+        if missing:
+            sys.exit("No numeric DataArray named "
+                     f"{', '.join(sorted(missing))}")
+    finally:
+        nixfile.close()
@@ -2,17 +2,34 @@ import pandas as pd
 import nixio as nix
 import numpy as np
 
+from ..instrument import operation
+from ..memmap import array_view
 
+
+@operation("table.export")
 def write_to_pandas(dataframe):
     if not isinstance(dataframe, nix.DataFrame):
         raise TypeError("The given object is not a DataFrame")
-    tmp_list = []
-    tmp_list.extend(dataframe._h5group.group['data'][:])
-    li = [list(ite) for ite in tmp_list]  # make all element list
-    pd_df = pd.DataFrame(li, columns=[str(n) for n in dataframe.column_names])
+    rows = array_view(dataframe._h5group.group['data'])[:]
+    return frame_from_rows(rows, dataframe.column_names)
+
+
+def frame_from_rows(rows, column_names):
+    """
+    Pandas DataFrame of rows of the compound dataset of a NIX DataFrame.
+    The columns keep the data types of the fields (also for no rows).
+
+    :param rows: Rows of the dataset
+    :type rows: numpy.ndarray
+    :param column_names: The column names of the NIX DataFrame
+    :type column_names: tuple
+    """
+    pd_df = pd.DataFrame(np.asarray(rows))
+    pd_df.columns = [str(n) for n in column_names]
     return pd_df
 
 
+@operation("table.import")
 def create_from_pandas(blk, pd_df, name, definition=None):
     """
     This function create Nixpy DataFrame from Pandas DataFrame.
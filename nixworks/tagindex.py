@@ -0,0 +1,211 @@
+"""
+tagindex.py
+
+Usage:
+    from nixworks.tagindex import tag_index
+
+    index = tag_index(block, dimension=0, unit="s")
+    tags, entries, starts, ends = index.overlapping(10.0, 12.0, data_array)
+
+An in-memory interval index over the positions and extents of all Tags and
+MultiTags of a block along one dimension of the data they tag.  It answers
+"which Tags or MultiTag entries overlap the window [low, high]?" without
+reading the tags again; the plotters use it to draw only the events in
+view (see plotter.TagOverlay).
+
+Every Tag and every MultiTag entry with a position along the dimension is
+one interval [position, position + extent] (a point if there is no
+extent).  The intervals are sorted by their start and covered by an
+implicit tree of the largest end of every FANOUT consecutive intervals,
+every FANOUT nodes of that, and so on.  The intervals overlapping a window
+are those starting before its end (a prefix of the sorted intervals, found
+by binary search) whose end is not before its start: the tree is descended
+level by level from the nodes of that prefix whose largest end reaches the
+window, with vectorised NumPy operations on all nodes of a level at once.
+The index holds 28 bytes per interval, so tens of millions of events fit
+in memory.
+
+Positions are converted to 'unit' where the tags have scalable units.
+Indexes are cached per file, block, dimension and unit while the Tags and
+MultiTags (their ids, modification times and numbers of positions) stay the
+same; pass 'refresh' after changing positions in place.
+"""
+import numpy as np
+import nixio as nix
+
+from .instrument import operation
+
+FANOUT = 64
+
+# (file, block, dimension, unit) -> (fingerprint, TagIndex)
+_indexes = dict()
+
+
+class TagIndex:
+    """
+    Intervals of the Tags and MultiTags of a block, sorted by their start.
+    'tags' holds the number of the tag of every interval (in 'ids' and
+    'names'), 'entries' the number of the MultiTag entry (0 for Tags).
+    """
+
+    def __init__(self, starts, ends, tags, entries, ids=(), names=(),
+                 references=()):
+        order = np.argsort(starts, kind="stable")
+        self.starts = np.asarray(starts, dtype=np.float64)[order]
+        self.ends = np.asarray(ends, dtype=np.float64)[order]
+        self.tags = np.asarray(tags, dtype=np.int32)[order]
+        self.entries = np.asarray(entries, dtype=np.int64)[order]
+        self.ids = list(ids)
+        self.names = list(names)
+        # ids of the DataArrays referenced by every tag
+        self.references = [frozenset(refs) for refs in references]
+        self.levels = [self.ends]
+        while len(self.levels[-1]) > FANOUT:
+            level = self.levels[-1]
+            self.levels.append(np.maximum.reduceat(
+                level, np.arange(0, len(level), FANOUT)))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def search(self, low, high):
+        """
+        Indices of the (sorted) intervals overlapping [low, high], in the
+        order of their starts.
+        """
+        count = np.searchsorted(self.starts, high, side="right")
+        top = len(self.levels) - 1
+        nodes = np.arange(len(self.levels[top]))
+        for depth in range(top, 0, -1):
+            nodes = nodes[nodes * FANOUT ** depth < count]
+            nodes = nodes[self.levels[depth][nodes] >= low]
+            children = (nodes[:, None] * FANOUT + np.arange(FANOUT)).ravel()
+            nodes = children[children < len(self.levels[depth - 1])]
+        nodes = nodes[nodes < count]
+        return nodes[self.ends[nodes] >= low]
+
+    def selected(self, data_array=None, tags=None):
+        """
+        Which tags reference 'data_array' and are among 'tags' (ids or
+        names); None if all are.
+        """
+        if data_array is None and tags is None:
+            return None
+        selected = np.ones(len(self.ids), dtype=bool)
+        if data_array is not None:
+            selected &= [data_array.id in refs for refs in self.references]
+        if tags is not None:
+            tags = set(tags)
+            selected &= [tagid in tags or name in tags
+                         for tagid, name in zip(self.ids, self.names)]
+        return selected
+
+    def overlapping(self, low, high, data_array=None, tags=None):
+        """
+        The intervals overlapping [low, high], optionally only those of tags
+        referencing 'data_array' or among 'tags' (ids or names).
+
+        :returns: Arrays of the tag numbers, entries, starts and ends.
+        """
+        hits = self.search(low, high)
+        selected = self.selected(data_array, tags)
+        if selected is not None:
+            hits = hits[selected[self.tags[hits]]]
+        return (self.tags[hits], self.entries[hits], self.starts[hits],
+                self.ends[hits])
+
+
+def unit_factor(tag, dimension, unit):
+    """Factor converting the positions of a tag to 'unit'."""
+    units = tag.units
+    if not unit or not units or len(units) <= dimension:
+        return 1.0
+    tagunit = units[dimension]
+    if not tagunit or tagunit == unit or \
+            not nix.util.units.scalable(tagunit, unit):
+        return 1.0
+    return nix.util.units.scaling(tagunit, unit)
+
+
+def column(data_array, dimension):
+    """Values of the entries of a positions or extents DataArray."""
+    if data_array is None:
+        return None
+    if len(data_array.shape) == 1:
+        return data_array[:] if dimension == 0 else None
+    if data_array.shape[1] <= dimension:
+        return None
+    return data_array[:, dimension]
+
+
+def fingerprint(block):
+    """Identifies the state of the Tags and MultiTags of a block."""
+    state = [(tag.id, tag.updated_at) for tag in block.tags]
+    for mtag in block.multi_tags:
+        extents = mtag.extents
+        state.append((mtag.id, mtag.updated_at, mtag.positions.shape,
+                      extents.shape if extents is not None else None))
+    return tuple(state)
+
+
+@operation("tagindex.build")
+def build_index(block, dimension=0, unit=None):
+    """
+    Read the positions and extents of the Tags and MultiTags of a block
+    along 'dimension' into a TagIndex.
+    """
+    starts, ends, tags, entries = [], [], [], []
+    ids, names, references = [], [], []
+
+    def add(tag, start, extent):
+        factor = unit_factor(tag, dimension, unit)
+        start = np.asarray(start, dtype=np.float64) * factor
+        end = start if extent is None else \
+            start + np.asarray(extent, dtype=np.float64) * factor
+        starts.append(np.minimum(start, end))
+        ends.append(np.maximum(start, end))
+        tags.append(np.full(len(start), len(ids), dtype=np.int32))
+        entries.append(np.arange(len(start)))
+        ids.append(tag.id)
+        names.append(tag.name)
+        references.append([da.id for da in tag.references])
+
+    for tag in block.tags:
+        position, extent = tag.position, tag.extent
+        if len(position) <= dimension:
+            continue
+        add(tag, [position[dimension]],
+            [extent[dimension]] if extent and len(extent) > dimension
+            else None)
+    for mtag in block.multi_tags:
+        positions = column(mtag.positions, dimension)
+        if positions is None:
+            continue
+        add(mtag, positions, column(mtag.extents, dimension))
+
+    if not ids:
+        return TagIndex(np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+    return TagIndex(np.concatenate(starts), np.concatenate(ends),
+                    np.concatenate(tags), np.concatenate(entries),
+                    ids, names, references)
+
+
+def tag_index(block, dimension=0, unit=None, refresh=False):
+    """
+    The TagIndex of a block, from the cache if its tags did not change.
+
+    :param block: A nix.Block.
+    :param dimension: The dimension of the tagged data the intervals are
+    taken along.
+    :param unit: Unit the positions are converted to (where scalable).
+    :param refresh: Build the index even if it is cached.
+    :rtype: TagIndex
+    """
+    key = (block.file._h5file.filename, block.id, dimension, unit)
+    state = fingerprint(block)
+    cached = _indexes.get(key)
+    if not refresh and cached is not None and cached[0] == state:
+        return cached[1]
+    index = build_index(block, dimension, unit)
+    _indexes[key] = (state, index)
+    return index
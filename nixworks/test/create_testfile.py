@@ -1,25 +1,115 @@
+"""
+create_testfile.py
+
+Usage:
+  python create_testfile.py [--size=<size>] [--channels=<n>] [--seed=<n>]
+      [--image=<file>] [--no-compression] [--deflate=<level>] [--shuffle]
+      [--chunking=<channel|time|auto>] [<filename>]
+
+Arguments:
+  filename   NIX file to create (default: test.nix).
+
+Flags:
+  --size=<size>     Total size of the two long sampled arrays ('long 1d data'
+                    and '2d sampled-set'), e.g. 500MB or 20GB (binary
+                    units).  Without it the small fixed test file is created.
+
+  --channels=<n>    Number of channels of the 2d arrays (default: 5).
+
+  --seed=<n>        Seed of the random numbers (default: 42).
+
+  --image=<file>    Image stored in the 'lena' array (default: lena.bmp).
+                    If the file does not exist, a synthetic RGB image is
+                    stored instead.
+
+  --no-compression, --deflate=<level>, --shuffle, --chunking=<...>
+                    Storage layout of the long sampled arrays (see
+                    nixworks/converters/layout.py).  Without any of these
+                    flags, NIX defaults are used.
+
+Synthetic NIX data covering every kind of DataArray the plotters handle.
+Each 'create_*()' function adds one DataArray to a Block; sizes and channel
+counts are parameters, defaulting to the small fixed test file.  The long
+sampled arrays are generated and written block by block, so files of tens
+of GB can be created with bounded memory.  The benchmark suite
+(benchmarks/suite.py) uses these functions to build its datasets.
+"""
+import re
+import sys
+from pathlib import Path
+
 import nixio as nix
 import numpy as np
 from scipy.stats import multivariate_normal
-from PIL import Image as img
+
+from nixworks.converters.layout import Layout
+from nixworks.converters.streaming import (DEFAULT_BUFFER_BYTES, block_rows,
+                                           iter_blocks)
+
+
+UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
 
 
-def create_1d_sampled(block):
+def parse_size(size):
+    """
+    Number of bytes of a size like '512', '500MB', '1.5G' or '20GiB'
+    (binary units).
+    """
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)(i?B)?\s*", str(size),
+                         re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size '{size}'")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def create_sampled_array(block, name, array_type, shape, layout=None):
+    """
+    Create a DataArray of doubles with the given shape (time on the first
+    axis) without writing any data, stored according to 'layout' (NIX
+    defaults if None).
+    """
+    if layout is None:
+        return block.create_data_array(name, array_type,
+                                       dtype=nix.DataType.Double,
+                                       shape=shape)
+    return layout.create_data_array(block, name, array_type, shape=shape,
+                                    dtype=np.float64, time_axis=0)
+
+
+def write_blocks(da, generate, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """
+    Fill the DataArray 'da' block by block along its first axis with the
+    values 'generate(start, stop)' returns for the rows [start, stop).
+    """
+    dataset = da._h5group.group["data"]
+    rows = block_rows(dataset.shape, dataset.dtype, dataset.chunks,
+                      buffer_bytes)
+    for slc in iter_blocks(dataset.shape, rows):
+        dataset[slc] = generate(slc.start, slc.stop)
+
+
+def create_1d_sampled(block, samples=500000, layout=None, seed=None):
     dt = 0.001
-    time = np.arange(500000) * dt
-    data = np.random.randn(len(time)) * 0.1 + np.sin(2*np.pi*time) * \
-        (np.sin(2 * np.pi * time * 0.0125) * 0.2)
-    da2 = block.create_data_array("long 1d data", "test",
-                                  dtype=nix.DataType.Double, data=data)
+    rng = np.random.default_rng(seed)
+
+    def generate(start, stop):
+        time = np.arange(start, stop) * dt
+        return rng.standard_normal(len(time)) * 0.1 + \
+            np.sin(2*np.pi*time) * (np.sin(2 * np.pi * time * 0.0125) * 0.2)
+
+    da2 = create_sampled_array(block, "long 1d data", "test", (samples,),
+                               layout)
+    write_blocks(da2, generate)
     da2.label = "intensity"
     da2.unit = "V"
     sd = da2.append_sampled_dimension(dt)
     sd.label = "time"
     sd.unit = "s"
+    return da2
 
 
-def create_1d_range(block):
-    times = np.linspace(0.0, 10., 25)
+def create_1d_range(block, samples=25):
+    times = np.linspace(0.0, 10., samples)
     values = np.sin(np.pi * 2 * times/2)
     range_da = block.create_data_array("1-d range data", "test",
                                        dtype=nix.DataType.Double, data=values)
@@ -28,17 +118,20 @@ def create_1d_range(block):
     rd = range_da.append_range_dimension(times)
     rd.label = "time"
     rd.unit = "s"
+    return range_da
 
 
-def create_1d_event(block):
-    times = np.linspace(0.0, 10., 25)
-    times = times + np.random.randn(len(times)) * 0.05
+def create_1d_event(block, events=25, seed=None):
+    rng = np.random.default_rng(seed)
+    times = np.linspace(0.0, 10., events)
+    times = times + rng.standard_normal(len(times)) * 0.05
     alias_range_da = block.create_data_array("1d event data", "test",
                                              dtype=nix.DataType.Double,
                                              data=times)
-    alias_range_da.append_alias_range_dimension()
+    alias_range_da.append_range_dimension_using_self()
     alias_range_da.label = "time"
     alias_range_da.unit = "ms"
+    return alias_range_da
 
 
 def create_1d_category(block):
@@ -53,11 +146,12 @@ def create_1d_category(block):
     set_data.unit = "K"
     sd = set_data.append_set_dimension()
     sd.labels = labels
+    return set_data
 
 
-def create_2d_category(block):
+def create_2d_category(block, places=3):
     months = np.arange(0., 12., 1.)
-    places = ["A", "B", "C"]
+    places = [chr(ord("A") + i % 26) * (i // 26 + 1) for i in range(places)]
     temperatures = np.sin(np.pi * 2 * months/12 + 7) * 25.
     values = np.zeros((len(months), len(places)))
     for i in range(len(places)):
@@ -66,31 +160,39 @@ def create_2d_category(block):
                                       dtype=nix.DataType.Double,
                                       data=values)
     sd = sets_da.append_set_dimension()
-    sd.labels = months
+    sd.labels = [str(m) for m in months]
     sd = sets_da.append_set_dimension()
     sd.labels = places
+    return sets_da
 
 
-def create_2d_sampled_set(block):
+def create_2d_sampled_set(block, samples=10000, channels=5, layout=None,
+                          seed=None):
     dt = 0.001
-    data = np.zeros((10000, 5))
-    time = np.arange(10000) * dt
-    for i in range(5):
-        data[:, i] = np.sin(2*np.pi*time+np.random.randn(1)*np.pi)
-    da = block.create_data_array("2d sampled-set", "test", data=data,
-                                 dtype=nix.DataType.Double)
+    rng = np.random.default_rng(seed)
+    phases = rng.standard_normal(channels) * np.pi
+
+    def generate(start, stop):
+        time = np.arange(start, stop) * dt
+        return np.sin(2*np.pi*time[:, None] + phases)
+
+    da = create_sampled_array(block, "2d sampled-set", "test",
+                              (samples, channels), layout)
+    write_blocks(da, generate)
     da.label = "voltage"
     da.unit = "mV"
     da.append_sampled_dimension(dt)
     da.append_set_dimension()
     da.dimensions[0].unit = "s"
     da.dimensions[0].label = "time"
+    return da
 
 
-def create_2d_range_set(block):
-    times = np.linspace(0.0, 10., 25)
-    values = np.random.randn(len(times), 5)
-    for i in range(5):
+def create_2d_range_set(block, samples=25, channels=5, seed=None):
+    rng = np.random.default_rng(seed)
+    times = np.linspace(0.0, 10., samples)
+    values = rng.standard_normal((len(times), channels))
+    for i in range(channels):
         values[:, i] += np.linspace(0.0, 3.0 * i, len(times))
     range_recordings = block.create_data_array("2d range data", "test",
                                                dtype=nix.DataType.Double,
@@ -98,14 +200,15 @@ def create_2d_range_set(block):
     rd = range_recordings.append_range_dimension(times)
     rd.unit = "s"
     rd.label = "time"
-    labels = ["V-1", "V-2", "V-3", "V-4", "V-5"]
+    labels = [f"V-{i + 1}" for i in range(channels)]
     sd = range_recordings.append_set_dimension()
     sd.labels = labels
+    return range_recordings
 
 
-def create_2d_sampled_sampled(block):
-    delta = 0.025
-    x = y = np.arange(-3.0, 3.0, delta)
+def create_2d_sampled_sampled(block, size=240):
+    delta = 6.0 / size
+    x = y = np.arange(size) * delta - 3.0
     X, Y = np.meshgrid(x, y)
     pos = np.dstack((X, Y))
     rv1 = multivariate_normal([0.5, -0.2], [[2.0, 0.3], [0.3, 0.5]])
@@ -122,12 +225,30 @@ def create_2d_sampled_sampled(block):
     d2 = da.append_sampled_dimension(delta)
     d2.label = "y"
     d2.offset = -3.
+    return da
+
+
+def synthetic_image(height=512, width=512):
+    """
+    RGB test image (colour gradients with a few rings) used when no image
+    file is available.
+    """
+    y, x = np.mgrid[0:height, 0:width]
+    rings = (np.sin(np.hypot(x - width / 2, y - height / 2) / 8) + 1) / 2
+    image = np.stack([x / width, y / height, rings], axis=-1)
+    return (image * 255).astype(np.uint8)
+
 
+def create_3d_image(block, filename="lena.bmp"):
+    if filename is not None and Path(filename).exists():
+        from PIL import Image as img
 
-def create_3d_image(block):
-    image = img.open('lena.bmp')
-    img_data = np.array(image)
-    channels = list(image.mode)
+        image = img.open(filename)
+        img_data = np.array(image)
+        channels = list(image.mode)
+    else:
+        img_data = synthetic_image()
+        channels = ["R", "G", "B"]
     image_da = block.create_data_array("lena", "nix.image.rgb", data=img_data)
     height_dim = image_da.append_sampled_dimension(1)
     height_dim.label = "height"
@@ -135,21 +256,65 @@ def create_3d_image(block):
     width_dim.label = "width"
     color_dim = image_da.append_set_dimension()
     color_dim.labels = channels
+    return image_da
 
 
-def create_test_data():
-    f = nix.File.open("test.nix", nix.FileMode.Overwrite)
+def create_test_data(filename="test.nix", size=None, channels=5, layout=None,
+                     image="lena.bmp", seed=42):
+    """
+    Create a NIX file with one DataArray of every kind.
+
+    :param filename: Path of the file to create.
+    :param size: Total size in bytes (or a size string, see 'parse_size()')
+    of the long sampled arrays; they share it in proportion to their channel
+    counts.  None creates the small fixed test file.
+    :param channels: Number of channels of the 2d arrays.
+    :param layout: Storage Layout of the long sampled arrays (NIX defaults
+    if None).
+    :param image: Image file for the 3d array; a synthetic image is used if
+    it is None or does not exist.
+    :param seed: Seed of the random numbers.
+    :rtype: None
+    """
+    if size is None:
+        samples_1d, samples_2d = 500000, 10000
+    else:
+        samples_1d = samples_2d = max(parse_size(size) //
+                                      (8 * (channels + 1)), 1)
+    f = nix.File.open(str(filename), nix.FileMode.Overwrite)
     b = f.create_block("test", "test")
-    create_1d_sampled(b)
+    create_1d_sampled(b, samples_1d, layout, seed)
     create_1d_range(b)
-    create_1d_event(b)
+    create_1d_event(b, seed=seed)
     create_1d_category(b)
-    create_2d_range_set(b)
+    create_2d_category(b)
+    create_2d_range_set(b, channels=channels, seed=seed)
     create_2d_sampled_sampled(b)
-    create_2d_sampled_set(b)
-    create_3d_image(b)
+    create_2d_sampled_set(b, samples_2d, channels, layout, seed)
+    create_3d_image(b, image)
     f.close()
 
 
+def main(args=None):
+    if args is None:
+        args = sys.argv
+    args = list(args)
+    opts = {"size": None, "channels": 5, "seed": 42, "image": "lena.bmp"}
+    layout = None
+    if any(arg == "--no-compression" or arg == "--shuffle" or
+           arg.startswith(("--deflate=", "--chunking=")) for arg in args):
+        layout = Layout.from_args(args)
+    for arg in list(args[1:]):
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        if key in opts:
+            opts[key] = value if key in ("size", "image") else int(value)
+            args.remove(arg)
+    filename = args[1] if len(args) > 1 else "test.nix"
+    create_test_data(filename, opts["size"], opts["channels"], layout,
+                     opts["image"], opts["seed"])
+
+
 if __name__ == "__main__":
-    create_test_data()
+    main()
@@ -0,0 +1,150 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import nixio as nix
+import pynwb as nwb
+import mne
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from nixworks.converters import checkpoint
+from nixworks.converters.checkpoint import Checkpoint, partial_path
+from nixworks.converters.layout import Layout
+from nixworks.converters.mne import mne2nix
+from nixworks.converters.nwb import nwb2nix
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(commits):
+    """
+    Patch Checkpoint.commit to record every block and to raise Interrupted
+    after 'commits' blocks were recorded.  The list of recorded chunk counts
+    is returned with the patch.
+    """
+    recorded = []
+    commit = Checkpoint.commit
+
+    def interrupting_commit(self, name, chunks, force=False):
+        if commits is not None and len(recorded) == commits:
+            raise Interrupted()
+        recorded.append(chunks)
+        self.interval = 0
+        commit(self, name, chunks, force)
+
+    return mock.patch.object(Checkpoint, "commit", interrupting_commit), \
+        recorded
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_nwb(self):
+        nwbpath = self.tmpdir / "test.nwb"
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        nwbfile = nwb.NWBFile(session_description="test", identifier="test",
+                              session_start_time=start)
+        data = (np.random.randn(40000, 4) * 100).astype(np.int16)
+        nwbfile.add_acquisition(nwb.TimeSeries(
+            name="multichannel", unit="V", rate=1000.,
+            data=H5DataIO(data, compression="gzip", chunks=(1000, 4))))
+        with nwb.NWBHDF5IO(str(nwbpath), "w") as io:
+            io.write(nwbfile)
+        return nwbpath, data
+
+    def convert_nwb(self, nwbpath, nixpath, layout, interrupt=None):
+        patch, recorded = interrupt_after(interrupt)
+        # small blocks, so that the copy takes several of them
+        buffer_bytes = 2 * 4 * 4000
+        with patch, redirect_stdout(None), redirect_stderr(None), \
+                mock.patch.object(checkpoint, "DEFAULT_BUFFER_BYTES",
+                                  buffer_bytes):
+            nwb2nix.convert_file(nwbpath, nixpath, layout)
+        return recorded
+
+    def test_nwb2nix_resume(self):
+        nwbpath, data = self.write_nwb()
+        for layout in (Layout(access="source"),
+                       Layout(compression=False, chunk_bytes=8 * 1000)):
+            nixpath = self.tmpdir / "test.nix"
+            with self.assertRaises(Interrupted):
+                self.convert_nwb(nwbpath, nixpath, layout, interrupt=3)
+            assert not nixpath.exists()
+            partial = nix.File(str(partial_path(nixpath)),
+                               nix.FileMode.ReadOnly)
+            section = partial.sections[checkpoint.SECTION_NAME]
+            chunks = section.sections["multichannel"]["Chunks"]
+            assert 0 < chunks < 40
+            partial.close()
+
+            recorded = self.convert_nwb(nwbpath, nixpath, layout)
+            assert recorded[0] > chunks
+            assert recorded[-1] == 40
+            assert not partial_path(nixpath).exists()
+            nf = nix.File(str(nixpath), nix.FileMode.ReadOnly)
+            np.testing.assert_array_equal(
+                nf.blocks[0].data_arrays["multichannel"][:], data)
+            assert checkpoint.SECTION_NAME not in nf.sections
+            nf.close()
+            nixpath.unlink()
+
+    def test_fingerprint_mismatch(self):
+        nwbpath, data = self.write_nwb()
+        nixpath = self.tmpdir / "test.nix"
+        with self.assertRaises(Interrupted):
+            self.convert_nwb(nwbpath, nixpath, Layout(access="source"),
+                             interrupt=3)
+        # another layout doesn't match the partial file: start over
+        recorded = self.convert_nwb(nwbpath, nixpath,
+                                    Layout(compression=False))
+        assert recorded[0] < 10
+        nf = nix.File(str(nixpath), nix.FileMode.ReadOnly)
+        np.testing.assert_array_equal(
+            nf.blocks[0].data_arrays["multichannel"][:], data)
+        nf.close()
+
+    def test_mne2nix_resume(self):
+        info = mne.create_info(["a", "b", "c"], 100., "eeg")
+        data = np.random.randn(3, 50000) * 1e-6
+        raw = mne.io.RawArray(data, info, verbose=False)
+        # resuming requires a source file to compare with
+        sourcefile = self.tmpdir / "raw.npy"
+        np.save(sourcefile, data)
+        source = mock.patch.object(mne.io.RawArray, "filenames",
+                                   (sourcefile,))
+        buffer_bytes = mock.patch.object(checkpoint, "DEFAULT_BUFFER_BYTES",
+                                         8 * 3 * 5000)
+        nfname = self.tmpdir / "raw.nix"
+        layout = Layout(chunk_bytes=8 * 3 * 1000)
+        for split in (False, True):
+            patch, recorded = interrupt_after(2)
+            with self.assertRaises(Interrupted), patch, source, \
+                    buffer_bytes, redirect_stdout(None):
+                mne2nix.write_raw_mne(str(nfname), raw, split, False, layout)
+            assert not nfname.exists()
+
+            patch, recorded = interrupt_after(None)
+            with patch, source, buffer_bytes, redirect_stdout(None):
+                mne2nix.write_raw_mne(str(nfname), raw, split, False, layout)
+            # continued with the first array, after the recorded blocks
+            assert recorded[0] > 1
+            nf = nix.File(str(nfname), nix.FileMode.ReadOnly)
+            arrays = nf.blocks[0].data_arrays
+            if split:
+                stored = np.array([arrays[name][:] for name in raw.ch_names])
+            else:
+                stored = arrays["EEG Data"][:]
+            np.testing.assert_array_equal(stored, data)
+            nf.close()
+            nfname.unlink()
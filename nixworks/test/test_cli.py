@@ -0,0 +1,57 @@
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+from nixworks import cli
+
+
+HEAVY_MODULES = ("pynwb", "mne", "matplotlib", "IPython", "ipywidgets")
+
+
+class TestCLI(unittest.TestCase):
+
+    def imported_heavy_modules(self, code):
+        check = (f"{code}\n"
+                 "import sys\n"
+                 f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])")
+        proc = subprocess.run([sys.executable, "-c", check], check=True,
+                              capture_output=True, text=True)
+        return proc.stdout.splitlines()[-1]
+
+    def test_lazy_imports(self):
+        assert self.imported_heavy_modules("import nixworks") == "[]"
+        code = "from nixworks.converters.mne import read_epochs"
+        assert "'mne'" in self.imported_heavy_modules(code)
+        code = "import nixworks.converters.mne"
+        assert self.imported_heavy_modules(code) == "[]"
+        code = ("from nixworks import cli\n"
+                "cli.main(['nwb2nix', '--version'])\n"
+                "cli.main(['--version'])")
+        assert self.imported_heavy_modules(code) == "[]"
+
+    def test_lazy_names(self):
+        # the names are bound to the modules, not to the subpackages
+        import nixworks
+        import nixworks.plotter.interactor
+        import nixworks.table.table
+        from nixworks.plotter import interactor, plotter
+        from nixworks.table import table
+        assert nixworks.plotter is plotter
+        assert nixworks.table is table
+        assert nixworks.interactor is interactor
+
+    def test_version(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            cli.main(["nix2nwb", "--version"])
+        lines = out.getvalue().splitlines()
+        assert lines[0] == f"nixworks: {cli.package_version()}"
+        assert lines[1].startswith("nixio: ")
+        assert lines[2].startswith("pynwb: ")
+
+    def test_missing_file(self):
+        with self.assertRaises(SystemExit):
+            with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
+                cli.main(["nwb2nix"])
@@ -0,0 +1,64 @@
+import pickle
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+import pandas as pd
+from nixworks.dask_io import dask_array, dask_dataframe
+from nixworks.table.table import create_from_pandas, write_to_pandas
+
+
+class TestDask(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        self.values = np.random.randn(20000, 4)
+        nixfile = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = nixfile.create_block("test", "test")
+        block.create_data_array("signal", "test", data=self.values)
+        calibrated = block.create_data_array(
+            "calibrated", "test", data=np.arange(10, dtype="int16"))
+        calibrated.polynom_coefficients = [1.0, 2.0]
+        self.frame = pd.DataFrame({"channel": np.arange(5000) % 3,
+                                   "value": np.random.rand(5000)})
+        create_from_pandas(block, self.frame, "events")
+        nixfile.close()
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        self.block = self.file.blocks[0]
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_array(self):
+        da = self.block.data_arrays["signal"]
+        array = dask_array(da)
+        assert array.chunksize == da._h5group.group["data"].chunks
+        np.testing.assert_allclose(array.mean(axis=0).compute(),
+                                   self.values.mean(axis=0))
+        # the graph holds no open files
+        array = pickle.loads(pickle.dumps(array[100:5000:7, 1:3]))
+        np.testing.assert_array_equal(
+            array.compute(scheduler="processes", num_workers=2),
+            self.values[100:5000:7, 1:3])
+        calibrated = dask_array(self.block.data_arrays["calibrated"])
+        np.testing.assert_array_equal(calibrated.compute(),
+                                      np.arange(10) * 2.0 + 1.0)
+
+    def test_dataframe(self):
+        dataframe = self.block.data_frames["events"]
+        frame = dask_dataframe(dataframe, rows=1500)
+        assert frame.npartitions == 4
+        assert frame.divisions == (0, 1500, 3000, 4500, 4999)
+        pd.testing.assert_frame_equal(frame.compute(),
+                                      write_to_pandas(dataframe))
+        means = frame.groupby("channel")["value"].mean().compute()
+        np.testing.assert_allclose(
+            means.sort_index(),
+            self.frame.groupby("channel")["value"].mean())
+        assert len(frame.loc[1499:1500].compute()) == 2
+        assert dask_dataframe(dataframe).npartitions == 1
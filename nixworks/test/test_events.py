@@ -0,0 +1,165 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+from nixworks import cli
+from nixworks.converters.layout import Layout
+from nixworks.events import detect_events
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        rng = np.random.default_rng(7)
+        self.values = rng.standard_normal((20000, 3)) * 0.1
+        # negative spikes every 97 samples on the second channel
+        self.spikes = np.arange(50, 19950, 97)
+        for start in self.spikes:
+            self.values[start:start + 5, 1] += [-1, -3, -5, -2, -1]
+        self.file = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = self.file.create_block("test", "test")
+        self.source = block.create_data_array("lfp", "nix.sampled",
+                                              data=self.values)
+        self.source.unit = "mV"
+        dim = self.source.append_sampled_dimension(0.001, label="time",
+                                                   unit="s")
+        dim.offset = 1.0
+        self.source.append_set_dimension(labels=["a", "b", "c"])
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, values, threshold):
+        """Crossings and peaks of the whole signal at once."""
+        above = np.concatenate(([False], values <= threshold, [False]))
+        edges = np.diff(above.astype(int))
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+        peaks = np.array([start + np.argmin(values[start:stop])
+                          for start, stop in zip(starts, stops)])
+        return starts, stops, peaks
+
+    def test_boundaries(self):
+        # blocks of 41 rows split many spikes
+        for jobs in (1, 2):
+            for peak in (False, True):
+                outputs = detect_events(self.source, f"spikes {jobs} {peak}",
+                                        -0.8, peak=peak, jobs=jobs,
+                                        buffer_bytes=24 * 41)
+                assert [da.name for da in outputs] == \
+                    [f"spikes {jobs} {peak} {label}" for label in "abc"]
+                assert outputs[0].shape == outputs[2].shape == (0,)
+                starts, _, peaks = self.expected(self.values[:, 1], -0.8)
+                index = peaks if peak else starts
+                np.testing.assert_allclose(outputs[1][:],
+                                           1.0 + index * 0.001)
+        assert len(peaks) == len(self.spikes)
+        np.testing.assert_array_equal(peaks, self.spikes + 2)
+        dim = outputs[1].dimensions[0]
+        assert dim.dimension_type == nix.DimensionType.Range
+        assert dim.is_alias
+        assert outputs[1].unit == "s"
+        section = outputs[1].metadata
+        assert section["Source"] == self.source.id
+
+    def test_open_end(self):
+        values = np.zeros(1000)
+        values[100:300] = 1.0
+        values[120] = 2.0
+        values[900:] = 1.5
+        block = self.file.blocks[0]
+        source = block.create_data_array("steps", "nix.sampled", data=values)
+        source.append_sampled_dimension(0.5, label="time", unit="ms")
+        for buffer_bytes in (8 * 30, 8 * 1000):
+            events = detect_events(source, f"steps {buffer_bytes}", 0.5,
+                                   peak=True, buffer_bytes=buffer_bytes)
+            np.testing.assert_allclose(events[0][:], [60.0, 450.0])
+        mtag = detect_events(source, "steps tag", 0.5, multitag=True,
+                             buffer_bytes=8 * 30)
+        np.testing.assert_allclose(mtag.positions[:], [50.0, 450.0])
+        np.testing.assert_allclose(mtag.extents[:], [100.0, 50.0])
+
+    def test_block_end(self):
+        # excursions ending exactly at the end of a block of 10 samples
+        values = np.zeros(40)
+        values[5:10] = [1, 3, 2, 1, 1]
+        values[12:14] = [2, 1]
+        values[25:30] = [1, 1, 1, 1, 2]
+        layout = Layout(access="time", chunk_bytes=8 * 10)
+        source = layout.create_data_array(self.file.blocks[0], "ends",
+                                          "nix.sampled", data=values)
+        source.append_sampled_dimension(1.0, unit="s")
+        assert source._h5group.group["data"].chunks == (10,)
+        for peak, expected in ((True, [6.0, 12.0, 29.0]),
+                               (False, [5.0, 12.0, 25.0])):
+            events = detect_events(source, f"ends {peak}", 0.5, peak=peak,
+                                   buffer_bytes=8 * 10)
+            np.testing.assert_allclose(events[0][:], expected)
+        mtag = detect_events(source, "ends tag", 0.5, peak=True,
+                             multitag=True, buffer_bytes=8 * 10)
+        np.testing.assert_allclose(mtag.extents[:], [5.0, 2.0, 5.0])
+        np.testing.assert_allclose(mtag.features[0].data[:],
+                                   [6.0, 12.0, 29.0])
+
+    def test_dead_time(self):
+        # the spikes are 97 ms apart: a dead time of 150 ms keeps every
+        # other one
+        events = detect_events(self.source, "spikes", -0.8, peak=True,
+                               dead_time=0.15, buffer_bytes=24 * 41)
+        np.testing.assert_allclose(events[1][:],
+                                   1.0 + (self.spikes[::2] + 2) * 0.001)
+
+    def test_relative(self):
+        std = self.values[:, 1].std()
+        threshold = self.values[:, 1].mean() - 4 * std
+        events = detect_events(self.source, "relative", -4, relative=True)
+        absolute = detect_events(self.source, "absolute",
+                                 [-100, threshold, -100])
+        np.testing.assert_allclose(events[1][:], absolute[1][:])
+        assert len(events[1][:]) == len(self.spikes)
+
+    def test_multitag(self):
+        mtag = detect_events(self.source, "spikes", -0.8, peak=True,
+                             multitag=True, jobs=3, buffer_bytes=24 * 41)
+        starts, stops, peaks = self.expected(self.values[:, 1], -0.8)
+        positions, extents = mtag.positions[:], mtag.extents[:]
+        np.testing.assert_allclose(positions[:, 0], 1.0 + starts * 0.001)
+        np.testing.assert_array_equal(positions[:, 1], 1)
+        np.testing.assert_allclose(extents[:, 0], (stops - starts) * 0.001)
+        np.testing.assert_array_equal(extents[:, 1], 0)
+        assert mtag.references[0].id == self.source.id
+        assert mtag.metadata["Source"] == self.source.id
+        np.testing.assert_allclose(mtag.features[0].data[:],
+                                   1.0 + peaks * 0.001)
+        assert mtag.features[0].link_type == nix.LinkType.Indexed
+        # the data of the first event
+        np.testing.assert_allclose(
+            mtag.tagged_data(0, "lfp")[:],
+            self.values[starts[0]:stops[0], 1:2])
+
+    def test_plot(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from nixworks.plotter.plotter import EventPlotter
+        events = detect_events(self.source, "spikes", -0.8, peak=True)
+        axis = EventPlotter(events[1]).plot()
+        assert axis.get_xlabel() == "time [s]"
+
+    def test_cli(self):
+        self.file.close()
+        cli.main(["events", "-a", "lfp", "--threshold", "-0.8", "--peak",
+                  "--multitag", self.path])
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        mtag = self.file.blocks[0].multi_tags["lfp events"]
+        assert mtag.positions.shape == (len(self.spikes), 2)
+        self.file.close()
+        with self.assertRaises(SystemExit):
+            cli.main(["events", "-a", "missing", "--threshold", "1",
+                      self.path])
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
@@ -0,0 +1,129 @@
+import json
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from pathlib import Path
+
+import h5py
+import numpy as np
+import nixio as nix
+from nixworks import instrument
+from nixworks.instrument import Recorder, operation
+from nixworks.table.table import create_from_pandas, write_to_pandas
+
+
+@operation("outer")
+def read_twice(dataset):
+    with operation("inner"):
+        dataset[:]
+    return dataset[:10]
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.h5file = h5py.File(self.tmpdir / "test.h5", "w")
+        self.dataset = self.h5file.create_dataset("data",
+                                                  data=np.arange(100.0))
+        self.dataset.attrs["unit"] = "mV"
+
+    def tearDown(self):
+        self.h5file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def summary(self, recorder):
+        return {entry["name"]: entry for entry in recorder.summary()}
+
+    def test_counts(self):
+        with Recorder("root") as recorder:
+            read_twice(self.dataset)
+            self.dataset.attrs["unit"]
+        events = {e.name: e for e in recorder.events}
+        assert events["inner"].reads == 1
+        assert events["inner"].bytes == 800
+        assert events["outer"].reads == 1
+        assert events["outer"].bytes == 80
+        assert events["root"].attrs == 1
+        assert events["inner"].parent == 1
+        assert events["outer"].parent == 0
+
+        summary = self.summary(recorder)
+        assert summary["outer"]["reads"] == 2
+        assert summary["outer"]["bytes"] == 880
+        assert summary["root"]["reads"] == 2
+        assert summary["root"]["attrs"] == 1
+        assert summary["root"]["seconds"] >= summary["outer"]["seconds"]
+
+    def test_recursive_operation(self):
+        @operation("recurse")
+        def recurse(depth):
+            self.dataset[:1]
+            if depth:
+                recurse(depth - 1)
+
+        with Recorder() as recorder:
+            recurse(2)
+        summary = self.summary(recorder)
+        assert summary["recurse"]["calls"] == 3
+        assert summary["recurse"]["reads"] == 3
+
+    def test_inactive(self):
+        getitem = h5py.Dataset.__getitem__
+        with Recorder():
+            assert instrument.active()
+            assert h5py.Dataset.__getitem__ is not getitem
+            with self.assertRaises(RuntimeError):
+                with Recorder():
+                    pass
+        assert not instrument.active()
+        assert h5py.Dataset.__getitem__ is getitem
+        # operations and count_read do nothing without a Recorder
+        read_twice(self.dataset)
+        instrument.count_read(100)
+
+    def test_output(self):
+        with Recorder("root") as recorder:
+            read_twice(self.dataset)
+            instrument.count_read(100, 0.5)
+
+        jsonfile = self.tmpdir / "profile.json"
+        recorder.save(jsonfile)
+        with open(jsonfile) as infile:
+            record = json.load(infile)
+        assert [e["name"] for e in record["events"]] == \
+            ["root", "outer", "inner"]
+        assert record["summary"][0]["name"] == "root"
+        assert record["summary"][0]["reads"] == 3
+        assert record["summary"][0]["bytes"] == 980
+
+        trace = recorder.trace()["traceEvents"]
+        assert all(e["ph"] == "X" for e in trace)
+        assert trace[2]["args"]["bytes"] == 800
+
+        folded = dict(line.rsplit(" ", 1) for line in
+                      recorder.folded("bytes").splitlines())
+        assert folded == {"root": "100", "root;outer": "80",
+                          "root;outer;inner": "800"}
+        assert "root;outer;inner" in recorder.folded()
+
+        out = StringIO()
+        recorder.print(out)
+        assert out.getvalue().splitlines()[1].startswith("root")
+
+    def test_table(self):
+        import pandas as pd
+
+        nixfile = nix.File.open(str(self.tmpdir / "table.nix"),
+                                nix.FileMode.Overwrite)
+        block = nixfile.create_block("table", "test")
+        frame = pd.DataFrame({"a": np.arange(10), "b": np.ones(10)})
+        with Recorder() as recorder:
+            df = create_from_pandas(block, frame, "frame")
+            write_to_pandas(df)
+        nixfile.close()
+        summary = self.summary(recorder)
+        assert summary["table.import"]["calls"] == 1
+        assert summary["table.export"]["reads"] > 0
+        assert summary["table.export"]["bytes"] >= frame.values.nbytes
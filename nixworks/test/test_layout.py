@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import nixio as nix
+from nixworks.converters.layout import Layout
+
+
+class TestLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.testfilename = os.path.join(self.tmpdir, "layout.nix")
+        self.file = nix.File.open(self.testfilename, nix.FileMode.Overwrite)
+        self.block = self.file.create_block("test_block", "abc")
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks(self):
+        layout = Layout(access="time", chunk_bytes=8 * 1000)
+        assert layout.chunks((10, 100000), 8, time_axis=1) == (10, 100)
+        assert layout.chunks((100000, 10), 8, time_axis=0) == (100, 10)
+        layout = Layout(access="channel", chunk_bytes=8 * 1000)
+        assert layout.chunks((10, 100000), 8, time_axis=1) == (1, 1000)
+        assert layout.chunks((10, 500), 8, time_axis=1) == (1, 500)
+        assert Layout(access=None).chunks((10, 10), 8) is True
+        with self.assertRaises(ValueError):
+            Layout(access="diagonal")
+
+    def test_create_data_array(self):
+        data = np.random.randn(4, 5000)
+        layout = Layout(level=1, shuffle=True, access="channel",
+                        chunk_bytes=8 * 1000)
+        da = layout.create_data_array(self.block, "data", "test", data=data)
+        dset = da._h5group.group["data"]
+        assert dset.chunks == (1, 1000)
+        assert dset.compression == "gzip"
+        assert dset.compression_opts == 1
+        assert dset.shuffle
+        np.testing.assert_array_equal(da[:], data)
+        da.append(data[:, :10], axis=1)
+        assert da.shape == (4, 5010)
+
+        layout = Layout(compression=False)
+        da = layout.create_data_array(self.block, "empty", "test",
+                                      shape=(3, 100), dtype=np.int16)
+        dset = da._h5group.group["data"]
+        assert dset.compression is None
+        assert da.dtype == np.int16
+
+    def test_from_args(self):
+        args = ["mne2nix.py", "--no-compression", "--chunking=auto",
+                "file.edf"]
+        layout = Layout.from_args(args)
+        assert args == ["mne2nix.py", "file.edf"]
+        assert not layout.compression
+        assert layout.access is None
+        layout = Layout.from_args(["--deflate=2", "--shuffle"])
+        assert layout.level == 2 and layout.shuffle
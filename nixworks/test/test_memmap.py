@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+import pandas as pd
+from nixworks.memmap import array_view, data_view, memmap
+from nixworks.table.table import create_from_pandas, write_to_pandas
+
+
+def make_contiguous(entity):
+    """Replace the chunked dataset of a NIX entity with a contiguous one."""
+    group = entity._h5group.group
+    data = group["data"][()]
+    del group["data"]
+    group.create_dataset("data", data=data)
+
+
+class TestMemmap(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        self.values = np.random.randn(1000, 4)
+        nixfile = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = nixfile.create_block("test", "test")
+        for name in ("contiguous", "chunked", "calibrated"):
+            da = block.create_data_array(name, "test", data=self.values)
+            da.append_sampled_dimension(0.001)
+            da.append_set_dimension()
+            if name != "chunked":
+                make_contiguous(da)
+        block.data_arrays["calibrated"].polynom_coefficients = [0.0, 2.0]
+        frame = pd.DataFrame({"a": np.arange(10), "b": np.ones(10)})
+        make_contiguous(create_from_pandas(block, frame, "frame"))
+        nixfile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_data_view(self):
+        nixfile = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        arrays = nixfile.blocks[0].data_arrays
+        view = data_view(arrays["contiguous"])
+        assert isinstance(view, np.memmap)
+        assert not view.flags.writeable
+        np.testing.assert_array_equal(view[100:200, 1:3],
+                                      self.values[100:200, 1:3])
+        chunked = arrays["chunked"]
+        assert data_view(chunked) is chunked
+        calibrated = arrays["calibrated"]
+        assert data_view(calibrated) is calibrated
+        assert memmap(calibrated._h5group.group["data"]) is not None
+        np.testing.assert_array_equal(calibrated[:5], self.values[:5] * 2)
+
+        dataframe = nixfile.blocks[0].data_frames["frame"]
+        assert isinstance(array_view(dataframe._h5group.group["data"]),
+                          np.memmap)
+        frame = write_to_pandas(dataframe)
+        np.testing.assert_array_equal(frame["a"], np.arange(10))
+        nixfile.close()
+
+    def test_writable_file(self):
+        # HDF5 may hold newer data than the file: no memory map
+        nixfile = nix.File.open(self.path, nix.FileMode.ReadWrite)
+        da = nixfile.blocks[0].data_arrays["contiguous"]
+        assert data_view(da) is da
+        nixfile.close()
+
+    def test_nix2mne(self):
+        from nixworks.converters.mne.nix2mne import read_direct
+
+        nixfile = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        da = nixfile.blocks[0].data_arrays["contiguous"]
+        out = np.empty((300, 4))
+        read_direct(da, out, 100, 400)
+        np.testing.assert_array_equal(out, self.values[100:400])
+        nixfile.close()
+
+    def test_plotter(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from nixworks.plotter.plotter import LinePlotter
+
+        nixfile = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        da = nixfile.blocks[0].data_arrays["contiguous"]
+        plotter = LinePlotter(da)
+        assert isinstance(plotter.data, np.memmap)
+        plotter.plot(maxpoints=100)
+        np.testing.assert_array_equal(plotter.lines[1].get_ydata(),
+                                      self.values[:100, 1])
+        nixfile.close()
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import numpy as np
+import nixio as nix
+import mne
+from nixworks.converters.layout import Layout
+from nixworks.converters.mne import mne2nix, nix2mne, read_epochs
+from nixworks.converters.mne.epochs import merge_windows
+
+
+class TestMNEConverters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        info = mne.create_info(["a", "b", "c", "d"], 100., "eeg")
+        self.data = np.random.randn(4, 1000) * 1e-6
+        self.raw = mne.io.RawArray(self.data, info, verbose=False)
+        annotations = mne.Annotations([1., 2., 4.], [0.5, 0.5, 0.2],
+                                      ["x", "y", "x"])
+        self.raw.set_annotations(annotations)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, split_data=False, split_stimuli=False):
+        nfname = os.path.join(self.tmpdir, "raw.nix")
+        with redirect_stdout(None):
+            mne2nix.write_raw_mne(nfname, self.raw, split_data, split_stimuli)
+        return nfname
+
+    def test_lazy_import(self):
+        nfname = self.write()
+        raw = nix2mne.import_nix(nfname)
+        assert not raw.preload
+        assert raw.ch_names == self.raw.ch_names
+        np.testing.assert_allclose(raw.get_data(), self.data)
+        np.testing.assert_allclose(raw.get_data(picks=[3, 1], start=10,
+                                                stop=20),
+                                   self.data[[3, 1], 10:20])
+
+        raw = nix2mne.import_nix(nfname, preload=True)
+        assert raw.preload
+        np.testing.assert_allclose(raw.get_data(), self.data)
+
+    def test_split_reads(self):
+        # the per-channel arrays are written from one read per block
+        get_data = mne.io.RawArray.get_data
+        calls = []
+
+        def counting(raw, *args, **kwargs):
+            calls.append(kwargs.get("picks"))
+            return get_data(raw, *args, **kwargs)
+
+        with mock.patch.object(mne.io.RawArray, "get_data", counting):
+            nfname = self.write(split_data=True)
+        assert calls == [[0, 1, 2, 3]]
+        nixfile = nix.File(nfname, nix.FileMode.ReadOnly)
+        for name, row in zip(self.raw.ch_names, self.data):
+            np.testing.assert_array_equal(
+                nixfile.blocks[0].data_arrays[name][:], row)
+        nixfile.close()
+
+    def test_square_data(self):
+        # as many samples as channels
+        info = mne.create_info(["a", "b", "c", "d"], 100., "eeg")
+        self.raw = mne.io.RawArray(self.data[:, :4], info, verbose=False)
+        nfname = self.write()
+        nixfile = nix.File(nfname, nix.FileMode.ReadOnly)
+        da = nixfile.blocks[0].data_arrays["EEG Data"]
+        dimtypes = [dim.dimension_type for dim in da.dimensions]
+        assert dimtypes == [nix.DimensionType.Set, nix.DimensionType.Range]
+        assert da.dimensions[0].labels == ("a", "b", "c", "d")
+        nixfile.close()
+
+    def test_merge_data_arrays(self):
+        nfname = self.write(split_data=True)
+        nixfile = nix.File(nfname, nix.FileMode.ReadOnly)
+        arrays = nixfile.blocks[0].groups[0].data_arrays
+        arrays = [da for da in arrays if da.type == mne2nix.RAW_DATA_TYPE]
+        merged = nix2mne.merge_data_arrays(arrays)
+        np.testing.assert_array_equal(merged, self.data)
+        # threads decode the compressed chunks outside of HDF5
+        with mock.patch.object(nix2mne, "read_block",
+                               wraps=nix2mne.read_block) as read_block:
+            merged = nix2mne.merge_data_arrays(arrays, 10, 110, jobs=2)
+            np.testing.assert_array_equal(merged, self.data[:, 10:110])
+            merged = nix2mne.merge_data_arrays(arrays, 333, jobs=3)
+            np.testing.assert_array_equal(merged, self.data[:, 333:])
+        assert read_block.call_count == 2 * len(arrays)
+        nixfile.close()
+
+    def test_annotations(self):
+        for split_data in (False, True):
+            for split_stimuli in (False, True):
+                nfname = self.write(split_data, split_stimuli)
+                raw = nix2mne.import_nix(nfname)
+                annotations = raw.annotations
+                np.testing.assert_allclose(annotations.onset, [1., 2., 4.])
+                np.testing.assert_allclose(annotations.duration,
+                                           [0.5, 0.5, 0.2])
+                assert list(annotations.description) == ["x", "y", "x"]
+                np.testing.assert_allclose(raw.get_data(start=5, stop=50),
+                                           self.data[:, 5:50])
+
+    def test_read_epochs(self):
+        for split_data in (False, True):
+            nfname = self.write(split_data, split_stimuli=True)
+            epochs = read_epochs(nfname, tmin=-0.1, tmax=0.3, jobs=2)
+            events, event_id = mne.events_from_annotations(self.raw,
+                                                           verbose=False)
+            expected = mne.Epochs(self.raw, events, event_id, tmin=-0.1,
+                                  tmax=0.3, baseline=None, verbose=False)
+            assert epochs.event_id == expected.event_id
+            np.testing.assert_array_equal(epochs.events, expected.events)
+            np.testing.assert_allclose(epochs.get_data(),
+                                       expected.get_data())
+
+            epochs = read_epochs(nfname, tmin=-0.1, tmax=0.3,
+                                 event_id={"x": 5}, max_gap=0)
+            assert len(epochs) == 2
+            np.testing.assert_array_equal(epochs.events[:, 2], [5, 5])
+
+    def test_read_epochs_repeated(self):
+        # two stimulus types with the same onset
+        self.raw.set_annotations(mne.Annotations([1., 1., 4.], [0.5] * 3,
+                                                 ["x", "y", "x"]))
+        nfname = self.write(split_stimuli=True)
+        epochs = read_epochs(nfname, tmin=-0.1, tmax=0.3)
+        assert len(epochs) == 2
+        assert "x/y" in epochs.event_id
+        epochs = read_epochs(nfname, tmin=-0.1, tmax=0.3,
+                             event_repeated="drop")
+        assert len(epochs) == 2
+        np.testing.assert_array_equal(epochs.events[:, 0], [100, 400])
+        with self.assertRaises(RuntimeError):
+            read_epochs(nfname, tmin=-0.1, tmax=0.3, event_repeated="error")
+
+    def test_read_epochs_dense(self):
+        # overlapping epochs all over the recording
+        onsets = np.arange(0.2, 9.5, 0.03)
+        self.raw.set_annotations(mne.Annotations(onsets, 0.01, "x"))
+        nfname = os.path.join(self.tmpdir, "raw.nix")
+        with redirect_stdout(None):
+            mne2nix.write_raw_mne(nfname, self.raw, layout=Layout(
+                access="time", chunk_bytes=8 * 4 * 50))
+        reads = []
+        read_raw_segment = nix2mne.read_raw_segment
+
+        def recording_read(nixfile, extras, channels, start, stop):
+            reads.append((start, stop))
+            return read_raw_segment(nixfile, extras, channels, start, stop)
+
+        with mock.patch.object(nix2mne, "read_raw_segment",
+                               recording_read):
+            epochs = read_epochs(nfname, tmin=-0.1, tmax=0.3,
+                                 buffer_bytes=8 * 4 * 200)
+        assert len(reads) > 1
+        assert max(stop - start for start, stop in reads) <= 200
+        events, event_id = mne.events_from_annotations(self.raw,
+                                                       verbose=False)
+        expected = mne.Epochs(self.raw, events, event_id, tmin=-0.1,
+                              tmax=0.3, baseline=None, verbose=False)
+        np.testing.assert_array_equal(epochs.events, expected.events)
+        np.testing.assert_allclose(epochs.get_data(), expected.get_data())
+
+    def test_merge_windows(self):
+        ranges = merge_windows([50, 0, 5, 30], 10)
+        assert ranges == [(0, 15), (30, 40), (50, 60)]
+        ranges = merge_windows([50, 0, 5, 30], 10, max_gap=15)
+        assert ranges == [(0, 60)]
+        ranges = merge_windows([50, 0, 5, 30], 10, max_gap=15,
+                               max_length=35)
+        assert ranges == [(0, 15), (30, 60)]
+        ranges = merge_windows([0, 5], 10, max_length=12)
+        assert ranges == [(0, 10), (5, 15)]
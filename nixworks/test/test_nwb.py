@@ -0,0 +1,381 @@
+import datetime
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+from pathlib import Path
+
+import h5py
+import numpy as np
+import nixio as nix
+import pynwb as nwb
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from nixworks import cli
+from nixworks.converters.layout import Layout
+from nixworks.converters.nwb import nix2nwb, nwb2nix
+from nixworks.converters import streaming
+from nixworks.converters.streaming import block_rows, iter_ragged
+
+
+class TestNWBConverters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.nwbpath = self.tmpdir / "test.nwb"
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        nwbfile = nwb.NWBFile(session_description="test", identifier="test",
+                              session_start_time=start)
+        self.data = (np.random.randn(20000, 4) * 100).astype(np.int16)
+        data = H5DataIO(self.data, compression="gzip", chunks=(1000, 4))
+        nwbfile.add_acquisition(nwb.TimeSeries(name="multichannel",
+                                               data=data, unit="V",
+                                               rate=1000.,
+                                               starting_time=0.5))
+        self.nwbfile = nwbfile
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def convert(self, layout=None):
+        with nwb.NWBHDF5IO(str(self.nwbpath), "w") as io:
+            io.write(self.nwbfile)
+        nixpath = self.tmpdir / "test.nix"
+        with redirect_stdout(None), redirect_stderr(None):
+            nwb2nix.convert_file(self.nwbpath, nixpath, layout)
+        return nix.File(str(nixpath), nix.FileMode.ReadOnly)
+
+    def test_block_rows(self):
+        assert block_rows((10000, 4), np.int16, (1000, 4), 8 * 2500) == 2000
+        assert block_rows((10000, 4), np.int16, (1000, 4), 100) == 1000
+        assert block_rows((500,), np.float64, None, 8 * 1000) == 500
+
+    def test_time_series(self):
+        nf = self.convert(Layout(compression=False))
+        da = nf.blocks[0].data_arrays["multichannel"]
+        np.testing.assert_array_equal(da[:], self.data)
+        assert da.dtype == np.int16
+        assert da.unit == "V"
+        dim = da.dimensions[0]
+        assert dim.sampling_interval == 0.001
+        assert dim.offset == 0.5
+        nf.close()
+
+    def test_chunk_passthrough(self):
+        nf = self.convert()
+        da = nf.blocks[0].data_arrays["multichannel"]
+        dataset = da._h5group.group["data"]
+        assert dataset.chunks == (1000, 4)
+        assert dataset.compression == "gzip"
+        np.testing.assert_array_equal(da[:], self.data)
+
+        with h5py.File(str(self.nwbpath), "r") as h5file:
+            source = h5file["acquisition/multichannel/data"]
+            assert streaming.can_copy_chunks(source, dataset)
+        nf.close()
+
+        nf = self.convert(Layout(access="channel"))
+        da = nf.blocks[0].data_arrays["multichannel"]
+        dataset = da._h5group.group["data"]
+        with h5py.File(str(self.nwbpath), "r") as h5file:
+            source = h5file["acquisition/multichannel/data"]
+            assert not streaming.can_copy_chunks(source, dataset)
+        nf.close()
+
+    def test_compression_flags(self):
+        with nwb.NWBHDF5IO(str(self.nwbpath), "w") as io:
+            io.write(self.nwbfile)
+        outdir = self.tmpdir / "out"
+        outdir.mkdir()
+        with redirect_stdout(None), redirect_stderr(None):
+            cli.main(["nwb2nix", "--no-compression", "-o", str(outdir),
+                      str(self.nwbpath)])
+        nf = nix.File(str(outdir / "test.nix"), nix.FileMode.ReadOnly)
+        da = nf.blocks[0].data_arrays["multichannel"]
+        dataset = da._h5group.group["data"]
+        assert dataset.compression is None
+        assert dataset.chunks == (1000, 4)
+        np.testing.assert_array_equal(da[:], self.data)
+        nf.close()
+
+        # an explicit deflate level matching the source keeps the chunks
+        with h5py.File(str(self.nwbpath), "r") as h5file:
+            level = h5file["acquisition/multichannel/data"].compression_opts
+        for deflate, copied in ((level, True), (level % 9 + 1, False)):
+            layout = Layout.from_args([f"--deflate={deflate}"],
+                                      access="source")
+            assert not layout.source_filters
+            nf = self.convert(layout)
+            da = nf.blocks[0].data_arrays["multichannel"]
+            dataset = da._h5group.group["data"]
+            assert dataset.chunks == (1000, 4)
+            assert dataset.compression_opts == deflate
+            np.testing.assert_array_equal(dataset[:], self.data)
+            with h5py.File(str(self.nwbpath), "r") as h5file:
+                source = h5file["acquisition/multichannel/data"]
+                assert layout.follows(source) == copied
+                assert streaming.can_copy_chunks(source, dataset) == copied
+            nf.close()
+
+    def test_timestamps(self):
+        regular = np.arange(1000) * 0.01 + 2.
+        jitter = regular + np.random.uniform(-1e-5, 1e-5, 1000)
+        irregular = np.sort(np.random.rand(1000)) * 10
+        for name, timestamps in [("regular", regular), ("jitter", jitter),
+                                 ("irregular", irregular)]:
+            self.nwbfile.add_acquisition(
+                nwb.TimeSeries(name=name, data=np.arange(1000.), unit="mV",
+                               timestamps=timestamps))
+        nf = self.convert()
+        arrays = nf.blocks[0].data_arrays
+        for name in ("regular", "jitter"):
+            dim = arrays[name].dimensions[0]
+            assert dim.dimension_type == nix.DimensionType.Sample
+            assert dim.unit == "s"
+            np.testing.assert_allclose(dim.sampling_interval, 0.01,
+                                       rtol=1e-5)
+            np.testing.assert_allclose(dim.offset, 2., atol=1e-4)
+        dim = arrays["irregular"].dimensions[0]
+        assert dim.dimension_type == nix.DimensionType.Range
+        np.testing.assert_array_equal(dim.ticks, irregular)
+        nf.close()
+
+    def test_iter_ragged(self):
+        counts = [3, 0, 7, 1, 0, 12, 5]
+        ends = np.cumsum(counts)
+        with h5py.File(str(self.tmpdir / "ragged.h5"), "w") as h5file:
+            data = h5file.create_dataset("data", data=np.arange(ends[-1] * 1.),
+                                         chunks=(4,))
+            index = h5file.create_dataset("index", data=ends, chunks=(2,))
+            rows = [[] for _ in counts]
+            for row, offset, values in iter_ragged(data, index, 8 * 4):
+                assert offset == len(rows[row])
+                rows[row].extend(values)
+        starts = ends - counts
+        for row, (start, end) in enumerate(zip(starts, ends)):
+            assert rows[row] == list(range(start, end))
+
+    def test_processing_and_tables(self):
+        module = self.nwbfile.create_processing_module("behavior", "behavior")
+        module.add(nwb.TimeSeries(name="speed", data=np.arange(100.),
+                                  unit="m/s", rate=10.))
+        self.nwbfile.add_stimulus(nwb.TimeSeries(name="stim",
+                                                 data=np.arange(50.),
+                                                 unit="V", rate=5.))
+        self.nwbfile.add_trial_column("condition", "condition")
+        for idx in range(10):
+            self.nwbfile.add_trial(start_time=idx * 10.,
+                                   stop_time=idx * 10. + 4,
+                                   condition=idx % 3)
+        self.nwbfile.add_unit_column("quality", "quality")
+        spikes = [np.sort(np.random.rand(n)) * 100 for n in (40, 0, 7)]
+        for idx, times in enumerate(spikes):
+            self.nwbfile.add_unit(spike_times=times,
+                                  quality="good" if idx else "mua")
+
+        nf = self.convert()
+        block = nf.blocks[0]
+        arrays = block.data_arrays
+        np.testing.assert_array_equal(arrays["behavior.speed"][:],
+                                      np.arange(100.))
+        assert "behavior.speed" in block.groups["behavior"].data_arrays
+        np.testing.assert_array_equal(arrays["stimulus.stim"][:],
+                                      np.arange(50.))
+
+        trials = block.multi_tags["trials"]
+        np.testing.assert_array_equal(trials.positions[:], np.arange(10) * 10.)
+        np.testing.assert_array_equal(trials.extents[:], np.full(10, 4.))
+        df = trials.features[0].data
+        np.testing.assert_array_equal(df.read_columns(name=["condition"]),
+                                      np.arange(10) % 3)
+
+        units = block.data_frames["units"]
+        assert list(units.read_columns(name=["quality"])) == \
+            ["mua", "good", "good"]
+        for idx, times in enumerate(spikes):
+            da = arrays[f"units.{idx}.spike_times"]
+            assert da.dimensions[0].is_alias
+            np.testing.assert_array_equal(da[:], times)
+        nf.close()
+
+    def test_regular_sampling(self):
+        assert nwb2nix.regular_sampling(np.arange(10.) * 2) == (0., 2.)
+        assert nwb2nix.regular_sampling(np.array([0., 1., 3.])) is None
+        assert nwb2nix.regular_sampling(np.array([1.])) is None
+
+    def test_copy_pipelined(self):
+        data = (np.random.randn(10007, 3) * 100).astype(np.int16)
+        with h5py.File(str(self.tmpdir / "pipeline.h5"), "w") as h5file:
+            sources = [
+                h5file.create_dataset("gzip", data=data, chunks=(1024, 3),
+                                      compression="gzip", shuffle=True),
+                h5file.create_dataset("plain", data=data),
+                h5file.create_dataset("sparse", shape=data.shape,
+                                      dtype=data.dtype, chunks=(512, 2),
+                                      compression="gzip"),
+            ]
+            sources[2][:600] = data[:600]
+            targets = [
+                h5file.create_dataset("t1", shape=data.shape, dtype=np.int16,
+                                      chunks=(4096, 2), compression="gzip",
+                                      compression_opts=2, shuffle=True),
+                h5file.create_dataset("t2", shape=data.shape, dtype=np.int16,
+                                      chunks=(777, 1), compression="gzip"),
+                h5file.create_dataset("t3", shape=data.shape, dtype=np.int16,
+                                      chunks=(512, 2), compression="gzip"),
+            ]
+            tasks = [(s, t, None) for s, t in zip(sources, targets)]
+            streaming.copy_pipelined(tasks, jobs=3, buffer_bytes=2**18)
+            np.testing.assert_array_equal(targets[0][:], data)
+            np.testing.assert_array_equal(targets[1][:], data)
+            expected = np.zeros_like(data)
+            expected[:600] = data[:600]
+            np.testing.assert_array_equal(targets[2][:], expected)
+
+    def test_read_block(self):
+        data = (np.random.randn(1000, 3) * 100).astype(np.int16)
+        with h5py.File(str(self.tmpdir / "block.h5"), "w") as h5file:
+            dataset = h5file.create_dataset("data", data=data,
+                                            chunks=(64, 2),
+                                            compression="gzip", shuffle=True)
+            pipeline = streaming.filter_pipeline(dataset)
+            for start, stop in ((0, 1000), (10, 20), (63, 65), (130, 1000)):
+                out = np.zeros((stop - start, 3), dtype=np.int16)
+                block = streaming.read_block(dataset, slice(start, stop),
+                                             pipeline, out=out)
+                assert block is out
+                np.testing.assert_array_equal(out, data[start:stop])
+            np.testing.assert_array_equal(
+                streaming.read_block(dataset, slice(100, 200), pipeline),
+                data[100:200])
+
+    def test_progress(self):
+        # raw chunk copies count the values copied, not the bytes stored
+        data = (np.random.randn(10007, 3) * 100).astype(np.int16)
+        with h5py.File(str(self.tmpdir / "progress.h5"), "w") as h5file:
+            source = h5file.create_dataset("source", data=data,
+                                           chunks=(1024, 2),
+                                           compression="gzip")
+            for name, pipelined in (("copy", False), ("pipelined", True)):
+                target = h5file.create_dataset(
+                    name, shape=data.shape, dtype=data.dtype,
+                    chunks=(1024, 2), compression="gzip")
+                assert streaming.can_copy_chunks(source, target)
+                progress = streaming.Progress(name, data.nbytes,
+                                              file=StringIO())
+                if pipelined:
+                    streaming.copy_pipelined(
+                        [(source, target, progress)], jobs=2,
+                        buffer_bytes=2**16,
+                        committed=lambda index, rows: None)
+                else:
+                    streaming.copy(source, target, progress=progress)
+                np.testing.assert_array_equal(target[:], data)
+                assert progress.done == progress.total == data.nbytes
+
+    def test_jobs(self):
+        self.nwbfile.add_acquisition(
+            nwb.TimeSeries(name="second", data=np.arange(5000.), unit="mV",
+                           rate=10.))
+        with nwb.NWBHDF5IO(str(self.nwbpath), "w") as io:
+            io.write(self.nwbfile)
+        nixpath = self.tmpdir / "jobs.nix"
+        with redirect_stdout(None), redirect_stderr(None):
+            nwb2nix.convert_file(self.nwbpath, nixpath, Layout(level=1),
+                                 jobs=2)
+        nf = nix.File(str(nixpath), nix.FileMode.ReadOnly)
+        arrays = nf.blocks[0].data_arrays
+        np.testing.assert_array_equal(arrays["multichannel"][:], self.data)
+        np.testing.assert_array_equal(arrays["second"][:], np.arange(5000.))
+        nf.close()
+
+    def test_duplicate_stems(self):
+        paths = [self.tmpdir / "a" / "session.nwb",
+                 self.tmpdir / "b" / "Session.nwb"]
+        with self.assertRaises(ValueError):
+            nwb2nix.output_paths(paths, self.tmpdir)
+        with self.assertRaises(ValueError):
+            nwb2nix.convert_batch(paths, self.tmpdir)
+        outputs = nwb2nix.output_paths(paths[:1], self.tmpdir)
+        assert outputs == {paths[0]: self.tmpdir / "session.nix"}
+
+    def relacs_file(self):
+        nf = nix.File.open(str(self.tmpdir / "relacs.nix"),
+                           nix.FileMode.Overwrite)
+        block = nf.create_block("recording", "relacs")
+        section = nf.create_section("recording", "relacs")
+        recording = section.create_section("Recording", "Recording")
+        recording["Name"] = "recording"
+        recording["Date"] = "2020-01-01"
+        recording["Time"] = "12:00:00"
+        block.metadata = section
+        return nf, block
+
+    def test_nix2nwb_streaming(self):
+        nf, block = self.relacs_file()
+        data = np.random.randn(2000000)
+        da = block.create_data_array("trace", "relacs.trace", data=data)
+        da.unit = "mV"
+        da.append_sampled_dimension(0.001, unit="s")
+
+        nwbpath = self.tmpdir / "relacs.nwb"
+        tracemalloc.start()
+        with redirect_stdout(None), redirect_stderr(None):
+            nix2nwb.convert_block(block, nwbpath, Layout(level=1),
+                                  buffer_bytes=2**20)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        nf.close()
+        assert peak < data.nbytes / 4
+
+        with h5py.File(str(nwbpath), "r") as h5file:
+            dataset = h5file["acquisition/trace/data"]
+            assert dataset.compression == "gzip"
+            assert dataset.compression_opts == 1
+            np.testing.assert_array_equal(dataset[:], data)
+
+    def test_nix2nwb_layouts(self):
+        nf, block = self.relacs_file()
+        multi = np.random.randn(4, 5000)
+        da = block.create_data_array("eeg", "relacs.eeg", data=multi)
+        da.unit = "uV"
+        da.append_set_dimension(labels=["Fz", "Cz", "Pz", "Oz"])
+        da.append_sampled_dimension(0.002, unit="s", offset=1.)
+        ticks = np.sort(np.random.rand(300)) * 1000
+        da = block.create_data_array("irregular", "relacs.trace",
+                                     data=np.arange(300.))
+        da.unit = "mV"
+        da.append_range_dimension(ticks, unit="ms")
+        spikes = [np.sort(np.random.rand(n)) for n in (20, 0, 31)]
+        for idx, times in enumerate(spikes):
+            da = block.create_data_array(f"spikes {idx}", "relacs.spikes",
+                                         data=times)
+            da.unit = "s"
+            da.append_range_dimension_using_self()
+
+        nwbpath = self.tmpdir / "relacs.nwb"
+        for layout in (Layout(), Layout(access="time")):
+            with redirect_stdout(None), redirect_stderr(None):
+                nix2nwb.convert_block(block, nwbpath, layout,
+                                      buffer_bytes=4096)
+            with nwb.NWBHDF5IO(str(nwbpath), "r") as io:
+                nwbfile = io.read()
+                eeg = nwbfile.acquisition["eeg"]
+                assert isinstance(eeg, nwb.ecephys.ElectricalSeries)
+                np.testing.assert_array_equal(eeg.data[:], multi.T)
+                assert eeg.conversion == 1e-6
+                assert eeg.rate == 500.
+                assert eeg.starting_time == 1.
+                assert list(eeg.electrodes.to_dataframe()["label"]) == \
+                    ["Fz", "Cz", "Pz", "Oz"]
+                irregular = nwbfile.acquisition["irregular"]
+                np.testing.assert_allclose(irregular.timestamps[:],
+                                           ticks / 1000)
+                units = nwbfile.units
+                assert list(units["label"][:]) == \
+                    [f"spikes {idx}" for idx in range(3)]
+                for idx, times in enumerate(spikes):
+                    np.testing.assert_array_equal(units["spike_times"][idx],
+                                                  times)
+        nf.close()
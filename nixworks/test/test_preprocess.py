@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+from scipy import signal
+from nixworks import cli
+from nixworks.preprocess import (Bandpass, Decimate, Highpass, Notch,
+                                 Reference, preprocess)
+
+
+class TestPreprocess(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        rng = np.random.default_rng(3)
+        self.rate = 1000.0
+        self.values = rng.standard_normal((30001, 5)) + \
+            np.arange(5) * 10
+        self.file = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = self.file.create_block("test", "test")
+        self.source = block.create_data_array("eeg", "nix.sampled",
+                                              data=self.values)
+        self.source.unit = "uV"
+        self.source.append_sampled_dimension(1 / self.rate, label="time",
+                                             unit="s")
+        self.labels = [f"E{idx}" for idx in range(5)]
+        self.source.append_set_dimension(labels=self.labels)
+        # mne2nix stores channels along the first axis
+        self.transposed = block.create_data_array(
+            "eeg.T", "nix.sampled", data=self.values.T)
+        self.transposed.unit = "uV"
+        self.transposed.append_set_dimension(labels=self.labels)
+        self.transposed.append_sampled_dimension(1 / self.rate,
+                                                 label="time", unit="s")
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def reference(self, steps):
+        """The steps applied by scipy to the whole recording."""
+        values = self.values.copy()
+        for step in steps:
+            if isinstance(step, Reference):
+                values -= values.mean(axis=1, keepdims=True)
+            elif isinstance(step, Decimate):
+                sos = signal.cheby1(8, 0.05, 0.8 / step.factor,
+                                    output="sos")
+                zi = signal.sosfilt_zi(sos)[:, :, None] * values[0]
+                values = signal.sosfilt(sos, values, axis=0, zi=zi)[0]
+                values = values[::step.factor]
+            else:
+                sos = step.start(self.rate).sos
+                zi = signal.sosfilt_zi(sos)[:, :, None] * values[0]
+                values = signal.sosfilt(sos, values, axis=0, zi=zi)[0]
+        return values
+
+    def test_iir(self):
+        steps = [Reference(), Bandpass(1.0, 40.0), Notch(50.0),
+                 Decimate(4)]
+        expected = self.reference(steps)
+        for source, jobs in ((self.source, 1), (self.transposed, 3)):
+            output = preprocess(source, steps, source.name + " filtered",
+                                jobs=jobs, buffer_bytes=8 * 5 * 4096)
+            data = output[:] if source is self.source else output[:].T
+            np.testing.assert_allclose(data, expected, atol=1e-9)
+            assert output.unit == "uV"
+        assert output.dimensions[1].sampling_interval == 0.004
+        assert output.dimensions[0].labels == tuple(self.labels)
+        section = output.metadata
+        assert section.type == "nixworks.provenance"
+        assert section["Source"] == self.transposed.id
+        assert section["SamplingRate"] == 250.0
+        assert len(section.props["Steps"].values) == 4
+
+    def test_fir(self):
+        taps = 201
+        output = preprocess(self.source, [Highpass(50.0, taps=taps)],
+                            "highpass", buffer_bytes=8 * 5 * 1000)
+        coefficients = signal.firwin(taps, 50.0, pass_zero="highpass",
+                                     fs=self.rate)
+        padded = np.concatenate((np.repeat(self.values[:1], taps - 1, 0),
+                                 self.values))
+        expected = signal.lfilter(coefficients, 1.0, padded,
+                                  axis=0)[taps - 1:]
+        np.testing.assert_allclose(output[:], expected, atol=1e-9)
+        # the offsets of the channels are removed without transient
+        assert np.abs(output[:100]).max() < 5
+
+    def test_reference_channels(self):
+        output = preprocess(self.source, [Reference(["E0", 4])], "ref")
+        np.testing.assert_allclose(
+            output[:], self.values -
+            self.values[:, [0, 4]].mean(axis=1, keepdims=True))
+
+    def test_cli(self):
+        self.file.close()
+        cli.main(["preprocess", "-a", "eeg", "--highpass", "1",
+                  "--notch", "50", "--decimate", "2", "-o", "filtered",
+                  self.path])
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        output = self.file.blocks[0].data_arrays["filtered"]
+        assert output.shape == (15001, 5)
+        assert output.dimensions[0].sampling_interval == 0.002
+        self.file.close()
+        with self.assertRaises(SystemExit):
+            cli.main(["preprocess", "-a", "missing", self.path])
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
@@ -0,0 +1,131 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import nixio as nix
+from scipy import signal
+from nixworks import cli, spectral
+from nixworks.spectral import Segments, spectrogram, welch
+
+
+class TestSpectral(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        self.rate = 500.0
+        time = np.arange(20000) / self.rate
+        rng = np.random.default_rng(5)
+        self.values = np.stack([np.sin(2 * np.pi * 50 * time),
+                                np.sin(2 * np.pi * 120 * time),
+                                np.zeros_like(time)], axis=1) + \
+            rng.standard_normal((20000, 3)) * 0.1
+        self.file = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = self.file.create_block("test", "test")
+        # channels along the first axis, as written by mne2nix
+        self.source = block.create_data_array("lfp", "nix.sampled",
+                                              data=self.values.T)
+        self.source.unit = "mV"
+        self.source.append_set_dimension(labels=["a", "b", "c"])
+        dim = self.source.append_sampled_dimension(1 / self.rate,
+                                                   label="time", unit="s")
+        dim.offset = 2.0
+        self.segments = Segments(nperseg=256, noverlap=64, nfft=300)
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_spectrogram(self):
+        output = spectrogram(self.source, "sgram", self.segments, jobs=2,
+                             buffer_bytes=100000)
+        freqs, times, expected = signal.spectrogram(
+            self.values, self.rate, "hann", nperseg=256, noverlap=64,
+            nfft=300, axis=0)
+        # scipy: (frequencies, channels, segments)
+        np.testing.assert_allclose(output[:],
+                                   expected.transpose(2, 0, 1))
+        time, frequency, channel = output.dimensions
+        np.testing.assert_allclose(time.axis(len(times)), times + 2.0)
+        np.testing.assert_allclose(frequency.axis(len(freqs)), freqs)
+        assert frequency.unit == "Hz"
+        assert channel.labels == ("a", "b", "c")
+        assert output.unit == "mV^2/Hz"
+        assert output.metadata["Completed"] == len(times)
+
+        single = spectrogram(self.source, "sgram b", self.segments,
+                             channel="b")
+        assert single.shape == (len(times), len(freqs))
+        np.testing.assert_allclose(single[:], expected[:, 1].T)
+        assert np.argmax(single[:].mean(axis=0)) == \
+            np.argmin(np.abs(freqs - 120))
+
+        import matplotlib
+        matplotlib.use("Agg")
+        from nixworks.plotter.plotter import ImagePlotter
+        axis = ImagePlotter(single).plot()
+        assert axis.get_ylabel() == "frequency [Hz]"
+
+    def test_read(self):
+        # a single channel is read on its own
+        source = spectral.Source(self.source, channel="b")
+        values = source.read(100, 300)
+        assert values.shape == (200, 1)
+        np.testing.assert_array_equal(values[:, 0], self.values[100:300, 1])
+        block = self.file.blocks[0]
+        columns = block.create_data_array("columns", "nix.sampled",
+                                          data=self.values)
+        columns.append_sampled_dimension(1 / self.rate)
+        columns.append_set_dimension()
+        source = spectral.Source(columns, channel=2)
+        np.testing.assert_array_equal(source.read(5, 10),
+                                      self.values[5:10, 2:])
+        source = spectral.Source(columns)
+        np.testing.assert_array_equal(source.read(5, 10), self.values[5:10])
+
+    def test_welch(self):
+        output = welch(self.source, "psd", self.segments,
+                       buffer_bytes=100000)
+        _, expected = signal.welch(self.values, self.rate, nperseg=256,
+                                   noverlap=64, nfft=300, axis=0)
+        np.testing.assert_allclose(output[:], expected)
+
+    def test_resume(self):
+        blocks = spectral.Source.blocks
+
+        def interrupted(*args):
+            for count, block in enumerate(blocks(*args)):
+                if count == 3:
+                    raise KeyboardInterrupt
+                yield block
+
+        for compute in (spectrogram, welch):
+            name = compute.__name__
+            with mock.patch.object(spectral.Source, "blocks", interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    compute(self.source, name, self.segments,
+                            buffer_bytes=50000)
+            partial = self.file.blocks[0].data_arrays[name]
+            assert 0 < partial.metadata["Completed"] < 100
+            output = compute(self.source, name, self.segments,
+                             buffer_bytes=50000)
+            expected = compute(self.source, name + " full", self.segments)
+            np.testing.assert_allclose(output[:], expected[:])
+            assert len(output.dimensions) == len(expected.dimensions)
+            with self.assertRaises(ValueError):
+                compute(self.source, name, Segments(128))
+            restarted = compute(self.source, name, Segments(128),
+                                restart=True)
+            assert restarted.metadata["Parameters"] != \
+                expected.metadata["Parameters"]
+
+    def test_cli(self):
+        self.file.close()
+        cli.main(["spectral", "-a", "lfp", "--welch", "--channel", "0",
+                  "--nperseg", "128", self.path])
+        self.file = nix.File.open(self.path, nix.FileMode.ReadOnly)
+        output = self.file.blocks[0].data_arrays["lfp (psd)"]
+        assert output.shape == (65,)
@@ -0,0 +1,153 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import h5py
+import numpy as np
+import nixio as nix
+from nixworks import stats
+from nixworks.stats import compute_statistics, load_statistics, statistics
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        rng = np.random.default_rng(1)
+        self.values = rng.standard_normal((20000, 3)) * [1, 10, 100] + \
+            [0, 5, -50]
+        self.values[5, 1] = np.nan
+        self.values[7, 2] = np.inf
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compute(self):
+        with h5py.File(self.tmpdir / "test.h5", "w") as h5file:
+            dataset = h5file.create_dataset("data", data=self.values,
+                                            chunks=(500, 3),
+                                            compression="gzip")
+            results = [compute_statistics(dataset, 0, 1, 32, jobs,
+                                          buffer_bytes=8 * 3 * 2000)
+                       for jobs in (1, 3)]
+            single = compute_statistics(dataset, 0, None, 32)
+            columns = compute_statistics(dataset, 1, 0, 8)
+
+        finite = np.where(np.isfinite(self.values), self.values, np.nan)
+        for result in results:
+            np.testing.assert_array_equal(result.count, [20000, 19999, 19999])
+            np.testing.assert_array_equal(result.nans, [0, 1, 0])
+            np.testing.assert_array_equal(result.infs, [0, 0, 1])
+            np.testing.assert_array_equal(result.minimum,
+                                          np.nanmin(finite, axis=0))
+            np.testing.assert_array_equal(result.maximum,
+                                          np.nanmax(finite, axis=0))
+            np.testing.assert_allclose(result.mean, np.nanmean(finite, 0))
+            np.testing.assert_allclose(result.std, np.nanstd(finite, 0))
+            for channel in range(3):
+                counts, edges = result.histogram_of(channel)
+                column = finite[:, channel]
+                expected, _ = np.histogram(column[~np.isnan(column)], edges)
+                np.testing.assert_array_equal(counts, expected)
+                # power of two bins covering at most four times the range
+                assert np.log2(np.diff(edges)[0]) % 1 == 0
+                assert edges[-1] - edges[0] <= \
+                    4 * (np.nanmax(column) - np.nanmin(column))
+        assert single.channels == 1
+        assert single.count[0] == 59998
+        assert single.histogram.sum() == 59998
+        assert columns.channels == 20000
+
+    def test_merge(self):
+        first = stats.block_statistics(self.values[:100, :1], 16)
+        second = stats.block_statistics(self.values[100:, :1] * 1000, 16)
+        merged = first.merge(second)
+        both = stats.block_statistics(
+            np.concatenate((self.values[:100, :1],
+                            self.values[100:, :1] * 1000)), 16)
+        counts, edges = merged.histogram_of(0)
+        expected, _ = np.histogram(
+            np.concatenate((self.values[:100, 0], self.values[100:, 0] *
+                            1000)), edges)
+        np.testing.assert_array_equal(counts, expected)
+        np.testing.assert_allclose(merged.mean, both.mean)
+        np.testing.assert_allclose(merged.std, both.std)
+        overall = stats.block_statistics(self.values[:, :2], 16).overall()
+        assert overall.count[0] == 39999
+
+    def write_nix(self):
+        nixfile = nix.File.open(str(self.tmpdir / "test.nix"),
+                                nix.FileMode.Overwrite)
+        block = nixfile.create_block("test", "test")
+        da = block.create_data_array("signal", "test", data=self.values)
+        da.append_sampled_dimension(0.001)
+        da.append_set_dimension()
+        return nixfile, da
+
+    def test_cache(self):
+        nixfile, da = self.write_nix()
+        first = statistics(da)
+        stored = load_statistics(nixfile, da)
+        np.testing.assert_array_equal(stored.histogram, first.histogram)
+        np.testing.assert_array_equal(stored.maximum, first.maximum)
+        assert stored.channel_axis == 1
+        with mock.patch.object(stats, "compute_statistics") as compute:
+            cached = statistics(da)
+        compute.assert_not_called()
+        assert cached.fingerprint == first.fingerprint
+
+        # sampled rows (the first ones are always sampled) and new shapes
+        # invalidate the cache
+        da[0, 0] = 1000.0
+        assert statistics(da).maximum[0] == 1000.0
+        da.append(np.full((10, 3), -1000.0))
+        assert statistics(da).minimum[0] == -1000.0
+        nixfile.close()
+
+        # read only files are left alone
+        nixfile = nix.File.open(str(self.tmpdir / "test.nix"),
+                                nix.FileMode.ReadOnly)
+        da = nixfile.blocks[0].data_arrays["signal"]
+        assert statistics(da, bins=8).bins == 8
+        assert load_statistics(nixfile, da).bins == 64
+        nixfile.close()
+
+    def test_calibration(self):
+        nixfile, da = self.write_nix()
+        raw = statistics(da)
+        da.polynom_coefficients = [1.0, -2.0]
+        da.expansion_origin = 0.5
+        values = da[:]
+        finite = np.where(np.isfinite(values), values, np.nan)
+        calibrated = statistics(da)
+        assert calibrated.fingerprint != raw.fingerprint
+        np.testing.assert_allclose(calibrated.minimum,
+                                   np.nanmin(finite, axis=0))
+        np.testing.assert_allclose(calibrated.maximum,
+                                   np.nanmax(finite, axis=0))
+        np.testing.assert_allclose(calibrated.mean,
+                                   np.nanmean(finite, axis=0))
+        np.testing.assert_allclose(calibrated.std, np.nanstd(finite, axis=0))
+        with mock.patch.object(stats, "compute_statistics") as compute:
+            statistics(da)
+        compute.assert_not_called()
+        nixfile.close()
+
+    def test_plotter(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from nixworks.plotter.plotter import LinePlotter
+
+        nixfile, da = self.write_nix()
+        da[15000, 0] = 500.0
+        plotter = LinePlotter(da)
+        plotter.plot(maxpoints=1000)
+        low, high = plotter.axis.get_ylim()
+        assert low < -400 and high > 500
+        assert stats.SECTION_NAME in nixfile.sections
+        # later windows keep the limits of the whole array
+        plotter.slider.set_val(10)
+        assert plotter.axis.get_ylim() == (low, high)
+        nixfile.close()
@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+from nixworks.tagindex import TagIndex, tag_index
+
+
+class TestTagIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        self.file = nix.File.open(self.path, nix.FileMode.Overwrite)
+        self.block = self.file.create_block("test", "test")
+        self.signal = self.block.create_data_array(
+            "signal", "nix.sampled", data=np.zeros((100000, 2)))
+        self.signal.append_sampled_dimension(0.001, label="time", unit="s")
+        self.signal.append_set_dimension()
+        self.other = self.block.create_data_array("other", "nix.sampled",
+                                                  data=np.zeros(10))
+        self.other.append_sampled_dimension(1.0, unit="s")
+
+        rng = np.random.default_rng(11)
+        self.starts = np.sort(rng.uniform(0, 100, 5000))
+        self.extents = rng.exponential(0.05, 5000)
+        self.extents[::500] = 10.0
+        positions = self.block.create_data_array(
+            "positions", "positions",
+            data=np.stack([self.starts, np.zeros(5000)], axis=1))
+        extents = self.block.create_data_array(
+            "extents", "extents",
+            data=np.stack([self.extents, np.ones(5000)], axis=1))
+        mtag = self.block.create_multi_tag("events", "events", positions)
+        mtag.extents = extents
+        mtag.references.append(self.signal)
+        # in milliseconds
+        tag = self.block.create_tag("stimulus", "stimulus", [20000.0, 0.0])
+        tag.extent = [5000.0, 1.0]
+        tag.units = ["ms", ""]
+        tag.references.append(self.signal)
+        point = self.block.create_tag("marker", "marker", [3.0])
+        point.references.append(self.other)
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_search(self):
+        rng = np.random.default_rng(2)
+        starts = rng.uniform(0, 1e5, 300000)
+        ends = starts + rng.exponential(1.0, 300000)
+        ends[::10000] += 1000.0
+        index = TagIndex(starts, ends, np.zeros(300000), np.arange(300000))
+        for low, high in ((10.0, 20.0), (5e4, 5e4), (-10.0, -1.0),
+                          (9e4, 2e5), (-1.0, 2e5)):
+            expected = np.flatnonzero((index.starts <= high) &
+                                      (index.ends >= low))
+            np.testing.assert_array_equal(index.search(low, high), expected)
+        assert len(TagIndex([], [], [], []).search(0.0, 1.0)) == 0
+
+    def test_block(self):
+        index = tag_index(self.block, unit="s")
+        assert len(index) == 5002
+        tags, entries, starts, ends = index.overlapping(21.0, 22.0,
+                                                        self.signal)
+        names = {index.names[tag] for tag in tags}
+        assert names == {"events", "stimulus"}
+        stimulus = tags == index.names.index("stimulus")
+        np.testing.assert_allclose(starts[stimulus], [20.0])
+        np.testing.assert_allclose(ends[stimulus], [25.0])
+        events = entries[~stimulus]
+        expected = np.flatnonzero((self.starts <= 22.0) &
+                                  (self.starts + self.extents >= 21.0))
+        np.testing.assert_array_equal(np.sort(events), expected)
+
+        tags, _, starts, _ = index.overlapping(0.0, 5.0, self.other)
+        assert [index.names[tag] for tag in tags] == ["marker"]
+        tags, _, _, _ = index.overlapping(0.0, 100.0, tags=["stimulus"])
+        assert len(tags) == 1
+
+        # positions along the second dimension
+        second = tag_index(self.block, dimension=1)
+        assert len(second) == 5001
+
+    def test_cache(self):
+        index = tag_index(self.block, unit="s")
+        assert tag_index(self.block, unit="s") is index
+        assert tag_index(self.block, unit="ms") is not index
+        self.block.multi_tags["events"].positions.append([[200.0, 0.0]],
+                                                         axis=0)
+        self.block.multi_tags["events"].extents.append([[1.0, 1.0]],
+                                                       axis=0)
+        updated = tag_index(self.block, unit="s")
+        assert updated is not index
+        assert len(updated.overlapping(199.0, 199.5)[0]) == 0
+        assert len(updated.overlapping(200.5, 201.0)[0]) == 1
+
+    def test_overlay(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from nixworks.plotter import LinePlotter
+        plotter = LinePlotter(self.signal)
+        plotter.plot(maxpoints=1000)
+        overlay = plotter.overlay_tags()
+        visible = np.flatnonzero((self.starts <= 0.999) &
+                                 (self.starts + self.extents >= 0.0))
+        spans = overlay.artists[0]
+        assert len(spans.get_paths()) == len(visible)
+        plotter.axis.set_xlim([20.0, 20.5])
+        visible = np.flatnonzero((self.starts <= 20.5) &
+                                 (self.starts + self.extents >= 20.0))
+        # the events and the stimulus
+        assert len(overlay.artists[0].get_paths()) == len(visible) + 1
+        overlay.remove()
+        assert not overlay.artists
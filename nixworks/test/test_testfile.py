@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import nixio as nix
+from nixworks.converters.layout import Layout
+from nixworks.test.create_testfile import create_test_data, parse_size
+
+
+class TestCreateTestfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "test.nix")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_size(self):
+        assert parse_size("512") == 512
+        assert parse_size("500MB") == 500 * 2**20
+        assert parse_size("1.5g") == int(1.5 * 2**30)
+        assert parse_size("20GiB") == 20 * 2**30
+        with self.assertRaises(ValueError):
+            parse_size("ten")
+
+    def test_default_file(self):
+        create_test_data(self.filename, image=None)
+        nf = nix.File(self.filename, nix.FileMode.ReadOnly)
+        arrays = nf.blocks[0].data_arrays
+        assert arrays["long 1d data"].shape == (500000,)
+        assert arrays["2d sampled-set"].shape == (10000, 5)
+        assert arrays["difference of Gaussians"].shape == (240, 240)
+        assert arrays["lena"].shape == (512, 512, 3)
+        assert len(arrays) == 9
+        nf.close()
+
+    def test_sized_file(self):
+        layout = Layout(level=1, access="time", chunk_bytes=2**16)
+        create_test_data(self.filename, "1MB", channels=7, layout=layout,
+                         image=None, seed=1)
+        nf = nix.File(self.filename, nix.FileMode.ReadOnly)
+        arrays = nf.blocks[0].data_arrays
+        samples = 2**20 // (8 * 8)
+        assert arrays["long 1d data"].shape == (samples,)
+        sampled_set = arrays["2d sampled-set"]
+        assert sampled_set.shape == (samples, 7)
+        dataset = sampled_set._h5group.group["data"]
+        assert dataset.compression == "gzip"
+        assert dataset.chunks == (2**16 // (8 * 7), 7)
+        # smooth sine waves
+        values = sampled_set[:]
+        assert np.abs(np.diff(values, axis=0)).max() < 0.01
+        assert arrays["2d range data"].shape == (25, 7)
+        nf.close()
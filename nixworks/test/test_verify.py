@@ -0,0 +1,119 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+import h5py
+import numpy as np
+import mne
+import pynwb as nwb
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from nixworks.converters import verify
+from nixworks.converters.mne import mne2nix
+from nixworks.converters.nwb import nwb2nix
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def nwb_pair(self):
+        nwbpath = self.tmpdir / "test.nwb"
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        nwbfile = nwb.NWBFile(session_description="test", identifier="test",
+                              session_start_time=start)
+        data = np.random.randn(20000, 3)
+        nwbfile.add_acquisition(nwb.TimeSeries(
+            name="signal", data=H5DataIO(data, compression="gzip",
+                                         chunks=(1000, 3)),
+            unit="V", rate=1000.))
+        nwbfile.add_trial(start_time=1., stop_time=2.)
+        with nwb.NWBHDF5IO(str(nwbpath), "w") as io:
+            io.write(nwbfile)
+        nixpath = self.tmpdir / "test.nix"
+        with redirect_stdout(None), redirect_stderr(None):
+            nwb2nix.convert_file(nwbpath, nixpath)
+        return nwbpath, nixpath
+
+    def test_nwb(self):
+        nwbpath, nixpath = self.nwb_pair()
+        for method in ("diff", "hash"):
+            report = verify.verify(nwbpath, nixpath, method=method, jobs=2,
+                                   buffer_bytes=8 * 3 * 2000)
+            assert report.ok
+            assert report.signals == ["signal"]
+            assert len(report.channels["signal"]) == 3
+
+        with h5py.File(str(nixpath), "a") as h5file:
+            for block in h5file["data"].values():
+                dataset = block["data_arrays/signal/data"]
+                dataset[1500:4200, 2] += 1.
+                dataset[7000, 0] = np.nan
+        report = verify.verify(nwbpath, nixpath, tolerance=0.5,
+                               buffer_bytes=8 * 3 * 2000)
+        assert not report.ok
+        ranges = [(m.channel, m.start, m.stop) for m in report.mismatches]
+        assert sorted(ranges) == [(0, 7000, 7001), (2, 1500, 4200)]
+        assert report.channels["signal"][0] == np.inf
+
+        report = verify.verify(nwbpath, nixpath, method="hash",
+                               buffer_bytes=8 * 3 * 2000)
+        ranges = [(m.channel, m.start, m.stop) for m in report.mismatches]
+        assert sorted(ranges) == [(0, 7000, 8000), (2, 1000, 5000)]
+
+    def test_nwb_timestamps(self):
+        nwbpath = self.tmpdir / "timestamps.nwb"
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        nwbfile = nwb.NWBFile(session_description="test", identifier="test",
+                              session_start_time=start)
+        nwbfile.add_acquisition(nwb.TimeSeries(
+            name="signal", data=np.random.randn(1000, 2), unit="n/a",
+            timestamps=np.arange(1000) * 0.01))
+        with nwb.NWBHDF5IO(str(nwbpath), "w") as io:
+            io.write(nwbfile)
+        nixpath = self.tmpdir / "timestamps.nix"
+        with redirect_stdout(None), redirect_stderr(None):
+            nwb2nix.convert_file(nwbpath, nixpath)
+        report = verify.verify(nwbpath, nixpath)
+        assert report.ok, report.metadata
+
+    def test_compare_units(self):
+        signals = [verify.Signal("s", (1, 1), unit=unit)
+                   for unit in (None, "", "n/a", "N/A")]
+        for source in signals:
+            for target in signals:
+                assert verify.compare_units(source, target)
+        volts = verify.Signal("s", (1, 1), unit="V")
+        millivolts = verify.Signal("s", (1, 1), unit="mV", conversion=1e3)
+        assert verify.compare_units(volts, millivolts)
+        assert not verify.compare_units(volts, signals[2])
+
+    def test_mne(self):
+        info = mne.create_info(["a", "b", "c"], 100., "eeg")
+        raw = mne.io.RawArray(np.random.randn(3, 1000) * 1e-6, info,
+                              verbose=False)
+        raw.set_annotations(mne.Annotations([1., 2.], [0.5, 0.5], ["x", "y"]))
+        fifpath = os.path.join(self.tmpdir, "test_raw.fif")
+        raw.save(fifpath, verbose=False)
+        nixpath = os.path.join(self.tmpdir, "test.nix")
+        with redirect_stdout(None):
+            mne2nix.write_raw_mne(nixpath, raw)
+        report = verify.verify(fifpath, nixpath, tolerance=1e-12)
+        assert report.ok
+        assert report.signals == ["raw"]
+
+        raw.set_annotations(mne.Annotations([1.], [0.5], ["x"]))
+        raw.save(fifpath, overwrite=True, verbose=False)
+        report = verify.verify(fifpath, nixpath, tolerance=1e-12)
+        assert report.metadata == ["annotations: 1 != 2"]
+
+    def test_value_ranges(self):
+        bad = np.array([True, True, False, False, True, False, True])
+        assert list(verify.value_ranges(bad)) == [(0, 2), (4, 5), (6, 7)]
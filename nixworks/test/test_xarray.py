@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import nixio as nix
+import xarray as xr
+from nixworks.instrument import Recorder
+from nixworks.xarray_backend import NixBackendEntrypoint
+
+
+class TestXarrayBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.path = str(self.tmpdir / "test.nix")
+        self.values = np.random.randn(20000, 3)
+        nixfile = nix.File.open(self.path, nix.FileMode.Overwrite)
+        block = nixfile.create_block("session", "recording")
+        da = block.create_data_array("signal", "nix.sampled",
+                                     data=self.values)
+        da.unit = "mV"
+        dim = da.append_sampled_dimension(0.001, label="time", unit="s")
+        dim.offset = 1.0
+        da.append_set_dimension(labels=["a", "b", "c"])
+        events = block.create_data_array("events", "nix.events",
+                                         data=[0.5, 1.25, 3.0, 7.5])
+        events.append_range_dimension_using_self()
+        events.dimensions[0].label = "onset"
+        ranged = block.create_data_array("ranged", "test",
+                                         data=np.arange(4.0))
+        ranged.append_range_dimension([0.0, 1.0, 4.0, 9.0], label="time",
+                                      unit="s")
+        calibrated = block.create_data_array(
+            "calibrated", "test", data=np.arange(6, dtype="int16"))
+        calibrated.polynom_coefficients = [1.0, 2.0]
+        calibrated.append_sampled_dimension(0.5, label="time", unit="s")
+        block.create_data_array("names", "test", dtype=nix.DataType.String,
+                                data=["x", "y"])
+        nixfile.create_block("empty", "test")
+        nixfile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_open(self):
+        assert NixBackendEntrypoint().guess_can_open(self.path)
+        with xr.open_dataset(self.path, engine="nix") as ds:
+            assert set(ds.data_vars) == {"signal", "events", "ranged",
+                                         "calibrated"}
+            # the time dimensions differ: prefixed with the array name
+            assert ds["signal"].dims == ("signal.time", "dim_1")
+            assert ds["events"].dims == ("onset",)
+            assert ds["ranged"].dims == ("ranged.time",)
+            assert ds["signal"].attrs["units"] == "mV"
+            time = ds["signal.time"]
+            assert time.attrs["units"] == "s"
+            assert type(ds.xindexes["signal.time"]).__name__ == \
+                "SampledIndex"
+            np.testing.assert_allclose(time[[0, -1]], [1.0, 20.999])
+            assert list(ds["dim_1"].values) == ["a", "b", "c"]
+            np.testing.assert_array_equal(ds["ranged.time"],
+                                          [0.0, 1.0, 4.0, 9.0])
+            np.testing.assert_array_equal(ds["onset"], ds["events"])
+            np.testing.assert_array_equal(ds["calibrated"],
+                                          np.arange(6) * 2.0 + 1.0)
+            np.testing.assert_array_equal(ds["signal"], self.values)
+        with xr.open_dataset(self.path, engine="nix", block="empty") as ds:
+            assert not ds.data_vars
+        with xr.open_dataset(self.path, engine="nix",
+                             drop_variables=["signal"]) as ds:
+            assert "signal" not in ds
+
+    def test_select(self):
+        with xr.open_dataset(self.path, engine="nix") as ds:
+            window = ds["signal"].sel({"signal.time": slice(2.0, 2.5),
+                                       "dim_1": "b"})
+            # both ends are included
+            np.testing.assert_array_equal(window,
+                                          self.values[1000:1501, 1])
+            np.testing.assert_allclose(window["signal.time"][[0, -1]],
+                                       [2.0, 2.5])
+            assert type(window.xindexes["signal.time"]).__name__ == \
+                "SampledIndex"
+            nearest = ds["signal"].sel({"signal.time": [1.0004, 3.0]})
+            np.testing.assert_array_equal(nearest,
+                                          self.values[[0, 2000]])
+            # only the chunks of the window are read
+            with Recorder("root") as recorder:
+                ds["signal"].sel({"signal.time": slice(5.0, 5.1)}).values
+            nbytes = {entry["name"]: entry["bytes"]
+                      for entry in recorder.summary()}["root"]
+            assert 0 < nbytes < self.values.nbytes / 10
+
+    def test_lazy_ticks(self):
+        with xr.open_dataset(self.path, engine="nix",
+                             create_default_indexes=False) as ds:
+            assert "ranged.time" not in ds.xindexes
+            assert "signal.time" in ds.xindexes
+            np.testing.assert_array_equal(ds["ranged.time"][1:3],
+                                          [1.0, 4.0])
@@ -0,0 +1,284 @@
+"""
+xarray_backend.py
+
+Open the DataArrays of a NIX file as a lazy xarray.Dataset.
+
+    import xarray as xr
+
+    ds = xr.open_dataset("recording.nix", engine="nix", block="session")
+    ds["signal"].sel(time=slice(10.0, 12.5)).values
+
+The backend is registered as the 'nix' engine in the 'xarray.backends'
+entry points of nixworks.  Every numeric DataArray of a block becomes a
+data variable (the first block unless 'block' gives a name or an index).
+Nothing is read on opening apart from the metadata; the values are read
+through xarray's lazy indexing adapters, so a selection reads only the
+HDF5 chunks it touches.  Contiguous datasets are read through a memory map
+(see memmap.py).
+
+The dimensions are named after the labels of the NIX dimensions ('dim_<i>'
+for dimensions without label).  If DataArrays of the block disagree about a
+dimension of the same name (other sampling interval, offset or length), it
+is prefixed with the name of the DataArray: '<array>.<label>'.
+
+- Sampled dimensions get a computed coordinate (offset + i * interval)
+  with a RangeIndex, so no tick array is ever built.  Label selections
+  with slices include both ends, e.g. 'sel(time=slice(1.0, 2.0))'; single
+  values and lists select the nearest sample.
+- Range dimensions get a coordinate backed by their ticks (or by the data
+  itself for alias range dimensions).  The ticks are read when xarray builds
+  the default index of the coordinate; pass 'create_default_indexes=False'
+  to 'open_dataset' to keep them on disk.
+- Set dimensions with labels get a string coordinate, those without none.
+
+Units, labels, types and definitions are stored in the attributes of the
+variables and coordinates.
+"""
+import os
+import math
+
+import numpy as np
+import nixio as nix
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.backends.file_manager import CachingFileManager
+from xarray.backends.locks import SerializableLock
+from xarray.core import indexing
+
+from .memmap import data_view
+
+try:
+    from xarray.indexes import RangeIndex
+    from xarray.core.indexing import IndexSelResult
+except ImportError:
+    RangeIndex = None
+
+NIX_LOCK = SerializableLock()
+EXTENSIONS = (".nix", ".h5")
+
+
+def numeric(data_array):
+    """True if the DataArray holds numbers (or booleans)."""
+    return data_array.dtype.kind in "biuf"
+
+
+def dimension_spec(data_array, index):
+    """
+    The properties that make two dimensions the same, to decide whether
+    DataArrays can share a dimension name.
+    """
+    dim = data_array.dimensions[index]
+    size = data_array.shape[index]
+    if dim.dimension_type == nix.DimensionType.Sample:
+        return ("sample", size, dim.sampling_interval, dim.offset or 0.0,
+                dim.unit)
+    if dim.dimension_type == nix.DimensionType.Range:
+        if dim.is_alias:
+            return ("range", size, data_array.id)
+        return ("range", size, dim._h5group.group.name, dim.unit)
+    return ("set", size, tuple(dim.labels))
+
+
+def dimension_label(data_array, index):
+    """Label of a dimension of a DataArray, or 'dim_<index>'."""
+    if index < len(data_array.dimensions):
+        dim = data_array.dimensions[index]
+        if dim.dimension_type != nix.DimensionType.Set and dim.label:
+            return dim.label
+    return "dim_{}".format(index)
+
+
+def dimension_names(data_arrays):
+    """
+    Dimension names of all DataArrays (a list of names per DataArray),
+    prefixing names that do not mean the same in all DataArrays.
+    """
+    specs = {}
+    for da in data_arrays:
+        for index in range(len(da.shape)):
+            label = dimension_label(da, index)
+            if index < len(da.dimensions):
+                spec = dimension_spec(da, index)
+            else:
+                spec = ("none", da.shape[index])
+            specs.setdefault(label, set()).add(spec)
+    names = []
+    for da in data_arrays:
+        labels = [dimension_label(da, index) for index in range(len(da.shape))]
+        names.append(tuple(label if len(specs[label]) == 1
+                           else "{}.{}".format(da.name, label)
+                           for label in labels))
+    return names
+
+
+def dimension_attrs(dim):
+    """Attributes of the coordinate of a sampled or range dimension."""
+    attrs = {}
+    if dim.label:
+        attrs["long_name"] = dim.label
+    if dim.unit:
+        attrs["units"] = dim.unit
+    return attrs
+
+
+if RangeIndex is not None:
+    class SampledIndex(RangeIndex):
+        """
+        RangeIndex of a sampled dimension.  Slices of labels select all
+        samples between (and including) their ends without rounding, other
+        labels the nearest samples.
+        """
+
+        def sel(self, labels, method=None, tolerance=None):
+            label = labels[self.dim]
+            if isinstance(label, slice) and label.step is None and \
+                    method is None:
+                start, stop = 0, self.size
+                if label.start is not None:
+                    start = math.ceil((label.start - self.start) / self.step)
+                if label.stop is not None:
+                    stop = math.floor(
+                        (label.stop - self.start) / self.step) + 1
+                start = min(max(start, 0), self.size)
+                stop = min(max(stop, start), self.size)
+                return IndexSelResult({self.dim: slice(start, stop)})
+            return super().sel(labels, method="nearest",
+                               tolerance=tolerance)
+
+        def isel(self, indexers):
+            index = super().isel(indexers)
+            if type(index) is RangeIndex:
+                return type(self)(index.transform)
+            return index
+
+
+def sampled_coordinates(dim, size, name):
+    """Coordinates of a sampled dimension, computed on access."""
+    offset = dim.offset or 0.0
+    interval = dim.sampling_interval
+    if RangeIndex is None:
+        values = xr.Variable(name, offset + np.arange(size) * interval)
+        coords = xr.Coordinates({name: values})
+    else:
+        index = SampledIndex.linspace(offset, offset + size * interval, size,
+                                      endpoint=False, coord_name=name,
+                                      dim=name)
+        coords = xr.Coordinates.from_xindex(index)
+    coords.variables[name].attrs.update(dimension_attrs(dim))
+    return coords
+
+
+class NixBackendArray(BackendArray):
+    """
+    Lazily indexed values of a DataArray ('ticks' for the ticks of a range
+    dimension).
+    """
+
+    def __init__(self, manager, block, name, shape, dtype, lock,
+                 ticks=None):
+        self.manager = manager
+        self.block = block
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.lock = lock
+        self.ticks = ticks
+
+    def source(self, nixfile):
+        """
+        The array to read from and the indexing it supports: calibrated
+        DataArrays are read through nixio, which applies the calibration.
+        """
+        da = nixfile.blocks[self.block].data_arrays[self.name]
+        if self.ticks is not None:
+            ticks = da.dimensions[self.ticks]._h5group.group["ticks"]
+            return ticks, indexing.IndexingSupport.OUTER_1VECTOR
+        view = data_view(da)
+        if view is da:
+            if len(da.polynom_coefficients) or da.expansion_origin:
+                return da, indexing.IndexingSupport.BASIC
+            view = da._h5group.group["data"]
+        return view, indexing.IndexingSupport.OUTER_1VECTOR
+
+    def __getitem__(self, key):
+        with self.lock:
+            source, support = self.source(self.manager.acquire())
+            return indexing.explicit_indexing_adapter(
+                key, self.shape, support,
+                lambda key: np.asarray(source[key], dtype=self.dtype))
+
+
+class NixBackendEntrypoint(BackendEntrypoint):
+    """xarray backend for NIX files (engine 'nix')."""
+
+    description = "Open the DataArrays of a block of a NIX file"
+    url = "https://github.com/G-Node/nixworks"
+    open_dataset_parameters = ("filename_or_obj", "drop_variables", "block")
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            _, ext = os.path.splitext(os.fspath(filename_or_obj))
+        except TypeError:
+            return False
+        return ext.lower() in EXTENSIONS
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None,
+                     block=None):
+        filename = os.fspath(filename_or_obj)
+        manager = CachingFileManager(
+            nix.File.open, filename, kwargs={"mode": nix.FileMode.ReadOnly})
+        with NIX_LOCK:
+            nixfile = manager.acquire()
+            if block is None:
+                block = 0
+            nixblock = nixfile.blocks[block]
+            dataset = read_block(nixblock, manager, NIX_LOCK,
+                                 set(drop_variables or ()))
+        dataset.set_close(manager.close)
+        return dataset
+
+
+def read_block(block, manager, lock, drop_variables):
+    """The lazy xarray.Dataset of the numeric DataArrays of a block."""
+    data_arrays = [da for da in block.data_arrays
+                   if numeric(da) and da.name not in drop_variables]
+    names = dimension_names(data_arrays)
+    # the coordinates of range dimensions get no index here, xarray
+    # creates the default indexes after opening unless told not to
+    coords = {}
+    indexes = {}
+    variables = {}
+    for da, dims in zip(data_arrays, names):
+        for index, dim in enumerate(list(da.dimensions)[:len(dims)]):
+            name = dims[index]
+            if name in coords:
+                continue
+            size = da.shape[index]
+            if dim.dimension_type == nix.DimensionType.Sample:
+                sampled = sampled_coordinates(dim, size, name)
+                coords.update(sampled.variables)
+                indexes.update(sampled.xindexes)
+            elif dim.dimension_type == nix.DimensionType.Range:
+                ticks = None if dim.is_alias else index
+                dtype = da.dtype if dim.is_alias else np.dtype(float)
+                values = NixBackendArray(manager, block.name, da.name,
+                                         (size,), dtype, lock, ticks)
+                coords[name] = xr.Variable(
+                    name, indexing.LazilyIndexedArray(values),
+                    dimension_attrs(dim))
+            elif dim.labels:
+                coords[name] = xr.Variable(name, np.array(dim.labels))
+        dtype = da.dtype
+        if len(da.polynom_coefficients) or da.expansion_origin:
+            dtype = np.dtype(float)
+        values = NixBackendArray(manager, block.name, da.name, da.shape,
+                                 dtype, lock)
+        attrs = {"type": da.type}
+        for key, attr in (("units", da.unit), ("long_name", da.label),
+                          ("definition", da.definition)):
+            if attr:
+                attrs[key] = attr
+        variables[da.name] = xr.Variable(
+            dims, indexing.LazilyIndexedArray(values), attrs)
+    return xr.Dataset(variables, coords=xr.Coordinates(coords, indexes),
+                      attrs={"block": block.name, "block_type": block.type})
@@ -11,8 +11,7 @@ with open('LICENSE') as f:
 classifiers = [
     'Development Status :: 4 - Beta',
     'Programming Language :: Python',
-    'Programming Language :: Python :: 2.7',
-    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3',
     'Programming Language :: Python :: 3.7',
     'Topic :: Scientific/Engineering'
 ]
@@ -38,13 +37,23 @@ setup(
     long_description_content_type='text/markdown',
     classifiers=classifiers,
     license='BSD',
-    packages=['nixworks.plotter', 'nixworks.table'],
+    packages=['nixworks', 'nixworks.plotter', 'nixworks.table',
+              'nixworks.converters', 'nixworks.converters.mne',
+              'nixworks.converters.nwb'],
     scripts=[],
+    entry_points={
+        'console_scripts': ['nixworks = nixworks.cli:main'],
+        'xarray.backends': [
+            'nix = nixworks.xarray_backend:NixBackendEntrypoint'],
+    },
     tests_require=['pytest'],
     test_suite='pytest',
     setup_requires=['pytest-runner'],
+    python_requires='>=3.7',
     install_requires=['nixio'],
-    package_data={'nixworks': [license_text, description_text]},
+    extras_require={'xarray': ['xarray'],
+                    'dask': ['dask[array,dataframe]']},
+    package_data={'nixworks': ['info.json', license_text, description_text]},
     include_package_data=True,
     zip_safe=False,
 )